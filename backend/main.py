@@ -1,24 +1,74 @@
 from pathlib import Path
 import shutil
 import os
+import asyncio
+import json
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 import uvicorn
 from pydantic import BaseModel, HttpUrl
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from backend.utils.pdf_processor_open_source import process_pdf_with_open_source
-from backend.utils.web_processor_open_source import scrape_website
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi import Query
-from backend.utils.pdf_processor_docling import process_pdf_with_docling
-from backend.utils.web_processor_docling import process_html_with_docling
-import io
 from datetime import datetime
-from backend.utils.s3 import upload_to_s3, get_from_s3
+from backend.utils.storage import get_storage, upload_file
+from backend.utils.document_buffer import DocumentBuffer
+from backend.utils.metrics import track_request, track_stage, render_metrics
+from backend.utils.profiling import PROFILING_ENABLED, profiling_requested, run_profiled, store_profile
+from backend.utils.admission import AdmissionRejected, get_limiter, admission_snapshot
+from backend.utils.single_flight import SingleFlight, normalize_url
+from backend.utils.web_cache import web_result_cache
+from backend.utils.search_index import SEARCH_INDEX_ENABLED, get_search_index
+from backend.utils.docling_export import validate_formats
+from backend.utils.direct_upload import presign_pdf_upload, complete_pdf_upload, read_uploaded_pdf, parse_raw_pdf_key
 import logging
-from backend.utils.pdf_processor_enterprise import process_pdf_with_enterprise
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-from backend.utils.web_processor_enterprise import scrape_website_with_pdf
+
+# Batch ingestion: documents processed at once, which is also the most a batch has queued or running
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", 4))
+# ZIP members larger than this, or expanding more than this ratio, are rejected unread
+BATCH_MAX_MEMBER_BYTES = int(os.getenv("BATCH_MAX_MEMBER_BYTES", 256 * 1024 * 1024))
+BATCH_MAX_COMPRESSION_RATIO = float(os.getenv("BATCH_MAX_COMPRESSION_RATIO", 100))
+# Long-lived pool so processors stay warm across batches
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="pdf-batch")
+
+def get_pdf_processor(category: str):
+    """Import and return the PDF processor for a category on first use"""
+    category = category.lower()
+    if category == "open source":
+        from backend.utils.pdf_processor_open_source import process_pdf_with_open_source
+        return process_pdf_with_open_source
+    elif category == "docling":
+        from backend.utils.pdf_processor_docling import process_pdf_with_docling
+        return process_pdf_with_docling
+    elif category == "enterprise":
+        from backend.utils.pdf_processor_enterprise import process_pdf_with_enterprise
+        return process_pdf_with_enterprise
+    return None
+
+def get_web_processor(category: str):
+    """Import and return the website processor for a category on first use"""
+    category = category.lower()
+    if category == "open source":
+        from backend.utils.web_processor_open_source import scrape_website
+        return scrape_website
+    elif category == "docling":
+        from backend.utils.web_processor_docling import process_html_with_docling
+        return process_html_with_docling
+    elif category == "enterprise":
+        from backend.utils.web_processor_enterprise import scrape_website_with_pdf
+        return scrape_website_with_pdf
+    return None
+
+# Concurrent identical requests share one run
+in_flight_requests = SingleFlight()
 
 app = FastAPI()
 # Configure CORS
@@ -30,88 +80,456 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def schedule_storage_check():
+    # Check the storage backend once in the background so startup is not blocked on S3
+    asyncio.get_running_loop().run_in_executor(None, get_storage().verify)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request, exc: AdmissionRejected):
+    # Fast rejection so clients back off instead of piling more work onto a full queue
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 class WebsiteURL(BaseModel):
     url: HttpUrl
     category: str
+
+class UploadRequest(BaseModel):
+    filename: str
+    size: int
+
+class UploadPart(BaseModel):
+    part_number: int
+    etag: str
+
+class CompleteUploadRequest(BaseModel):
+    key: str
+    upload_id: str
+    parts: List[UploadPart]
+
+class StoredPDF(BaseModel):
+    key: str
+    category: str
+    lineage: Optional[str] = None
+    formats: Optional[List[str]] = None
     
+def make_document_id(filename: str, unique: bool = False) -> str:
+    """Generate a document ID from the original filename and timestamp"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    document_id = f"{Path(filename).stem}_{timestamp}"
+    # Batches can contain the same filename several times within one second
+    return f"{document_id}_{uuid.uuid4().hex[:8]}" if unique else document_id
+
+def process_pdf_document(document: DocumentBuffer, filename: str, category: str, document_id: str = None, profile: bool = False, lineage: str = None, stored: bool = False, formats: list = None) -> dict:
+    """
+    Upload the original PDF to storage and run the category's processor on it.
+
+    The same immutable buffer feeds the raw upload and the processor, so the
+    document is held in memory once per request. ``lineage`` names the document
+    this upload revises (default: the filename without extension); unchanged pages
+    of its previous revision are reused. With ``profile`` the processor runs under
+    cProfile and the result gains a ``profile`` entry with the URLs of the stored
+    profile. ``stored`` means the PDF was uploaded to its raw key directly by the
+    client, so it is not uploaded again. ``formats`` asks the Docling processor for
+    outputs beyond markdown.
+    """
+    processor = get_pdf_processor(category)
+    if processor is None:
+        raise ValueError("Invalid category: " + category)
+    document_id = document_id or make_document_id(filename)
+
+    with track_request("pdf", category):
+        # First, upload the original PDF to storage
+        pdf_key = f"pdf_sources/raw/{document_id}/{filename}"
+        if not stored:
+            logger.info(f"Uploading original PDF to storage: {pdf_key}")
+            
+            with track_stage("api", "raw_upload"):
+                upload_file(
+                    document.data, 
+                    pdf_key, 
+                    content_type='application/pdf'
+                )
+            
+            logger.info("PDF uploaded successfully, now processing...")
+        
+        # Process from the buffer we already hold instead of reading it back from storage
+        pdf_buffer = document.open()
+        options = {'lineage': lineage}
+        if set(formats or []) - {"markdown"}:
+            options['formats'] = formats
+        try:
+            if not profile:
+                return processor(pdf_buffer, document_id, filename, **options)
+            result, profiler = run_profiled(processor, pdf_buffer, document_id, filename, **options)
+            result['profile'] = store_profile(profiler, "pdf", document_id)
+            return result
+        finally:
+            pdf_buffer.close()
+
+def check_formats(formats: Optional[List[str]], category: str) -> list:
+    """Validate requested output formats; only Docling exports more than markdown"""
+    try:
+        formats = validate_formats(formats)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if category.lower() != "docling" and set(formats) - {"markdown"}:
+        raise HTTPException(status_code=400, detail="Only the docling category exports formats other than markdown")
+    return formats
+
+def check_profiling(profile: bool, x_profile: Optional[str]) -> bool:
+    """Resolve whether to profile this request; refuses when profiling is disabled"""
+    if not profiling_requested(profile, x_profile):
+        return False
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiling is disabled on this deployment")
+    return True
+
 @app.post("/process-pdf/")
 async def process_pdf(
     file: UploadFile = File(...),
-    category: str = Query(..., description="Processing category (opensource/docling/enterprise)")
+    category: str = Query(..., description="Processing category (opensource/docling/enterprise)"),
+    profile: bool = Query(False, description="Profile this request (requires PROFILING_ENABLED)"),
+    lineage: Optional[str] = Query(None, description="Client-chosen id shared by revisions of a document; pages are cached only when given"),
+    formats: Optional[List[str]] = Query(None, description="Docling only: further outputs exported from the same conversion (json, html, text)"),
+    x_profile: Optional[str] = Header(None)
 ):
+    if get_pdf_processor(category) is None:
+        raise HTTPException(status_code=400, detail="Invalid category: " + category)
+    formats = check_formats(formats, category)
+    profile = check_profiling(profile, x_profile)
+    # Read file content once; every stage shares this buffer
+    document = await DocumentBuffer.from_upload(file)
+    # The same bytes under the same name and options produce the same result
+    key = ("pdf", await run_in_threadpool(document.sha256), file.filename, category.lower(), profile, lineage, tuple(formats))
+
+    async def run():
+        async with get_limiter(category).admit():
+            return await run_in_threadpool(process_pdf_document, document, file.filename, category, profile=profile, lineage=lineage, formats=formats)
+
     try:
-        # Generate unique document ID using original filename and timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        base_name = Path(file.filename).stem
-        document_id = f"{base_name}_{timestamp}"
-        
-        # Read file content
-        file_content = await file.read()
-        
-        # First, upload the original PDF to S3
-        pdf_key = f"pdf_sources/raw/{document_id}/{file.filename}"
-        logger.info(f"Uploading original PDF to S3: {pdf_key}")
-        
-        upload_to_s3(
-            file_content, 
-            pdf_key, 
-            content_type='application/pdf'
-        )
-        
-        logger.info("PDF uploaded successfully, now processing...")
-        
-        # Get the PDF from S3 for processing
-        pdf_content = get_from_s3(pdf_key)
-        pdf_buffer = io.BytesIO(pdf_content)
-        
-        # Process based on category
-        if category.lower() == "open source":
-            result = process_pdf_with_open_source(pdf_buffer, document_id, file.filename)
-        elif category.lower() == "docling":
-            result = process_pdf_with_docling(pdf_buffer, document_id, file.filename)
-        elif category.lower() == "enterprise":
-            result = process_pdf_with_enterprise(pdf_buffer, document_id, file.filename)
+        result = await in_flight_requests.run(key, run, "pdf", category)
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing PDF: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "status": "success",
+        "message": f"PDF processed using {category} method",
+        "data": result
+    }
+
+@app.post("/uploads/presign")
+async def presign_upload(upload: UploadRequest):
+    """
+    Presigned URL(s) for uploading a PDF straight to the bucket.
+
+    Small files get a single PUT URL; files larger than the part size get a multipart
+    upload with one URL per part, finished with /uploads/complete. Either way, pass the
+    returned key to /process-pdf-by-key/ once the upload is done.
+    """
+    try:
+        return await run_in_threadpool(presign_pdf_upload, upload.filename, upload.size, make_document_id(upload.filename))
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/uploads/complete")
+async def complete_upload(upload: CompleteUploadRequest):
+    """Assemble a multipart upload from the ETags the part uploads returned"""
+    parts = [(part.part_number, part.etag) for part in upload.parts]
+    try:
+        await run_in_threadpool(complete_pdf_upload, upload.key, upload.upload_id, parts)
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to complete upload: {str(e)}")
+    return {"status": "success", "key": upload.key}
+
+@app.post("/process-pdf-by-key/")
+async def process_pdf_by_key(
+    stored_pdf: StoredPDF,
+    profile: bool = Query(False, description="Profile this request (requires PROFILING_ENABLED)"),
+    x_profile: Optional[str] = Header(None)
+):
+    """Process a PDF the client already uploaded with a presigned URL"""
+    category = stored_pdf.category
+    if get_pdf_processor(category) is None:
+        raise HTTPException(status_code=400, detail="Invalid category: " + category)
+    try:
+        document_id, filename = parse_raw_pdf_key(stored_pdf.key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    formats = check_formats(stored_pdf.formats, category)
+    profile = check_profiling(profile, x_profile)
+    # Each presigned upload has its own key, so the key identifies the bytes
+    key = ("pdf-key", stored_pdf.key, category.lower(), profile, stored_pdf.lineage, tuple(formats))
+
+    def read_and_process():
+        document = read_uploaded_pdf(stored_pdf.key)
+        return process_pdf_document(document, filename, category, document_id, profile=profile, lineage=stored_pdf.lineage, stored=True, formats=formats)
+
+    async def run():
+        async with get_limiter(category).admit():
+            return await run_in_threadpool(read_and_process)
+
+    try:
+        result = await in_flight_requests.run(key, run, "pdf", category)
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing stored PDF: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "status": "success",
+        "message": f"PDF processed using {category} method",
+        "data": result
+    }
+
+@app.post("/export-docling/{document_id}")
+async def export_docling(
+    document_id: str,
+    formats: List[str] = Query(..., description="Outputs to export: markdown, json, html, text")
+):
+    """Export more formats of a PDF already converted with Docling, without converting it again"""
+    formats = check_formats(formats, "docling")
+    if not formats:
+        raise HTTPException(status_code=400, detail="No formats requested")
+    from backend.utils.docling_export import export_stored_document
+    try:
+        exports = await run_in_threadpool(export_stored_document, document_id, formats)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error exporting Docling document: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "status": "success",
+        "message": f"Exported {', '.join(formats)} from the stored Docling document",
+        "data": {"document_id": document_id, "urls": {"exports": exports}}
+    }
+
+def read_upload(fileobj) -> bytes:
+    fileobj.seek(0)
+    return fileobj.read()
+
+def check_zip_member(member: zipfile.ZipInfo) -> None:
+    """Reject a ZIP member whose declared size or compression ratio is over the batch limits"""
+    # zipfile stops decompressing at the declared size, so it bounds what read() returns
+    if member.file_size > BATCH_MAX_MEMBER_BYTES:
+        raise ValueError(f"ZIP member is {member.file_size} bytes, over the {BATCH_MAX_MEMBER_BYTES}-byte limit")
+    ratio = member.file_size / max(member.compress_size, 1)
+    if ratio > BATCH_MAX_COMPRESSION_RATIO:
+        raise ValueError(f"ZIP member expands {ratio:.0f}x, over the {BATCH_MAX_COMPRESSION_RATIO:g}x limit")
+
+def iter_batch_documents(files):
+    """
+    Yield (filename, load) pairs for every PDF in the uploaded files.
+
+    Nothing is read up front: ``load`` reads a PDF, or one member of a ZIP archive
+    opened in place, from its spooled upload only when a worker picks the document up.
+    Only the documents being processed are ever held in memory, and ZIP members over
+    the size or compression-ratio limits are reported as errors without being read.
+    """
+    for upload in files:
+        filename, fileobj = upload.filename, upload.file
+        if filename.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(fileobj)
+            except zipfile.BadZipFile as e:
+                def load(error=e):
+                    raise ValueError(f"Invalid ZIP archive: {error}")
+                yield filename, load
+                continue
+            for member in archive.infolist():
+                member_name = Path(member.filename)
+                if member.is_dir() or member_name.suffix.lower() != '.pdf' or '__MACOSX' in member_name.parts:
+                    continue
+                try:
+                    check_zip_member(member)
+                except ValueError as e:
+                    def load(error=e):
+                        raise error
+                    yield member_name.name, load
+                    continue
+                yield member_name.name, lambda archive=archive, member=member: archive.read(member)
         else:
-            raise HTTPException(status_code=400, detail="Invalid category: " + category)
-        
+            yield filename, lambda fileobj=fileobj: read_upload(fileobj)
+
+def process_batch_document(filename: str, load, category: str) -> dict:
+    """Load and process one batch document, reporting its outcome instead of raising"""
+    started = time.perf_counter()
+    document_id = make_document_id(filename, unique=True)
+    document = DocumentBuffer(b"")
+    try:
+        document = DocumentBuffer(load(), filename)
+        result = process_pdf_document(document, filename, category, document_id)
         return {
+            "filename": filename,
             "status": "success",
-            "message": f"PDF processed using {category} method",
-            "data": result
+            "document_id": document_id,
+            "urls": result.get("urls"),
+            "metadata": result.get("metadata"),
+            "bytes": len(document),
+            "seconds": round(time.perf_counter() - started, 3)
         }
-        
     except Exception as e:
-        logger.error(f"Error processing PDF: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if 'pdf_buffer' in locals():
-            pdf_buffer.close()
+        logger.error(f"Error processing {filename} in batch: {str(e)}", exc_info=True)
+        return {
+            "filename": filename,
+            "status": "error",
+            "document_id": document_id,
+            "error": str(e),
+            "bytes": len(document),
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+
+@app.post("/process-pdf-batch/")
+async def process_pdf_batch(
+    files: List[UploadFile] = File(...),
+    category: str = Query(..., description="Processing category (opensource/docling/enterprise)")
+):
+    """
+    Process many PDFs (or ZIP archives of PDFs) in one request.
+
+    Documents are processed on a bounded worker pool and each result is streamed back as
+    one JSON line as soon as it completes, followed by a summary line with the batch's
+    aggregate throughput.
+    """
+    if get_pdf_processor(category) is None:
+        raise HTTPException(status_code=400, detail="Invalid category: " + category)
+
+    async def stream_results():
+        # Uploaded files stay open until the response has been sent
+        loop = asyncio.get_running_loop()
+        limiter = get_limiter(category)
+        documents = iter_batch_documents(files)
+
+        async def run_document(filename, load):
+            # Batch documents share the category's slots but wait apart from, and are never
+            # counted against, the interactive queue
+            async with limiter.admit(reject_when_full=False):
+                return await loop.run_in_executor(batch_executor, process_batch_document, filename, load, category)
+
+        pending = set()
+        succeeded = failed = total_bytes = 0
+        started = time.perf_counter()
+
+        while True:
+            # Submit documents one at a time, at most BATCH_MAX_WORKERS queued or running
+            for filename, load in documents:
+                pending.add(asyncio.ensure_future(run_document(filename, load)))
+                if len(pending) >= BATCH_MAX_WORKERS:
+                    break
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                outcome = future.result()
+                if outcome["status"] == "success":
+                    succeeded += 1
+                else:
+                    failed += 1
+                total_bytes += outcome["bytes"]
+                yield json.dumps({"type": "document", **outcome}) + "\n"
+
+        elapsed = time.perf_counter() - started
+        yield json.dumps({
+            "type": "summary",
+            "category": category,
+            "documents": succeeded + failed,
+            "succeeded": succeeded,
+            "failed": failed,
+            "bytes": total_bytes,
+            "elapsed_seconds": round(elapsed, 3),
+            "documents_per_second": round((succeeded + failed) / elapsed, 3) if elapsed else None,
+            "megabytes_per_second": round(total_bytes / 1024 / 1024 / elapsed, 3) if elapsed else None
+        }) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+def process_website_url(url: str, category: str, profile: bool = False) -> dict:
+    """
+    Run the category's website processor, optionally under the profiler.
+
+    Unprofiled runs go through the result cache, so an unchanged page is answered
+    from its previous result after a conditional GET.
+    """
+    processor = get_web_processor(category)
+    with track_request("web", category):
+        if not profile:
+            return web_result_cache.get_or_process(url, category, processor)
+        result, profiler = run_profiled(processor, url)
+        result['profile'] = store_profile(profiler, "web", result['document_id'])
+        return result
 
 # Process a website URL and extract its content
 @app.post("/process-website/")
-async def process_website(website: WebsiteURL):
+async def process_website(
+    website: WebsiteURL,
+    profile: bool = Query(False, description="Profile this request (requires PROFILING_ENABLED)"),
+    x_profile: Optional[str] = Header(None)
+):
+    if get_web_processor(website.category) is None:
+        raise HTTPException(status_code=400, detail="Invalid category")
+    profile = check_profiling(profile, x_profile)
+    key = ("web", normalize_url(str(website.url)), website.category.lower(), profile)
+
+    async def run():
+        async with get_limiter(website.category).admit():
+            return await run_in_threadpool(process_website_url, str(website.url), website.category, profile)
+
     try:
-        if website.category.lower() == "open source":
-            result = scrape_website(str(website.url))
-        elif website.category.lower() == "docling":
-            result = process_html_with_docling(str(website.url))
-        elif website.category.lower() == "enterprise":
-            result = scrape_website_with_pdf(str(website.url))
-        else:
-            raise HTTPException(status_code=400, detail="Invalid category")
-        
-        return {
-                "status": "success",
-                "message": "Website processed using " + website.category,
-                "data": result
-        }
-            
+        result = await in_flight_requests.run(key, run, "web", website.category)
+    except AdmissionRejected:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
-   
+
+    return {
+        "status": "success",
+        "message": "Website processed using " + website.category,
+        "data": result
+    }
+
+@app.get("/search")
+async def search(
+    q: str = Query(..., min_length=1, description="Words to find; every word must appear on the page, word* matches a prefix"),
+    limit: int = Query(10, ge=1, le=100),
+    source_type: Optional[str] = Query(None, description="Only pdf or web documents")
+):
+    """Ranked documents whose extracted markdown matches the query, with page numbers and snippets"""
+    if not SEARCH_INDEX_ENABLED:
+        raise HTTPException(status_code=503, detail="Search is disabled on this deployment; set SEARCH_INDEX_PATH to enable it")
+    try:
+        results = await run_in_threadpool(get_search_index().search, q, limit, source_type)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+    return {"query": q, "results": results}
+
+@app.get("/admission")
+async def admission_status():
+    """Per-category concurrency and queue depth, for monitoring"""
+    return admission_snapshot()
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 @app.get("/test-s3-connection")
 async def test_connection():
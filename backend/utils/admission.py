@@ -0,0 +1,120 @@
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from backend.utils.metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_IN_FLIGHT, ADMISSION_WAIT, ADMISSION_REJECTIONS
+
+# Defaults reflect relative memory cost: Docling loads OCR/layout models, enterprise mostly waits on Azure
+DEFAULT_CONCURRENCY = {"open source": 8, "docling": 1, "enterprise": 4}
+DEFAULT_QUEUE = {"open source": 32, "docling": 4, "enterprise": 16}
+
+def _parse_limits(value: str, defaults: dict) -> dict:
+    """Parse "docling=2,enterprise=8" on top of the defaults"""
+    limits = dict(defaults)
+    for item in (value or "").split(","):
+        if "=" in item:
+            category, limit = item.split("=", 1)
+            limits[category.strip().lower()] = int(limit)
+    return limits
+
+CONCURRENCY_LIMITS = _parse_limits(os.getenv("CONCURRENCY_LIMITS"), DEFAULT_CONCURRENCY)
+QUEUE_LIMITS = _parse_limits(os.getenv("QUEUE_LIMITS"), DEFAULT_QUEUE)
+
+class AdmissionRejected(Exception):
+    """Raised when a category's wait queue is full"""
+
+    def __init__(self, category: str, retry_after: int):
+        super().__init__(f"Too many {category} requests in progress, retry in {retry_after}s")
+        self.category = category
+        self.retry_after = retry_after
+
+class CategoryLimiter:
+    """
+    Concurrency limit with a bounded wait queue for one processing category.
+
+    Must be used from the event loop thread; the counters are not locked.
+    """
+
+    def __init__(self, category: str, max_concurrent: int, max_queue: int):
+        self.category = category
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.waiting = 0
+        # Batch jobs wait apart from interactive requests so they never fill max_queue
+        self.batch_waiting = 0
+        self.in_flight = 0
+        # Moving average of processing time, used to suggest Retry-After
+        self.avg_service_seconds = 5.0
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.avg_service_seconds * (self.waiting + 1) / self.max_concurrent))
+
+    @asynccontextmanager
+    async def admit(self, reject_when_full: bool = True):
+        """
+        Wait for a processing slot.
+
+        When every slot is busy and the queue is full, raises AdmissionRejected
+        immediately unless ``reject_when_full`` is False. Batch jobs pass False: they
+        bound their own fan-out and wait outside the queue, so a running batch never
+        makes interactive requests see a full queue.
+        """
+        if reject_when_full and self.semaphore.locked() and self.waiting >= self.max_queue:
+            ADMISSION_REJECTIONS.labels(self.category).inc()
+            raise AdmissionRejected(self.category, self.retry_after())
+
+        if reject_when_full:
+            self.waiting += 1
+            ADMISSION_QUEUE_DEPTH.labels(self.category).set(self.waiting)
+        else:
+            self.batch_waiting += 1
+        queued = time.perf_counter()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            if reject_when_full:
+                self.waiting -= 1
+                ADMISSION_QUEUE_DEPTH.labels(self.category).set(self.waiting)
+            else:
+                self.batch_waiting -= 1
+        ADMISSION_WAIT.labels(self.category).observe(time.perf_counter() - queued)
+
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.labels(self.category).set(self.in_flight)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.avg_service_seconds = 0.8 * self.avg_service_seconds + 0.2 * (time.perf_counter() - started)
+            self.in_flight -= 1
+            ADMISSION_IN_FLIGHT.labels(self.category).set(self.in_flight)
+            self.semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.waiting,
+            "batch_queued": self.batch_waiting,
+            "avg_service_seconds": round(self.avg_service_seconds, 3)
+        }
+
+_limiters = {}
+
+def get_limiter(category: str) -> CategoryLimiter:
+    """Return the shared limiter for a category, creating it on first use"""
+    category = category.lower()
+    if category not in _limiters:
+        _limiters[category] = CategoryLimiter(
+            category,
+            CONCURRENCY_LIMITS.get(category, DEFAULT_CONCURRENCY["open source"]),
+            QUEUE_LIMITS.get(category, DEFAULT_QUEUE["open source"])
+        )
+    return _limiters[category]
+
+def admission_snapshot() -> dict:
+    """Current concurrency and queue state for every category seen so far"""
+    return {category: limiter.snapshot() for category, limiter in _limiters.items()}
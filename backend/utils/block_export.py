@@ -0,0 +1,144 @@
+import json
+import os
+import tempfile
+from backend.utils.storage import get_storage
+from backend.utils.metrics import BYTES_UPLOADED
+
+# Structured output alongside the markdown: one record per block, as none, jsonl or parquet
+# (parquet needs the pyarrow package; without it JSON lines are written instead)
+STRUCTURED_EXPORT = os.getenv("STRUCTURED_EXPORT", "none").lower()
+# Parquet rows buffered before a row group is written; pages are never split across groups
+STRUCTURED_EXPORT_ROW_GROUP_ROWS = int(os.getenv("STRUCTURED_EXPORT_ROW_GROUP_ROWS", 5000))
+# Spooled exports move from memory to a temporary file beyond this size
+STRUCTURED_EXPORT_SPOOL_BYTES = int(os.getenv("STRUCTURED_EXPORT_SPOOL_BYTES", 16 * 1024 * 1024))
+
+CONTENT_TYPES = {"jsonl": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+
+_pyarrow_warning_shown = False
+
+def export_format():
+    """The structured export format to write, or None when disabled"""
+    global _pyarrow_warning_shown
+    if STRUCTURED_EXPORT not in CONTENT_TYPES:
+        return None
+    if STRUCTURED_EXPORT == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            if not _pyarrow_warning_shown:
+                print("pyarrow is not installed; writing structured export as JSON lines instead")
+                _pyarrow_warning_shown = True
+            return "jsonl"
+    return STRUCTURED_EXPORT
+
+def block_record(block_type: str, bbox=None, text: str = None, cells=None, image_url: str = None) -> dict:
+    """
+    One block of a page.
+
+    ``bbox`` is (x0, y0, x1, y1) in PDF points with the origin at the top left of the
+    page; ``cells`` is a list of cell_record() dicts for tables.
+    """
+    return {
+        "type": block_type,
+        "bbox": [round(float(value), 2) for value in bbox] if bbox is not None else None,
+        "text": text,
+        "cells": cells,
+        "image_url": image_url
+    }
+
+def cell_record(row: int, column: int, text: str, row_span: int = 1, column_span: int = 1) -> dict:
+    return {"row": row, "column": column, "row_span": row_span or 1, "column_span": column_span or 1, "text": text}
+
+def bbox_from_polygon(polygon, scale: float = 1.0):
+    """Bounding box of a polygon given as points with x/y attributes, or None"""
+    if not polygon:
+        return None
+    xs = [point.x * scale for point in polygon]
+    ys = [point.y * scale for point in polygon]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+def _parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("document_id", pa.string()),
+        ("page", pa.int32()),
+        ("block_index", pa.int32()),
+        ("type", pa.string()),
+        ("bbox", pa.list_(pa.float64(), 4)),
+        ("text", pa.string()),
+        ("cells", pa.list_(pa.struct([
+            ("row", pa.int32()),
+            ("column", pa.int32()),
+            ("row_span", pa.int32()),
+            ("column_span", pa.int32()),
+            ("text", pa.string())
+        ]))),
+        ("image_url", pa.string())
+    ])
+
+class BlockWriter:
+    """
+    Streams a document's block records to storage-ready JSON lines or Parquet.
+
+    Pages are written as the processor finishes them: JSON lines immediately, Parquet
+    in row groups of whole pages once STRUCTURED_EXPORT_ROW_GROUP_ROWS rows are
+    buffered. The output is spooled (in memory, then on disk) and uploaded by close().
+    """
+
+    def __init__(self, document_id: str, key_base: str, export: str):
+        self.document_id = document_id
+        self.format = export
+        self.key = f"{key_base}.{export}"
+        self.records = 0
+        self.row_groups = 0
+        self._spool = tempfile.SpooledTemporaryFile(max_size=STRUCTURED_EXPORT_SPOOL_BYTES)
+        self._pending = []
+        self._parquet = None
+        if export == "parquet":
+            import pyarrow.parquet as pq
+            self._schema = _parquet_schema()
+            self._parquet = pq.ParquetWriter(self._spool, self._schema, compression="zstd")
+
+    def write_page(self, page: int, blocks) -> None:
+        rows = [
+            {"document_id": self.document_id, "page": page, "block_index": index, **block}
+            for index, block in enumerate(blocks or [])
+        ]
+        self.records += len(rows)
+        if self._parquet is None:
+            for row in rows:
+                self._spool.write(json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n")
+            return
+        self._pending.extend(rows)
+        if len(self._pending) >= STRUCTURED_EXPORT_ROW_GROUP_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        import pyarrow as pa
+        table = pa.Table.from_pylist(self._pending, schema=self._schema)
+        self._parquet.write_table(table, row_group_size=len(self._pending))
+        self.row_groups += 1
+        self._pending = []
+
+    def close(self) -> dict:
+        """Upload the export and return its summary (format, url, records, row_groups)"""
+        try:
+            if self._parquet is not None:
+                self._flush()
+                self._parquet.close()
+            size = self._spool.tell()
+            self._spool.seek(0)
+            url = get_storage().put_fileobj(self._spool, self.key, CONTENT_TYPES[self.format])
+            BYTES_UPLOADED.labels("blocks").inc(size)
+        except Exception as e:
+            raise Exception(f"Failed to upload structured export: {str(e)}")
+        finally:
+            self._spool.close()
+        return {"format": self.format, "url": url, "records": self.records, "row_groups": self.row_groups}
+
+def open_block_writer(document_id: str, key_base: str):
+    """A BlockWriter for the configured format, or None when structured export is off"""
+    export = export_format()
+    return BlockWriter(document_id, key_base, export) if export else None
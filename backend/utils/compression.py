@@ -0,0 +1,58 @@
+import gzip
+import os
+
+# Compression of stored markdown: none, gzip or zstd (zstd needs the zstandard package,
+# and clients that accept it; requests/urllib3 and browsers decode gzip everywhere)
+MARKDOWN_COMPRESSION = os.getenv("MARKDOWN_COMPRESSION", "none").lower()
+# Smaller documents are stored as-is; compression would save little and cost a round of CPU
+MARKDOWN_COMPRESSION_MIN_BYTES = int(os.getenv("MARKDOWN_COMPRESSION_MIN_BYTES", 64 * 1024))
+MARKDOWN_COMPRESSION_LEVEL = os.getenv("MARKDOWN_COMPRESSION_LEVEL")
+
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+
+def compress(body: bytes, encoding: str, level: int = None) -> bytes:
+    """Compress body with a Content-Encoding algorithm (gzip or zstd)"""
+    level = level if level is not None else DEFAULT_LEVELS[encoding]
+    if encoding == "gzip":
+        # mtime=0 keeps the output deterministic for identical content
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    if encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+def decompress(body: bytes, encoding: str = None) -> bytes:
+    """Undo compress(); bodies without an encoding are returned unchanged"""
+    if not encoding:
+        return body
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+_zstd_warning_shown = False
+
+def markdown_encoding(size: int):
+    """The Content-Encoding to store a markdown body of this size with, or None"""
+    global _zstd_warning_shown
+    if MARKDOWN_COMPRESSION not in DEFAULT_LEVELS or size < MARKDOWN_COMPRESSION_MIN_BYTES:
+        return None
+    if MARKDOWN_COMPRESSION == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            if not _zstd_warning_shown:
+                print("zstandard is not installed; compressing markdown with gzip instead")
+                _zstd_warning_shown = True
+            return "gzip"
+    return MARKDOWN_COMPRESSION
+
+def compress_markdown(body: bytes):
+    """Return (stored_body, content_encoding) for a UTF-8 markdown body"""
+    encoding = markdown_encoding(len(body))
+    if encoding is None:
+        return body, None
+    level = int(MARKDOWN_COMPRESSION_LEVEL) if MARKDOWN_COMPRESSION_LEVEL else None
+    return compress(body, encoding, level), encoding
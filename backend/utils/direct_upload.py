@@ -0,0 +1,67 @@
+import os
+import uuid
+from pathlib import Path
+from backend.utils.storage import get_storage
+from backend.utils.document_buffer import DocumentBuffer
+
+# Clients upload PDFs straight to the bucket through presigned URLs valid this long
+PRESIGNED_UPLOAD_EXPIRES_SECONDS = int(os.getenv("PRESIGNED_UPLOAD_EXPIRES_SECONDS", 900))
+# Larger uploads are split into parts of this size (S3 requires at least 5 MiB per part)
+PRESIGNED_UPLOAD_PART_SIZE = max(int(os.getenv("PRESIGNED_UPLOAD_PART_SIZE", 64 * 1024 * 1024)), 5 * 1024 * 1024)
+PRESIGNED_UPLOAD_MAX_BYTES = int(os.getenv("PRESIGNED_UPLOAD_MAX_BYTES", 1024 * 1024 * 1024))
+
+RAW_PDF_PREFIX = "pdf_sources/raw/"
+
+def raw_pdf_key(document_id: str, filename: str) -> str:
+    """Storage key of an original PDF, the same layout /process-pdf/ uploads to"""
+    return f"{RAW_PDF_PREFIX}{document_id}/{filename}"
+
+def parse_raw_pdf_key(key: str):
+    """Return (document_id, filename) of a raw PDF key; ValueError for anything else"""
+    parts = key[len(RAW_PDF_PREFIX):].split("/") if key.startswith(RAW_PDF_PREFIX) else []
+    if len(parts) != 2 or not all(parts) or ".." in parts or not parts[1].lower().endswith(".pdf"):
+        raise ValueError(f"Not an uploaded PDF: {key}")
+    return parts[0], parts[1]
+
+def presign_pdf_upload(filename: str, size: int, document_id: str) -> dict:
+    """
+    Issue presigned URL(s) for uploading a PDF directly to storage.
+
+    The object lands where /process-pdf/ would have stored it, so /process-pdf-by-key/
+    processes it without the API ever receiving the bytes.
+    """
+    filename = Path(filename).name
+    if not filename.lower().endswith(".pdf"):
+        raise ValueError("Only PDF files can be uploaded")
+    if size <= 0 or size > PRESIGNED_UPLOAD_MAX_BYTES:
+        raise ValueError(f"Upload size must be between 1 and {PRESIGNED_UPLOAD_MAX_BYTES} bytes")
+    # A random suffix keeps presigned keys unguessable and unique per upload
+    document_id = f"{document_id}_{uuid.uuid4().hex[:8]}"
+    key = raw_pdf_key(document_id, filename)
+    upload = get_storage().presign_upload(
+        key,
+        "application/pdf",
+        size,
+        PRESIGNED_UPLOAD_EXPIRES_SECONDS,
+        PRESIGNED_UPLOAD_PART_SIZE
+    )
+    return {
+        "key": key,
+        "document_id": document_id,
+        "expires_in": PRESIGNED_UPLOAD_EXPIRES_SECONDS,
+        **upload
+    }
+
+def complete_pdf_upload(key: str, upload_id: str, parts) -> None:
+    """Finish a multipart PDF upload from its (part_number, etag) pairs"""
+    parse_raw_pdf_key(key)
+    get_storage().complete_upload(key, upload_id, parts)
+
+def read_uploaded_pdf(key: str) -> DocumentBuffer:
+    """Stream an uploaded PDF out of storage into a single in-memory buffer"""
+    _, filename = parse_raw_pdf_key(key)
+    stream = get_storage().open(key)
+    try:
+        return DocumentBuffer.from_stream(stream, filename, max_bytes=PRESIGNED_UPLOAD_MAX_BYTES)
+    finally:
+        stream.close()
@@ -0,0 +1,109 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from backend.utils.storage import get_storage, upload_markdown
+from backend.utils.metrics import BYTES_UPLOADED
+
+# Keep every converted DoclingDocument so other formats can be exported later without
+# reconverting; off by default, since a stored document embeds its page images. Requesting
+# the json format stores the document either way.
+DOCLING_PERSIST_DOCUMENT = os.getenv("DOCLING_PERSIST_DOCUMENT", "false").lower() == "true"
+DOCLING_EXPORT_WORKERS = int(os.getenv("DOCLING_EXPORT_WORKERS", 4))
+# Shared by every conversion; exports only serialize and upload, so threads suffice
+export_executor = ThreadPoolExecutor(max_workers=DOCLING_EXPORT_WORKERS, thread_name_prefix="docling-export")
+
+# Output format: (file extension, content type)
+EXPORT_FORMATS = {
+    "markdown": ("md", "text/markdown"),
+    "json": ("json", "application/json"),
+    "html": ("html", "text/html"),
+    "text": ("txt", "text/plain"),
+}
+
+def validate_formats(formats) -> list:
+    """Lower-case, de-duplicated formats in request order; ValueError for unknown ones"""
+    formats = list(dict.fromkeys(fmt.strip().lower() for fmt in formats or [] if fmt.strip()))
+    unknown = [fmt for fmt in formats if fmt not in EXPORT_FORMATS]
+    if unknown:
+        raise ValueError(f"Unsupported formats: {', '.join(unknown)}; choose from {', '.join(EXPORT_FORMATS)}")
+    return formats
+
+def docling_document_key(document_id: str) -> str:
+    return f"pdf_sources/docling_documents/{document_id}.json"
+
+def serialize(document, fmt: str) -> bytes:
+    """Export a DoclingDocument in one format; images are embedded where the format allows"""
+    from docling_core.types.doc import ImageRefMode
+    if fmt == "markdown":
+        return document.export_to_markdown(image_mode=ImageRefMode.EMBEDDED).encode("utf-8")
+    if fmt == "html":
+        return document.export_to_html(image_mode=ImageRefMode.EMBEDDED).encode("utf-8")
+    if fmt == "text":
+        return document.export_to_text().encode("utf-8")
+    if fmt == "json":
+        return json.dumps(document.export_to_dict()).encode("utf-8")
+    raise ValueError(f"Unsupported format: {fmt}")
+
+def _export(document, fmt: str, key: str) -> str:
+    body = serialize(document, fmt)
+    if fmt == "markdown":
+        return upload_markdown(body.decode("utf-8"), key)
+    url = get_storage().put(key, body, EXPORT_FORMATS[fmt][1])
+    BYTES_UPLOADED.labels("docling_export").inc(len(body))
+    return url
+
+def submit_exports(document, document_id: str, base_name: str, formats, persist: bool = DOCLING_PERSIST_DOCUMENT) -> dict:
+    """
+    Start serializing and uploading each format of one converted document in the background.
+
+    The JSON format is the persisted DoclingDocument itself, so it is uploaded once
+    under the key export_stored_document() reads back. Returns {format: future}.
+    """
+    futures = {}
+    for fmt in formats:
+        if fmt == "json":
+            continue
+        key = f"pdf_sources/docling_exports/{document_id}/{base_name}.{EXPORT_FORMATS[fmt][0]}"
+        futures[fmt] = export_executor.submit(_export, document, fmt, key)
+    if persist or "json" in formats:
+        futures["json"] = export_executor.submit(_export, document, "json", docling_document_key(document_id))
+    return futures
+
+def collect_exports(futures: dict, required=None) -> dict:
+    """
+    Wait for submitted exports and return {format: url}.
+
+    Failures of ``required`` formats (default: all) raise; others, such as persisting a
+    document nobody asked for, are logged and left out.
+    """
+    exports = {}
+    for fmt, future in futures.items():
+        try:
+            exports[fmt] = future.result()
+        except Exception as e:
+            if required is None or fmt in required:
+                raise Exception(f"Failed to export {fmt}: {str(e)}")
+            print(f"Failed to export {fmt}: {str(e)}")
+    return exports
+
+def load_stored_document(document_id: str):
+    """Read back a persisted DoclingDocument; FileNotFoundError when none was stored"""
+    from docling_core.types.doc import DoclingDocument
+    storage = get_storage()
+    key = docling_document_key(document_id)
+    if not storage.exists(key):
+        raise FileNotFoundError(
+            f"No stored Docling document for {document_id}; convert it with the json format "
+            "or with DOCLING_PERSIST_DOCUMENT=true"
+        )
+    return DoclingDocument.model_validate(json.loads(storage.get(key)))
+
+def export_stored_document(document_id: str, formats) -> dict:
+    """Export more formats of an already converted document without running Docling again"""
+    document = load_stored_document(document_id)
+    # JSON is the stored document itself; hand back its URL instead of rewriting it
+    other_formats = [fmt for fmt in formats if fmt != "json"]
+    exports = collect_exports(submit_exports(document, document_id, document.name, other_formats, persist=False))
+    if "json" in formats:
+        exports["json"] = get_storage().url(docling_document_key(document_id))
+    return exports
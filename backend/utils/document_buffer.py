@@ -0,0 +1,67 @@
+import hashlib
+import io
+
+class DocumentBuffer:
+    """
+    Immutable in-memory copy of an uploaded document, shared by every stage of a request.
+
+    The upload is read exactly once. Storage uploads take ``data`` directly, and each
+    processor gets its own reader from ``open()``; ``io.BytesIO`` shares the underlying
+    bytes object until it is written to, so handing out readers does not copy the
+    document, and ``getvalue()`` on those readers returns the same object again.
+    """
+
+    __slots__ = ("_data", "filename", "_sha256")
+
+    def __init__(self, data, filename: str = None):
+        if not isinstance(data, bytes):
+            # bytearray/memoryview are mutable or borrowed; freeze them once
+            data = bytes(data)
+        self._data = data
+        self.filename = filename
+        self._sha256 = None
+
+    @classmethod
+    async def from_upload(cls, upload) -> "DocumentBuffer":
+        """Read a FastAPI UploadFile once"""
+        return cls(await upload.read(), upload.filename)
+
+    @classmethod
+    def from_stream(cls, stream, filename: str = None, max_bytes: int = None, chunk_size: int = 1024 * 1024) -> "DocumentBuffer":
+        """
+        Read a document from a file-like stream (e.g. an S3 object body) in chunks.
+
+        Chunks are collected in a BytesIO whose ``getvalue()`` hands over its buffer
+        without another copy, so the document is held once. Raises ValueError as
+        soon as more than ``max_bytes`` have been read.
+        """
+        buffer = io.BytesIO()
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            buffer.write(chunk)
+            if max_bytes is not None and buffer.tell() > max_bytes:
+                raise ValueError(f"Document is larger than {max_bytes} bytes")
+        return cls(buffer.getvalue(), filename)
+
+    @property
+    def data(self) -> bytes:
+        return self._data
+
+    def view(self) -> memoryview:
+        """Read-only, zero-copy view of the document"""
+        return memoryview(self._data)
+
+    def open(self) -> io.BytesIO:
+        """A fresh reader positioned at the start, sharing the document's memory"""
+        return io.BytesIO(self._data)
+
+    def sha256(self) -> str:
+        """Hex digest of the document, computed once"""
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self._data).hexdigest()
+        return self._sha256
+
+    def __len__(self) -> int:
+        return len(self._data)
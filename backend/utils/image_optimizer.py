@@ -0,0 +1,151 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Post-processing of extracted images before upload; off by default so images are stored as found
+IMAGE_OPTIMIZATION_ENABLED = os.getenv("IMAGE_OPTIMIZATION_ENABLED", "false").lower() == "true"
+# Images narrower or shorter than this (icons, spacers, bullets) are dropped
+IMAGE_MIN_DIMENSION = int(os.getenv("IMAGE_MIN_DIMENSION", 32))
+# Longest side after downscaling
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", 2048))
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "webp").lower()  # webp or jpeg
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 80))
+# Longest side of the generated thumbnails; 0 disables thumbnails
+IMAGE_THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", 256))
+IMAGE_OPTIMIZER_WORKERS = int(os.getenv("IMAGE_OPTIMIZER_WORKERS", os.cpu_count() or 2))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_optimizer_pool() -> ProcessPoolExecutor:
+    """Create (once) the process pool that re-encodes images off the request threads"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Spawned workers only import Pillow, not the API process with its threads and clients
+                _pool = ProcessPoolExecutor(
+                    max_workers=IMAGE_OPTIMIZER_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pool
+
+def optimization_settings() -> str:
+    """The settings that shape optimized output, for caches keyed on them"""
+    if not IMAGE_OPTIMIZATION_ENABLED:
+        return "off"
+    return f"{IMAGE_MIN_DIMENSION}/{IMAGE_MAX_DIMENSION}/{IMAGE_OUTPUT_FORMAT}/{IMAGE_QUALITY}/{IMAGE_THUMBNAIL_SIZE}"
+
+def optimization_stats() -> dict:
+    """Empty counters for optimize_images to accumulate into"""
+    return {
+        'images': 0,
+        'dropped': 0,
+        'reencoded': 0,
+        'original_bytes': 0,
+        'optimized_bytes': 0,
+        'thumbnail_bytes': 0,
+        'bytes_saved': 0
+    }
+
+def _encode(image, output_format, quality) -> bytes:
+    buffer = io.BytesIO()
+    if output_format == 'jpeg':
+        image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    else:
+        image.save(buffer, 'WEBP', quality=quality, method=4)
+    return buffer.getvalue()
+
+def optimize_image(image_bytes: bytes, image_ext: str, settings: tuple):
+    """
+    Drop, downscale and re-encode one image; runs in a pool worker.
+
+    Returns None for images below the minimum dimension, otherwise a dict with the
+    bytes and extension to store, and an optional thumbnail. Images that Pillow cannot
+    read, or that would not get smaller, come back with ``image`` set to None so the
+    original is kept without sending it back through the pool.
+    """
+    from PIL import Image
+
+    min_dimension, max_dimension, output_format, quality, thumbnail_size = settings
+    output_ext = 'jpg' if output_format == 'jpeg' else output_format
+    unchanged = {'image': None, 'ext': image_ext, 'thumbnail': None, 'thumbnail_ext': None}
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        if image.width < min_dimension or image.height < min_dimension:
+            return None
+        # Let the JPEG decoder skip detail we are about to throw away
+        image.draft('RGB', (max_dimension, max_dimension))
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        if has_alpha and output_format != 'jpeg':
+            image = image.convert('RGBA')
+        elif has_alpha:
+            # JPEG has no alpha channel; flatten onto white
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+        downscaled = max(image.size) > max_dimension
+        if downscaled:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        encoded = _encode(image, output_format, quality)
+
+        if downscaled or len(encoded) < len(image_bytes):
+            result = {'image': encoded, 'ext': output_ext, 'thumbnail': None, 'thumbnail_ext': None}
+        else:
+            result = dict(unchanged)
+        if thumbnail_size and max(image.size) > thumbnail_size:
+            image.thumbnail((thumbnail_size, thumbnail_size), Image.LANCZOS)
+            result['thumbnail'] = _encode(image, output_format, quality)
+            result['thumbnail_ext'] = output_ext
+        return result
+    except Exception as e:
+        print(f"Image optimization skipped: {str(e)}")
+        return unchanged
+
+def optimize_images(images, stats: dict = None) -> list:
+    """
+    Optimize (image_bytes, image_ext) pairs in the process pool.
+
+    Returns one entry per input in order: None for dropped images, otherwise the dict
+    from optimize_image. When optimization is disabled every image passes through
+    unchanged. Counters, including bytes saved, are added to ``stats`` when given.
+    """
+    images = list(images)
+    if not IMAGE_OPTIMIZATION_ENABLED or not images:
+        results = [{'image': None, 'ext': image_ext, 'thumbnail': None, 'thumbnail_ext': None} for _, image_ext in images]
+    else:
+        settings = (IMAGE_MIN_DIMENSION, IMAGE_MAX_DIMENSION, IMAGE_OUTPUT_FORMAT, IMAGE_QUALITY, IMAGE_THUMBNAIL_SIZE)
+        try:
+            results = list(get_optimizer_pool().map(
+                optimize_image,
+                [image_bytes for image_bytes, _ in images],
+                [image_ext for _, image_ext in images],
+                [settings] * len(images)
+            ))
+        except Exception as e:
+            # A broken pool must not fail the document; store the originals instead
+            print(f"Image optimization failed, storing originals: {str(e)}")
+            results = [{'image': None, 'ext': image_ext, 'thumbnail': None, 'thumbnail_ext': None} for _, image_ext in images]
+
+    for (image_bytes, _), result in zip(images, results):
+        reencoded = result is not None and result['image'] is not None
+        if result is not None and not reencoded:
+            result['image'] = image_bytes
+        if stats is None:
+            continue
+        stats['images'] += 1
+        stats['original_bytes'] += len(image_bytes)
+        if result is None:
+            stats['dropped'] += 1
+            continue
+        stats['reencoded'] += reencoded
+        stats['optimized_bytes'] += len(result['image'])
+        stats['thumbnail_bytes'] += len(result['thumbnail'] or b'')
+    if stats is not None:
+        stats['bytes_saved'] = stats['original_bytes'] - stats['optimized_bytes']
+    return results
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+from backend.utils.metrics import IMAGES_DEDUPLICATED
+
+# Store images once under a content-hash key shared by every document, instead of per document
+SHARED_IMAGE_STORE_ENABLED = os.getenv("SHARED_IMAGE_STORE_ENABLED", "false").lower() == "true"
+SHARED_IMAGE_PREFIX = os.getenv("SHARED_IMAGE_PREFIX", "shared_sources/extracted_images").rstrip("/")
+# Optional file that keeps the index of stored images across restarts
+IMAGE_HASH_INDEX_PATH = os.getenv("IMAGE_HASH_INDEX_PATH")
+
+def image_digest(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def shared_image_key(digest: str, image_ext: str) -> str:
+    """Content-addressed key for an image; the two-character shard keeps listings small"""
+    return f"{SHARED_IMAGE_PREFIX}/{digest[:2]}/{digest}.{image_ext}"
+
+class ImageHashIndex:
+    """
+    URLs of images already present in the shared store.
+
+    Entries are object URLs rather than keys so an index never vouches for an object in
+    a different bucket or backend. With a path, entries are appended to that file and
+    reloaded on first use.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = Path(path) if path else None
+        self._urls = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._urls is None:
+            self._urls = set()
+            if self.path and self.path.is_file():
+                self._urls.update(line.strip() for line in self.path.read_text(encoding="utf-8").splitlines() if line.strip())
+
+    def __contains__(self, url: str) -> bool:
+        with self._lock:
+            self._load()
+            return url in self._urls
+
+    def add(self, url: str) -> None:
+        with self._lock:
+            self._load()
+            if url in self._urls:
+                return
+            self._urls.add(url)
+            if self.path:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(url + "\n")
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_image_index() -> ImageHashIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ImageHashIndex(IMAGE_HASH_INDEX_PATH)
+    return _index
+
+def find_shared_image(storage, key: str):
+    """
+    Return the URL of an image already in the shared store, or None.
+
+    The local index answers first; on a miss a HEAD request (``storage.exists``) catches
+    images stored by other workers or before a restart. A failed check counts as a miss,
+    which only costs a redundant upload of identical content.
+    """
+    url = storage.url(key)
+    if url in get_image_index():
+        IMAGES_DEDUPLICATED.labels("index").inc()
+        return url
+    try:
+        found = storage.exists(key)
+    except Exception as e:
+        print(f"Shared image check failed for {key}: {str(e)}")
+        return None
+    if not found:
+        return None
+    get_image_index().add(url)
+    IMAGES_DEDUPLICATED.labels("head").inc()
+    return url
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Local copies of extracted output are opt-in; S3 is the source of truth
+LOCAL_OUTPUT_ENABLED = os.getenv("LOCAL_OUTPUT_ENABLED", "false").lower() == "true"
+LOCAL_OUTPUT_DIR = Path(os.getenv("LOCAL_OUTPUT_DIR") or Path(tempfile.gettempdir()) / "content_extraction")
+# 0 removes a document's directory as soon as its request ends
+LOCAL_OUTPUT_RETENTION_SECONDS = int(os.getenv("LOCAL_OUTPUT_RETENTION_SECONDS", 0))
+
+def prune_expired_output(root: Path = LOCAL_OUTPUT_DIR, retention_seconds: int = LOCAL_OUTPUT_RETENTION_SECONDS):
+    """Delete document directories older than the retention period"""
+    if not root.exists():
+        return
+    cutoff = time.time() - retention_seconds
+    for source_dir in root.iterdir():
+        if not source_dir.is_dir():
+            continue
+        for document_dir in source_dir.iterdir():
+            try:
+                if document_dir.stat().st_mtime < cutoff:
+                    shutil.rmtree(document_dir, ignore_errors=True)
+            except FileNotFoundError:
+                continue
+
+@contextmanager
+def local_output_dir(source_type: str, document_id: str):
+    """
+    Yield a temporary directory for a document's local output, or None when disabled.
+
+    The directory is removed when the request ends unless a retention period is
+    configured, in which case expired directories are pruned on the next request.
+    """
+    if not LOCAL_OUTPUT_ENABLED:
+        yield None
+        return
+
+    if LOCAL_OUTPUT_RETENTION_SECONDS > 0:
+        prune_expired_output()
+
+    output_dir = LOCAL_OUTPUT_DIR / f"{source_type}_sources" / document_id
+    output_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        yield output_dir
+    finally:
+        if LOCAL_OUTPUT_RETENTION_SECONDS <= 0:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+def save_local_output(output_dir, subdir: str, filename: str, content) -> None:
+    """Write bytes or text under output_dir/subdir; does nothing when output_dir is None"""
+    if output_dir is None:
+        return
+    target_dir = output_dir / subdir
+    target_dir.mkdir(parents=True, exist_ok=True)
+    if isinstance(content, str):
+        (target_dir / filename).write_text(content, encoding="utf-8")
+    else:
+        (target_dir / filename).write_bytes(content)
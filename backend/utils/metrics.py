@@ -0,0 +1,71 @@
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Buckets span quick web scrapes through multi-minute OCR runs
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+REQUEST_LATENCY = Histogram(
+    "extraction_request_seconds",
+    "End-to-end processing time of a document or website",
+    ["source", "category"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_DURATION = Histogram(
+    "extraction_stage_seconds",
+    "Time spent in each processing stage",
+    ["processor", "stage"],
+    buckets=STAGE_BUCKETS
+)
+PAGES_PROCESSED = Counter("extraction_pages_total", "Pages processed", ["processor"])
+PAGES_REUSED = Counter("extraction_pages_reused_total", "Pages taken unchanged from a previous revision instead of being extracted", ["processor"])
+IMAGES_PROCESSED = Counter("extraction_images_total", "Images extracted and stored", ["processor"])
+BYTES_UPLOADED = Counter("storage_uploaded_bytes_total", "Bytes written to storage", ["kind"])
+IMAGE_BYTES_SAVED = Counter("image_optimization_saved_bytes_total", "Image bytes not stored thanks to dropping and recompression", ["processor"])
+IMAGES_DEDUPLICATED = Counter("storage_images_deduplicated_total", "Images found in the shared image store and not uploaded again", ["check"])
+FAILURES = Counter("extraction_failures_total", "Failed requests and stages", ["processor", "stage"])
+
+REQUESTS_COALESCED = Counter("requests_coalesced_total", "Requests that joined an identical request already in progress", ["source", "category"])
+
+SEARCH_INDEX_PAGES = Counter("search_index_pages_total", "Pages written to the full-text search index", ["source"])
+
+WEB_CACHE_LOOKUPS = Counter("web_cache_lookups_total", "Website result cache lookups by outcome (hit, revalidated, changed, expired, miss)", ["category", "outcome"])
+
+ADMISSION_QUEUE_DEPTH = Gauge("admission_queue_depth", "Requests waiting for a processing slot", ["category"])
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Requests currently being processed", ["category"])
+ADMISSION_WAIT = Histogram(
+    "admission_wait_seconds",
+    "Time requests spent queued before processing",
+    ["category"],
+    buckets=LATENCY_BUCKETS
+)
+ADMISSION_REJECTIONS = Counter("admission_rejections_total", "Requests rejected with 429 because the queue was full", ["category"])
+
+@contextmanager
+def track_stage(processor: str, stage: str):
+    """Time a block as one stage of a processor; failures inside it are counted"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        FAILURES.labels(processor, stage).inc()
+        raise
+    finally:
+        STAGE_DURATION.labels(processor, stage).observe(time.perf_counter() - started)
+
+@contextmanager
+def track_request(source: str, category: str):
+    """Time a whole request by source (pdf/web) and category; failures are counted"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        FAILURES.labels(f"{source}_{category.lower().replace(' ', '_')}", "request").inc()
+        raise
+    finally:
+        REQUEST_LATENCY.labels(source, category.lower()).observe(time.perf_counter() - started)
+
+def render_metrics():
+    """Return (body, content type) in the Prometheus text exposition format"""
+    return generate_latest(), CONTENT_TYPE_LATEST
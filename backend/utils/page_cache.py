@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import fitz
+from backend.utils.storage import get_storage, STORAGE_MAX_WORKERS
+from backend.utils.metrics import PAGES_REUSED
+
+# Re-extract only the pages that changed when a new revision of a document is uploaded.
+# Opt-in, and only for uploads naming their lineage. Nothing here deletes old fragments:
+# they are shared between revisions, so expire pdf_sources/page_cache/ with a storage
+# lifecycle rule (e.g. an S3 expiration after 30 days). A revision whose manifest or
+# fragments have expired just has those pages processed again and stored anew.
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "false").lower() == "true"
+# Bump when fragment contents change shape so older manifests are ignored
+PAGE_CACHE_VERSION = 2
+
+def page_fingerprint(doc, page) -> str:
+    """
+    Hash what determines a page's extracted output.
+
+    Covers the page geometry, its content stream and the raw streams of the images and
+    form XObjects it draws, so an edited image is noticed even when the content stream
+    is unchanged. Falls back to the extracted text if the streams cannot be read.
+    """
+    digest = hashlib.sha256(f"{tuple(page.rect)}|{page.rotation}".encode())
+    try:
+        digest.update(page.read_contents())
+        for xref in sorted({img[0] for img in page.get_images(full=True)} | {xobj[0] for xobj in page.get_xobjects()}):
+            digest.update(doc.xref_stream_raw(xref) or b"")
+    except Exception:
+        digest.update(page.get_text().encode("utf-8"))
+    return digest.hexdigest()
+
+def document_fingerprints(pdf_bytes) -> list:
+    """Fingerprint of every page, in page order"""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return [page_fingerprint(doc, page) for page in doc]
+    finally:
+        doc.close()
+
+def slice_pdf_pages(pdf_bytes, page_numbers) -> bytes:
+    """A PDF holding only the given 1-based pages, in the given order"""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        doc.select([page_number - 1 for page_number in page_numbers])
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+def page_cache_enabled(lineage: str = None) -> bool:
+    """
+    Whether pages are cached for this upload.
+
+    Revisions of a document share a lineage, an id the client chooses and passes with
+    every revision. Uploads without one are never cached: filenames are not unique
+    enough to tell revisions of one document from different documents.
+    """
+    return PAGE_CACHE_ENABLED and bool(lineage)
+
+def _manifest_key(processor: str, lineage: str) -> str:
+    return f"pdf_sources/page_cache/{processor}/{hashlib.sha256(lineage.encode('utf-8')).hexdigest()[:32]}.json"
+
+def _fragment_key(processor: str, body: bytes) -> str:
+    # Content-addressed, so a page unchanged across revisions is stored once
+    return f"pdf_sources/page_cache/{processor}/fragments/{hashlib.sha256(body).hexdigest()}.json"
+
+def _load_manifest(processor: str, lineage: str, settings: str):
+    try:
+        manifest = json.loads(get_storage().get(_manifest_key(processor, lineage)))
+    except Exception:
+        return None
+    if manifest.get("version") != PAGE_CACHE_VERSION or manifest.get("settings") != settings:
+        return None
+    return manifest
+
+def load_page_fragments(processor: str, lineage: str, settings: str) -> dict:
+    """
+    Fragment keys from the lineage's latest revision, keyed by (page number, fingerprint).
+
+    Fragments embed their page number (headings, image labels, storage keys), so a page
+    is reused only at the same position. Returns an empty dict when the cache is
+    disabled, nothing is stored yet, or the revision was built with other settings.
+    """
+    if not page_cache_enabled(lineage):
+        return {}
+    manifest = _load_manifest(processor, lineage, settings)
+    if manifest is None:
+        return {}
+    return {
+        (page_number, page["fingerprint"]): page["fragment_key"]
+        for page_number, page in enumerate(manifest.get("pages", []), start=1)
+    }
+
+def _read_fragments(keys) -> dict:
+    """Fragment for each key that could be read; missing or unreadable ones are left out"""
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+    storage = get_storage()
+
+    def read(key):
+        try:
+            return key, json.loads(storage.get(key))
+        except Exception as e:
+            print(f"Failed to read cached page fragment {key}: {str(e)}")
+            return key, None
+
+    with ThreadPoolExecutor(max_workers=min(STORAGE_MAX_WORKERS, len(keys))) as executor:
+        return {key: fragment for key, fragment in executor.map(read, keys) if fragment is not None}
+
+def save_page_fragments(processor: str, lineage: str, settings: str, document_id: str, fingerprints: list, fragments: list, reused=()) -> None:
+    """
+    Record this revision's page fragments as the lineage's latest.
+
+    Each fragment is stored once under a hash of its content; the manifest only lists
+    page fingerprints and fragment keys, so it stays small however large the pages'
+    markdown (with embedded images) is. Fragments of the ``reused`` page numbers were
+    just read from storage and are not uploaded again.
+    """
+    if not page_cache_enabled(lineage):
+        return
+    bodies = [json.dumps(fragment, sort_keys=True).encode("utf-8") for fragment in fragments]
+    keys = [_fragment_key(processor, body) for body in bodies]
+    stored = {keys[page_number - 1] for page_number in reused}
+    manifest = {
+        "version": PAGE_CACHE_VERSION,
+        "processor": processor,
+        "lineage": lineage,
+        "settings": settings,
+        "document_id": document_id,
+        "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "pages": [
+            {"fingerprint": fingerprint, "fragment_key": key}
+            for fingerprint, key in zip(fingerprints, keys)
+        ]
+    }
+    try:
+        storage = get_storage()
+        pending = {key: body for key, body in zip(keys, bodies) if key not in stored}
+        uploaded = storage.put_many((key, body, "application/json") for key, body in pending.items())
+        if len(uploaded) < len(pending):
+            raise Exception(f"{len(pending) - len(uploaded)} page fragments were not stored")
+        storage.put(_manifest_key(processor, lineage), json.dumps(manifest).encode("utf-8"), "application/json")
+    except Exception as e:
+        # The result is complete without the cache; the next revision is just processed in full
+        print(f"Failed to store page fragments for {lineage}: {str(e)}")
+
+def plan_pages(processor: str, lineage: str, settings: str, fingerprints: list, allow_reuse: bool = True):
+    """
+    Split a revision's pages into reusable fragments and pages to process.
+
+    Returns (reused, changed, summary): reused maps 1-based page number to its cached
+    fragment, changed lists the page numbers to extract, and summary is reported in
+    the result metadata. Without ``allow_reuse``, or when the upload is not cached,
+    every page is processed.
+    """
+    allow_reuse = allow_reuse and page_cache_enabled(lineage)
+    cached = load_page_fragments(processor, lineage, settings) if allow_reuse else {}
+    matches = {
+        page_number: cached[(page_number, fingerprint)]
+        for page_number, fingerprint in enumerate(fingerprints, start=1)
+        if (page_number, fingerprint) in cached
+    }
+    fragments = _read_fragments(matches.values())
+    reused = {}
+    changed = []
+    for page_number in range(1, len(fingerprints) + 1):
+        fragment = fragments.get(matches.get(page_number))
+        if fragment is not None:
+            reused[page_number] = fragment
+        else:
+            changed.append(page_number)
+    PAGES_REUSED.labels(processor).inc(len(reused))
+    summary = {
+        "lineage": lineage,
+        "cached": allow_reuse,
+        "pages": len(fingerprints),
+        "reused_pages": len(reused),
+        "processed_pages": len(changed)
+    }
+    return reused, changed, summary
@@ -1,9 +1,10 @@
 from pathlib import Path
 import io
+import os
 from docling.document_converter import DocumentConverter
 from pydantic import BaseModel
 from docling.datamodel.base_models import InputFormat, DocumentStream
-from docling_core.types.doc import ImageRefMode
+from docling_core.types.doc import ImageRefMode, TableItem, PictureItem, TextItem
 from docling.document_converter import (
     DocumentConverter,
     PdfFormatOption,
@@ -11,10 +12,19 @@ from docling.document_converter import (
 from tempfile import NamedTemporaryFile
 from docling.datamodel.pipeline_options import PdfPipelineOptions
 from docling.backend.pypdfium2_backend import PyPdfiumDocumentBackend
-from backend.utils.s3 import upload_markdown_to_s3
+from backend.utils.storage import upload_markdown
+from backend.utils.search_index import schedule_indexing
+from backend.utils.block_export import open_block_writer, block_record, cell_record
+from backend.utils.docling_export import DOCLING_PERSIST_DOCUMENT, submit_exports, collect_exports
+from backend.utils.metrics import track_stage, PAGES_PROCESSED
+from backend.utils.admission import CONCURRENCY_LIMITS
+from backend.utils.page_cache import document_fingerprints, page_cache_enabled, plan_pages, save_page_fragments, slice_pdf_pages
 
 from datetime import datetime
 import logging
+import queue
+import threading
+from contextlib import contextmanager
 
 logging.basicConfig(
     filename="output.log",  # File name where logs will be saved
@@ -23,71 +33,228 @@ logging.basicConfig(
 )
 logger = logging.getLogger()
 
+PROCESSOR = "pdf_docling"
 
-def process_pdf_with_docling(pdf_buffer: io.BytesIO, document_id: str, original_filename: str):
-    """Process PDF using Docling and return markdown with embedded images"""
-    print("Processing PDF with Docling")
+# Reusing unchanged pages needs a markdown export per page, each walking the whole
+# document, so Docling keeps page fragments only when asked to (and the page cache is on)
+DOCLING_PAGE_CACHE_ENABLED = os.getenv("DOCLING_PAGE_CACHE_ENABLED", "false").lower() == "true"
+
+
+# Converters are shared by every worker thread: at most as many as Docling may run at
+# once (its admission limit), each keeping its models loaded between documents
+DOCLING_MAX_CONVERTERS = max(CONCURRENCY_LIMITS.get("docling", 1), 1)
+_idle_converters = queue.Queue()
+_converters_created = 0
+_converters_lock = threading.Lock()
+
+def create_docling_converter() -> DocumentConverter:
+    # Configure pipeline options
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.do_ocr = True
+    pipeline_options.do_table_structure = True
+    pipeline_options.images_scale = 2.0
+    pipeline_options.generate_page_images = True
+    pipeline_options.generate_picture_images = True
+    print("Pipeline options set")
+
+    # Initialize DocumentConverter
+    converter = DocumentConverter(
+        format_options={
+            InputFormat.PDF: PdfFormatOption(
+                pipeline_options=pipeline_options,
+                backend=PyPdfiumDocumentBackend
+            )
+        }
+    )
+    print("Document converter initialized")
+    return converter
+
+@contextmanager
+def docling_converter():
+    """
+    Borrow a DocumentConverter from the shared pool for one conversion.
+
+    A new converter is only created while fewer than DOCLING_MAX_CONVERTERS exist;
+    otherwise the caller waits for one to be returned.
+    """
+    global _converters_created
     try:
-        # Configure pipeline options
-        pipeline_options = PdfPipelineOptions()
-        pipeline_options.do_ocr = True
-        pipeline_options.do_table_structure = True
-        pipeline_options.images_scale = 2.0
-        pipeline_options.generate_page_images = True
-        pipeline_options.generate_picture_images = True
-        print("Pipeline options set")
-
-        # Initialize DocumentConverter
-        doc_converter = DocumentConverter(
-            format_options={
-                InputFormat.PDF: PdfFormatOption(
-                    pipeline_options=pipeline_options,
-                    backend=PyPdfiumDocumentBackend
-                )
-            }
-        )
-        print("Document converter initialized")
+        converter = _idle_converters.get_nowait()
+    except queue.Empty:
+        with _converters_lock:
+            create = _converters_created < DOCLING_MAX_CONVERTERS
+            if create:
+                _converters_created += 1
+        if create:
+            try:
+                converter = create_docling_converter()
+            except Exception:
+                with _converters_lock:
+                    _converters_created -= 1
+                raise
+        else:
+            converter = _idle_converters.get()
+    try:
+        yield converter
+    finally:
+        _idle_converters.put(converter)
+
+def docling_page_blocks(document) -> dict:
+    """
+    Structured export blocks of a converted document, by page number, in reading order.
+
+    The document is walked once and each item is filed under the page of its first
+    provenance. Text items keep their Docling label (paragraph, section_header,
+    list_item, ...) as the block type. Boxes are converted from Docling's bottom-left
+    origin to top-left points.
+    """
+    blocks = {}
+    for item, _ in document.iterate_items():
+        if not getattr(item, "prov", None):
+            continue
+        prov = item.prov[0]
+        page = document.pages.get(prov.page_no)
+        bbox = None
+        if page is not None:
+            box = prov.bbox.to_top_left_origin(page_height=page.size.height)
+            bbox = (box.l, box.t, box.r, box.b)
+        if isinstance(item, TableItem):
+            block = block_record(
+                "table",
+                bbox,
+                item.export_to_markdown(doc=document),
+                [
+                    cell_record(cell.start_row_offset_idx, cell.start_col_offset_idx, cell.text, cell.row_span, cell.col_span)
+                    for cell in item.data.table_cells
+                ]
+            )
+        elif isinstance(item, PictureItem):
+            block = block_record("picture", bbox)
+        elif isinstance(item, TextItem):
+            block = block_record(item.label.value, bbox, item.text)
+        else:
+            continue
+        blocks.setdefault(prov.page_no, []).append(block)
+    return blocks
+
+def process_pdf_with_docling(pdf_buffer: io.BytesIO, document_id: str, original_filename: str, lineage: str = None, formats=None):
+    """
+    Process PDF using Docling and return markdown with embedded images.
 
+    The markdown is one export of the whole document. With DOCLING_PAGE_CACHE_ENABLED
+    it is instead exported page by page, so pages unchanged since the lineage's previous
+    revision can be reused and only the changed pages are sliced out and converted.
+
+    ``formats`` lists further outputs (json, html, text) exported from the same
+    conversion, serialized and uploaded concurrently with the markdown. Those need the
+    whole document, so requesting them converts every page. Whole-document conversions
+    also persist the DoclingDocument, from which later format requests are served.
+    """
+    print("Processing PDF with Docling")
+    try:
         # Get base name for file naming
         base_name = Path(original_filename).stem
-        
-        # Process the PDF directly from buffer
-        pdf_buffer.seek(0)
-        doc_stream = DocumentStream(
-            name=f"{base_name}.pdf",
-            stream=pdf_buffer,
-            format=InputFormat.PDF
-        )
-        print("Document stream created")
-
-        # Convert document
-        conv_result = doc_converter.convert(doc_stream)
-        print("Conversion completed")
-
-        # Export to markdown with embedded images
-        markdown_content = conv_result.document.export_to_markdown(
-            image_mode=ImageRefMode.EMBEDDED
-        )
+
+        pdf_bytes = pdf_buffer.getvalue()
+        block_writer = open_block_writer(document_id, f"pdf_sources/extracted_blocks/{document_id}/{base_name}")
+        # Cached fragments only carry blocks when they were built for an export
+        settings = "embedded-images" + ("|blocks" if block_writer else "")
+        fingerprints = document_fingerprints(pdf_bytes)
+        extra_formats = [fmt for fmt in formats or [] if fmt != "markdown"]
+        # Other formats are exported from one document covering every page
+        page_cache = DOCLING_PAGE_CACHE_ENABLED and not extra_formats and page_cache_enabled(lineage)
+        reused, changed, incremental = plan_pages(PROCESSOR, lineage, settings, fingerprints, allow_reuse=page_cache)
+        markdown_content = ""
+        page_markdown = {}
+        page_blocks = {}
+        export_futures = {}
+
+        if changed:
+            # Process the PDF directly from buffer, or just its changed pages
+            doc_stream = DocumentStream(
+                name=f"{base_name}.pdf",
+                stream=pdf_buffer if not reused else io.BytesIO(slice_pdf_pages(pdf_bytes, changed)),
+                format=InputFormat.PDF
+            )
+            doc_stream.stream.seek(0)
+            print("Document stream created")
+
+            # Convert document
+            with docling_converter() as doc_converter, track_stage(PROCESSOR, "parse"):
+                conv_result = doc_converter.convert(doc_stream)
+            PAGES_PROCESSED.labels(PROCESSOR).inc(len(conv_result.document.pages))
+            print("Conversion completed")
+
+            if not reused and (extra_formats or DOCLING_PERSIST_DOCUMENT):
+                # Serialize and upload the other formats while the markdown is built
+                export_futures = submit_exports(conv_result.document, document_id, base_name, extra_formats)
+
+            converted_blocks = docling_page_blocks(conv_result.document) if block_writer else {}
+
+            # Export markdown with embedded images: the whole document at once unless pages are cached
+            with track_stage(PROCESSOR, "markdown_export"):
+                if not page_cache:
+                    markdown_content = conv_result.document.export_to_markdown(image_mode=ImageRefMode.EMBEDDED)
+                for converted_page, page_num in enumerate(changed, start=1):
+                    if page_cache:
+                        page_markdown[page_num] = conv_result.document.export_to_markdown(
+                            image_mode=ImageRefMode.EMBEDDED,
+                            page_no=converted_page
+                        )
+                    if block_writer:
+                        page_blocks[page_num] = converted_blocks.get(converted_page, [])
+
+        fragments = []
+        for page_num in range(1, len(fingerprints) + 1):
+            fragment = reused.get(page_num)
+            if fragment is None:
+                fragment = {'markdown': page_markdown.get(page_num, "")}
+                if block_writer:
+                    fragment['blocks'] = page_blocks.get(page_num, [])
+            if block_writer:
+                block_writer.write_page(page_num, fragment['blocks'])
+            fragments.append(fragment)
+        if page_cache:
+            save_page_fragments(PROCESSOR, lineage, settings, document_id, fingerprints, fragments, reused)
+            markdown_content = "\n\n".join(fragment['markdown'] for fragment in fragments if fragment['markdown'])
         print("Markdown content generated")
 
         # Upload markdown to S3
         timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
         markdown_key = f"pdf_sources/extracted_markdown/{document_id}/{base_name}_{timestamp}.md"
-        markdown_url = upload_markdown_to_s3(markdown_content, markdown_key)
+        with track_stage(PROCESSOR, "markdown_upload"):
+            markdown_url = upload_markdown(markdown_content, markdown_key)
         print("Markdown uploaded to S3")
+        # Without per-page markdown the document is indexed as a single page
+        search_pages = [fragment['markdown'] for fragment in fragments] if page_cache else [markdown_content]
+        schedule_indexing(document_id, 'pdf', PROCESSOR, search_pages, markdown_url, original_filename)
+
+        urls = {'markdown': markdown_url}
+        structured_export = None
+        if block_writer:
+            with track_stage(PROCESSOR, "blocks_upload"):
+                structured_export = block_writer.close()
+            urls['blocks'] = structured_export['url']
+
+        with track_stage(PROCESSOR, "format_export"):
+            exports = collect_exports(export_futures, required=extra_formats)
+        if 'json' in exports:
+            urls['docling_document'] = exports['json']
+        urls['exports'] = {fmt: exports[fmt] for fmt in extra_formats}
 
         return {
             'source_type': 'pdf',
             'document_id': document_id,
-            'urls': {
-                'markdown': markdown_url
-            },
+            'urls': urls,
             'metadata': {
                 'source_type': 'pdf',
                 'original_filename': original_filename,
                 'processing_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 'content_type': 'document',
-                'processor': 'docling'
+                'processor': 'docling',
+                'incremental': incremental,
+                'page_fingerprints': fingerprints if incremental['cached'] else None,
+                'structured_export': structured_export
             }
         }
 
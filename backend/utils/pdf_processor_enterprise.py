@@ -1,150 +1,382 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
 import fitz  # PyMuPD
 from pathlib import Path
 from datetime import datetime
-from backend.utils.s3 import upload_image_to_s3, upload_markdown_to_s3
+from types import SimpleNamespace
+from backend.utils.storage import upload_images, upload_markdown
+from backend.utils.search_index import schedule_indexing
+from backend.utils.block_export import open_block_writer, block_record, cell_record, bbox_from_polygon
+from backend.utils.local_output import local_output_dir, save_local_output
+from backend.utils.image_optimizer import optimize_images, optimization_stats, optimization_settings
+from backend.utils.page_cache import document_fingerprints, plan_pages, save_page_fragments, slice_pdf_pages
+from backend.utils.metrics import track_stage, FAILURES, PAGES_PROCESSED, IMAGES_PROCESSED, IMAGE_BYTES_SAVED
 
-def process_pdf_with_enterprise(pdf_buffer, document_id, original_filename):
+PROCESSOR = "pdf_enterprise"
+
+# Documents longer than this are split into page ranges analyzed in parallel
+AZURE_CHUNK_PAGES = int(os.getenv("AZURE_CHUNK_PAGES", 50))
+AZURE_MAX_CONCURRENT_ANALYSES = int(os.getenv("AZURE_MAX_CONCURRENT_ANALYSES", 4))
+
+@lru_cache(maxsize=1)
+def get_document_analysis_client():
+    """Create (once) an Azure Form Recognizer client from environment credentials"""
+    endpoint = os.getenv("AZURE_FORM_RECOGNIZER_ENDPOINT")
+    api_key = os.getenv("AZURE_FORM_RECOGNIZER_KEY")
+
+    if not endpoint or not api_key:
+        raise ValueError("Azure Form Recognizer credentials not found in environment variables")
+
+    return DocumentAnalysisClient(endpoint, AzureKeyCredential(api_key))
+
+def split_pdf_pages(pdf_bytes, chunk_pages):
+    """
+    Slice a PDF locally into documents of at most ``chunk_pages`` pages.
+
+    Returns a list of (page_offset, chunk_bytes) where page_offset is the number of
+    pages preceding the chunk in the original document.
+    """
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        page_count = len(doc)
+        if page_count <= chunk_pages:
+            return [(0, pdf_bytes)]
+
+        chunks = []
+        for start in range(0, page_count, chunk_pages):
+            end = min(start + chunk_pages, page_count) - 1
+            chunk = fitz.open()
+            chunk.insert_pdf(doc, from_page=start, to_page=end)
+            chunks.append((start, chunk.tobytes()))
+            chunk.close()
+        return chunks
+    finally:
+        doc.close()
+
+def _analyze_chunk(client, page_offset, chunk_bytes):
+    """Analyze one page range and re-base its page numbers onto the full document."""
+    poller = client.begin_analyze_document("prebuilt-document", document=chunk_bytes)
+    result = poller.result()
+    if page_offset:
+        for page in result.pages or []:
+            page.page_number += page_offset
+        for table in result.tables or []:
+            for region in table.bounding_regions or []:
+                region.page_number += page_offset
+    return result
+
+def analyze_document(client, pdf_bytes, chunk_pages=None, max_concurrency=None):
+    """
+    Analyze a PDF with Azure Form Recognizer, splitting large documents into page ranges.
+
+    Chunks are submitted concurrently (at most ``max_concurrency`` at a time) and merged in
+    page order. Returns an object exposing ``pages`` and ``tables`` like an AnalyzeResult.
+    """
+    chunk_pages = chunk_pages or AZURE_CHUNK_PAGES
+    max_concurrency = max_concurrency or AZURE_MAX_CONCURRENT_ANALYSES
+
+    chunks = split_pdf_pages(pdf_bytes, chunk_pages)
+    if len(chunks) == 1:
+        return _analyze_chunk(client, 0, chunks[0][1])
+
+    print(f"✅ Document split into {len(chunks)} page ranges")
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(chunks))) as executor:
+        results = list(executor.map(lambda chunk: _analyze_chunk(client, *chunk), chunks))
+
+    return SimpleNamespace(
+        pages=[page for result in results for page in (result.pages or [])],
+        tables=[table for result in results for table in (result.tables or [])]
+    )
+
+def table_to_markdown(table):
+    """
+    Render an Azure table as markdown in one pass over its cells.
+
+    Cells are placed into a row x column grid by their row and column index; the extra
+    columns (and rows) covered by a spanned cell are left empty so every row has the
+    same width.
+    """
+    column_count = table.column_count or max((cell.column_index + 1 for cell in table.cells), default=0)
+    grid = [[""] * column_count for _ in range(table.row_count)]
+    for cell in table.cells:
+        if cell.row_index < table.row_count and cell.column_index < column_count:
+            grid[cell.row_index][cell.column_index] = cell.content.replace("|", "\\|").replace("\n", " ")
+
+    parts = ["\n**Table:**\n\n"]
+    for row_index, row_cells in enumerate(grid):
+        parts.append("| " + " | ".join(row_cells) + " |\n")
+        if row_index == 0:
+            parts.append("| " + " | ".join(["---"] * column_count) + " |\n")
+    return "".join(parts)
+
+def renumber_pages(result, page_numbers):
+    """Map the pages of an analysis of a sliced PDF back to their numbers in the full document."""
+    for page in result.pages or []:
+        page.page_number = page_numbers[page.page_number - 1]
+    for table in result.tables or []:
+        for region in table.bounding_regions or []:
+            region.page_number = page_numbers[region.page_number - 1]
+    return result
+
+def build_page_markdown(result, image_snippets):
+    """
+    Render each page of an analysis result, with its image snippets, as markdown.
+
+    Each page collects its fragments in lists that are joined once at the end, so the
+    cost stays linear in the size of the output. Returns a dict of page number to markdown.
+    """
+    content_map = {}
+
+    def page_entry(page_num):
+        if page_num not in content_map:
+            content_map[page_num] = {"text": [f"## Page {page_num}\n\n"], "tables": [], "images": []}
+        return content_map[page_num]
+
+    # Page dimensions and text lines
+    for page in result.pages or []:
+        entry = page_entry(page.page_number)
+        entry["text"].append(f"**Page Dimensions:** {page.width} x {page.height}\n\n")
+        if page.lines:
+            entry["text"].append("**Text Content:**\n\n")
+            entry["text"].extend(f"{line.content}\n\n" for line in page.lines)
+
+    # Tables, attached to the page they start on
+    for table in result.tables or []:
+        if table.bounding_regions:
+            page_entry(table.bounding_regions[0].page_number)["tables"].append(table_to_markdown(table))
+
+    # Image markdown produced alongside the analysis
+    for page_num, snippets in image_snippets.items():
+        page_entry(page_num)["images"].extend(snippets)
+
+    # Combine each page's content: text, images, then tables
+    return {
+        page_num: "".join(entry["text"] + entry["images"] + entry["tables"])
+        for page_num, entry in content_map.items()
+    }
+
+def build_page_blocks(result, image_urls):
+    """
+    Structured export blocks of each page: text lines, tables with their cells, then images.
+
+    Azure reports PDF coordinates in inches; they are converted to points so every
+    processor's boxes share one unit. Returns a dict of page number to blocks.
+    """
+    blocks = {}
+    scales = {}
+    for page in result.pages or []:
+        scales[page.page_number] = 72 if (getattr(page, "unit", None) or "inch") == "inch" else 1
+        blocks[page.page_number] = [
+            block_record("line", bbox_from_polygon(line.polygon, scales[page.page_number]), line.content)
+            for line in page.lines or []
+        ]
+    for table in result.tables or []:
+        if not table.bounding_regions:
+            continue
+        region = table.bounding_regions[0]
+        blocks.setdefault(region.page_number, []).append(block_record(
+            "table",
+            bbox_from_polygon(getattr(region, "polygon", None), scales.get(region.page_number, 72)),
+            table_to_markdown(table).replace("**Table:**", "").strip(),
+            [
+                cell_record(cell.row_index, cell.column_index, cell.content, getattr(cell, "row_span", 1), getattr(cell, "column_span", 1))
+                for cell in table.cells
+            ]
+        ))
+    for image_key, image_url in image_urls.items():
+        page_num = int(image_key[1:].split("_")[0])
+        blocks.setdefault(page_num, []).append(block_record("image", image_url=image_url))
+    return blocks
+
+def build_markdown(result, image_snippets):
+    """Assemble the document markdown from an analysis result and per-page image snippets."""
+    pages = build_page_markdown(result, image_snippets)
+    return "# PDF Extraction Output\n\n" + "".join(pages[page_num] for page_num in sorted(pages))
+
+def extract_and_upload_images(pdf_bytes, document_id, output_dir=None, pages=None):
+    """
+    Extract every embedded image with PyMuPDF and upload them to storage in one batch.
+
+    ``pages`` limits extraction to a set of 1-based page numbers.
+
+    Runs independently of the Azure analysis so both can proceed at the same time.
+    Returns (image_urls, thumbnail_urls, image_markdown, optimization) where
+    image_markdown maps page number to the markdown snippets for that page and
+    optimization holds the image optimizer's counters.
+    """
+    extracted = []  # (page number, image index, image bytes, image ext)
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
     try:
-        # Initialize Azure Form Recognizer client
-        endpoint = os.getenv("AZURE_FORM_RECOGNIZER_ENDPOINT")
-        api_key = os.getenv("AZURE_FORM_RECOGNIZER_KEY")
-        
-        if not endpoint or not api_key:
-            raise ValueError("Azure Form Recognizer credentials not found in environment variables")
-            
-        client = DocumentAnalysisClient(endpoint, AzureKeyCredential(api_key))
-        print("✅ Azure Form Recognizer client initialized")
-        # Create directory structure
-        base_dir = Path("pdf_sources") / document_id
-        raw_dir = base_dir / "raw"
-        markdown_dir = base_dir / "extracted_markdown"
-        images_dir = base_dir / "extracted_images"
-
-        # Create directories
-        for dir_path in [base_dir, raw_dir, markdown_dir, images_dir]:
-            dir_path.mkdir(parents=True, exist_ok=True)
-        print("✅ Directories created")
-        # Initialize content storage
-        markdown_content = "# PDF Extraction Output\n\n"
-        content_map = {}
-        image_urls = {}
-        
-        # Analyze document with Azure Form Recognizer
-        poller = client.begin_analyze_document("prebuilt-document", document=pdf_buffer)
-        result = poller.result()
-        print("✅ Document analyzed")
-
-
-        # Process each page
-        if result.pages:
-            for page in result.pages:
-                page_num = page.page_number
-                content_map[page_num] = {
-                    "text": f"## Page {page_num}\n\n",
-                    "tables": [],
-                    "images": []
-                }
-                print("✅ Page content initialized")
-                # Add page dimensions
-                content_map[page_num]["text"] += f"**Page Dimensions:** {page.width} x {page.height}\n\n"
-                print("✅ Page dimensions added")
-
-                # Extract text
-                if page.lines:
-                    content_map[page_num]["text"] += "**Text Content:**\n\n"
-                    for line in page.lines:
-                        content_map[page_num]["text"] += f"{line.content}\n\n"
-                print("✅ Text content extracted")
-
-
-        # Extract and process tables
-        if result.tables:
-            print("✅ Tables found")
-            for table in result.tables:
-                table_markdown = "\n**Table:**\n\n"
-                for row in range(table.row_count):
-                    row_cells = [cell.content for cell in table.cells if cell.row_index == row]
-                    table_markdown += "| " + " | ".join(row_cells) + " |\n"
-                    if row == 0:
-                        table_markdown += "| " + " | ".join(["---"] * len(row_cells)) + " |\n"
-
-                if table.bounding_regions:
-                    page_number = table.bounding_regions[0].page_number
-                    content_map[page_number]["tables"].append(table_markdown)
-                print("✅ Tables extracted")
-
-        # Extract and process images using PyMuPDF
-        print("✅ PyMuPDF document opening")
-        doc = fitz.open(stream=pdf_buffer, filetype="pdf")
-        print("✅ PyMuPDF document opened")
         for page_number in range(len(doc)):
+            if pages is not None and page_number + 1 not in pages:
+                continue
             page = doc[page_number]
             images = page.get_images(full=True)
-            print("✅ Images found")
             for img_index, img in enumerate(images):
                 xref = img[0]
-                base_image = doc.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]
-                print("✅ Image extracted")
-                image_filename = f"page{page_number+1}_img{img_index+1}.{image_ext}"
-                s3_image_key = f"pdf_sources/extracted_images/{document_id}/{image_filename}"
-                print("✅ Image filename and S3 key initialized")
-                # Upload image to S3
-                try:
-                    image_url = upload_image_to_s3(image_bytes, s3_image_key, image_ext)
-                    image_urls[f"p{page_number + 1}_{img_index + 1}"] = image_url
-                    print("✅ Image uploaded to S3")
-                    # Save locally and add to markdown
-                    image_path = images_dir / image_filename
-                    with open(image_path, "wb") as f:
-                        f.write(image_bytes)
-                    print("✅ Image saved locally")
-                    image_markdown = f"\n![Image {page_number + 1}-{img_index + 1}]({image_url})\n"
-                    content_map[page_number + 1]["images"].append(image_markdown)
-                    print("✅ Image markdown added to content map")
-                except Exception as e:
-                    print(f"Failed to process image {image_filename}: {str(e)}")
-
-        # Combine all content in order
-        for page_number in sorted(content_map.keys()):
-            markdown_content += content_map[page_number]["text"]
-            for image_markdown in content_map[page_number]["images"]:
-                markdown_content += image_markdown
-            for table_markdown in content_map[page_number]["tables"]:
-                markdown_content += table_markdown
-
-        # Save markdown locally and to S3
-        markdown_filename = f"{Path(original_filename).stem}.md"
-        markdown_path = markdown_dir / markdown_filename
-        with open(markdown_path, "w", encoding="utf-8") as f:
-            f.write(markdown_content)
-
-        # Upload markdown to S3
-        s3_markdown_key = f"pdf_sources/extracted_markdown/{document_id}/{markdown_filename}"
-        markdown_url = upload_markdown_to_s3(markdown_content, s3_markdown_key)
-
+                with track_stage(PROCESSOR, "image_extraction"):
+                    base_image = doc.extract_image(xref)
+                extracted.append((page_number + 1, img_index + 1, base_image["image"], base_image["ext"]))
+    finally:
         doc.close()
 
-        return {
-            'source_type': 'pdf',
-            'document_id': document_id,
-            'urls': {
+    # Drop icons and shrink the rest before anything is uploaded (no-op unless enabled)
+    optimization = optimization_stats()
+    with track_stage(PROCESSOR, "image_optimization"):
+        optimized = optimize_images(((image_bytes, image_ext) for _, _, image_bytes, image_ext in extracted), optimization)
+    IMAGE_BYTES_SAVED.labels(PROCESSOR).inc(max(optimization['bytes_saved'], 0))
+
+    kept = []  # (page number, image index, storage key, thumbnail key)
+    pending_uploads = []
+    for (page_num, img_num, _, _), image in zip(extracted, optimized):
+        if image is None:
+            continue
+        image_filename = f"page{page_num}_img{img_num}.{image['ext']}"
+        s3_image_key = f"pdf_sources/extracted_images/{document_id}/{image_filename}"
+        pending_uploads.append((image['image'], s3_image_key, image['ext']))
+        thumbnail_key = None
+        if image['thumbnail']:
+            thumbnail_key = f"pdf_sources/extracted_images/{document_id}/thumbnails/page{page_num}_img{img_num}.{image['thumbnail_ext']}"
+            pending_uploads.append((image['thumbnail'], thumbnail_key, image['thumbnail_ext']))
+        kept.append((page_num, img_num, s3_image_key, thumbnail_key))
+        # Keep a local copy only when local output is enabled
+        save_local_output(output_dir, "extracted_images", image_filename, image['image'])
+
+    # Upload all images concurrently; failed uploads are left out of the markdown
+    with track_stage(PROCESSOR, "image_upload"):
+        uploaded = upload_images(pending_uploads)
+    IMAGES_PROCESSED.labels(PROCESSOR).inc(len(uploaded))
+    if len(uploaded) < len(pending_uploads):
+        FAILURES.labels(PROCESSOR, "image_upload").inc(len(pending_uploads) - len(uploaded))
+
+    image_urls = {}
+    thumbnail_urls = {}
+    image_markdown = {}
+    for page_num, img_num, s3_image_key, thumbnail_key in kept:
+        image_url = uploaded.get(s3_image_key)
+        if image_url is None:
+            continue
+        image_urls[f"p{page_num}_{img_num}"] = image_url
+        if thumbnail_key in uploaded:
+            thumbnail_urls[f"p{page_num}_{img_num}"] = uploaded[thumbnail_key]
+        image_markdown.setdefault(page_num, []).append(f"\n![Image {page_num}-{img_num}]({image_url})\n")
+    print(f"✅ {len(image_urls)} images extracted and uploaded")
+    return image_urls, thumbnail_urls, image_markdown, optimization
+
+def process_pdf_with_enterprise(pdf_buffer, document_id, original_filename, client=None, lineage=None):
+    """
+    Process a PDF with Azure Form Recognizer for text and tables and PyMuPDF for images.
+
+    The image extraction runs on a worker thread while the Azure analysis is polled, so
+    latency is roughly the slower of the two rather than their sum. Pages unchanged since
+    the lineage's previous revision are reused; only the changed pages are sliced out and
+    sent to Azure. Pass ``client`` to use a preconfigured (or stub) DocumentAnalysisClient.
+    """
+    try:
+        # Local copies go to a temporary directory only when explicitly enabled
+        with local_output_dir("pdf", document_id) as output_dir:
+            # Both consumers get the same immutable bytes, so neither disturbs the other's read position.
+            # getvalue() returns the buffer's bytes object itself rather than a copy.
+            pdf_bytes = pdf_buffer.getvalue()
+
+            block_writer = open_block_writer(document_id, f"pdf_sources/extracted_blocks/{document_id}/{Path(original_filename).stem}")
+            # Cached fragments only carry blocks when they were built for an export
+            settings = optimization_settings() + ("|blocks" if block_writer else "")
+            fingerprints = document_fingerprints(pdf_bytes)
+            reused, changed, incremental = plan_pages(PROCESSOR, lineage, settings, fingerprints)
+            page_markdown, page_blocks = {}, {}
+            image_urls, thumbnail_urls, image_optimization = {}, {}, optimization_stats()
+
+            if changed:
+                # Initialize Azure Form Recognizer client
+                if client is None:
+                    client = get_document_analysis_client()
+                print("✅ Azure Form Recognizer client initialized")
+                analysis_bytes = pdf_bytes if not reused else slice_pdf_pages(pdf_bytes, changed)
+
+                # Extract images locally while Azure analyzes the document
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    image_future = executor.submit(
+                        extract_and_upload_images, pdf_bytes, document_id, output_dir, set(changed) if reused else None
+                    )
+
+                    with track_stage(PROCESSOR, "remote_api_wait"):
+                        result = analyze_document(client, analysis_bytes)
+                    if reused:
+                        renumber_pages(result, changed)
+                    PAGES_PROCESSED.labels(PROCESSOR).inc(len(result.pages or []))
+                    print("✅ Document analyzed")
+
+                    image_urls, thumbnail_urls, image_snippets, image_optimization = image_future.result()
+
+                with track_stage(PROCESSOR, "parse"):
+                    page_markdown = build_page_markdown(result, image_snippets)
+                    page_blocks = build_page_blocks(result, image_urls) if block_writer else {}
+
+            # Fragments for every page: freshly built for changed pages, cached for the rest
+            fragments = []
+            for page_num in range(1, len(fingerprints) + 1):
+                fragment = reused.get(page_num)
+                if fragment is None:
+                    prefix = f"p{page_num}_"
+                    fragment = {
+                        'markdown': page_markdown.get(page_num, ""),
+                        'images': {key: url for key, url in image_urls.items() if key.startswith(prefix)},
+                        'thumbnails': {key: url for key, url in thumbnail_urls.items() if key.startswith(prefix)}
+                    }
+                    if block_writer:
+                        fragment['blocks'] = page_blocks.get(page_num, [])
+                if block_writer:
+                    block_writer.write_page(page_num, fragment['blocks'])
+                fragments.append(fragment)
+            save_page_fragments(PROCESSOR, lineage, settings, document_id, fingerprints, fragments, reused)
+
+            image_urls, thumbnail_urls = {}, {}
+            for fragment in fragments:
+                image_urls.update(fragment['images'])
+                thumbnail_urls.update(fragment['thumbnails'])
+            markdown_content = "# PDF Extraction Output\n\n" + "".join(fragment['markdown'] for fragment in fragments)
+            print("✅ Markdown assembled")
+
+            # Save markdown locally (when enabled) and to S3
+            markdown_filename = f"{Path(original_filename).stem}.md"
+            save_local_output(output_dir, "extracted_markdown", markdown_filename, markdown_content)
+
+            # Upload markdown to S3
+            s3_markdown_key = f"pdf_sources/extracted_markdown/{document_id}/{markdown_filename}"
+            with track_stage(PROCESSOR, "markdown_upload"):
+                markdown_url = upload_markdown(markdown_content, s3_markdown_key)
+            schedule_indexing(document_id, 'pdf', PROCESSOR, [fragment['markdown'] for fragment in fragments], markdown_url, original_filename)
+
+            urls = {
                 'markdown': markdown_url,
-                'images': image_url
-            },
-            'metadata': {
+                'images': image_urls,
+                'thumbnails': thumbnail_urls
+            }
+            structured_export = None
+            if block_writer:
+                with track_stage(PROCESSOR, "blocks_upload"):
+                    structured_export = block_writer.close()
+                urls['blocks'] = structured_export['url']
+
+            return {
                 'source_type': 'pdf',
-                'original_filename': original_filename,
-                'processing_date': datetime.now().strftime("%Y%m%d_%H%M%S"),
-                'content_type': 'document'
+                'document_id': document_id,
+                'urls': urls,
+                'metadata': {
+                    'source_type': 'pdf',
+                    'original_filename': original_filename,
+                    'processing_date': datetime.now().strftime("%Y%m%d_%H%M%S"),
+                    'content_type': 'document',
+                    'image_optimization': image_optimization,
+                    'incremental': incremental,
+                    'page_fingerprints': fingerprints if incremental['cached'] else None,
+                    'structured_export': structured_export
+                }
             }
-        }
 
     except Exception as e:
-        if 'doc' in locals():
-            doc.close()
-        raise Exception(f"Failed to process PDF with enterprise method: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Failed to process PDF with enterprise method: {str(e)}")
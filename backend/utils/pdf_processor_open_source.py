@@ -2,101 +2,210 @@ import fitz
 import shutil
 from pathlib import Path
 from datetime import datetime
-from backend.utils.s3 import upload_image_to_s3, upload_markdown_to_s3
+from backend.utils.storage import upload_image, upload_markdown
+from backend.utils.search_index import schedule_indexing
+from backend.utils.block_export import open_block_writer, block_record, cell_record
+from backend.utils.image_optimizer import optimize_images, optimization_stats, optimization_settings
+from backend.utils.page_cache import page_fingerprint, plan_pages, save_page_fragments
+from backend.utils.metrics import track_stage, PAGES_PROCESSED, IMAGES_PROCESSED, IMAGE_BYTES_SAVED
 import io
 
-def process_pdf_with_open_source(pdf_buffer: io.BytesIO, document_id: str, original_filename: str):
+PROCESSOR = "pdf_open_source"
+
+def extract_page(doc, page, page_num: int, document_id: str, image_optimization: dict, with_blocks: bool = False) -> dict:
+    """
+    Extract one page's tables, images and text.
+
+    Returns the page's fragment: its markdown plus the image and thumbnail URLs and
+    table count it contributes, so unchanged pages can be reused by later revisions.
+    With ``with_blocks`` the fragment also lists the page's blocks in reading order
+    for the structured export.
+    """
+    markdown_content = []
+    image_urls = {}
+    thumbnail_urls = {}
+    tables_found = 0
+    blocks = []
+
+    # Extract tables first
+    with track_stage(PROCESSOR, "table_detection"):
+        tables = page.find_tables()
+    table_areas = []  # Store table areas for text exclusion
+    
+    if tables and tables.tables:
+        tables_found += len(tables.tables)
+        for table in tables.tables:
+            cells = table.extract()
+            if cells:
+                header = cells[0]
+                table_start = len(markdown_content)
+                markdown_content.append('\n| ' + ' | '.join(str(cell) for cell in header) + ' |')
+                markdown_content.append('| ' + ' | '.join(['---' for _ in header]) + ' |')
+                for row in cells[1:]:
+                    markdown_content.append('| ' + ' | '.join(str(cell) for cell in row) + ' |')
+                markdown_content.append('\n')
+                if with_blocks:
+                    blocks.append(block_record(
+                        "table",
+                        table.bbox,
+                        "\n".join(markdown_content[table_start:]).strip(),
+                        # Cells covered by a merged cell come back as None
+                        [cell_record(r, c, text) for r, row in enumerate(cells) for c, text in enumerate(row) if text is not None]
+                    ))
+            
+            # Store table area
+            table_areas.append(table.bbox)  # Use bbox instead of rect
+    
+    # Extract images
+    image_list = page.get_images()
+    page_images = []
+    for img in image_list:
+        xref = img[0]
+        with track_stage(PROCESSOR, "image_extraction"):
+            base_image = doc.extract_image(xref)
+        page_images.append((base_image["image"], base_image["ext"]))
+
+    def image_bbox(img_index):
+        rects = page.get_image_rects(image_list[img_index][0])
+        return tuple(rects[0]) if rects else None
+
+    # Drop icons and shrink the rest before upload (no-op unless enabled)
+    with track_stage(PROCESSOR, "image_optimization"):
+        page_images = optimize_images(page_images, image_optimization)
+
+    for img_index, image in enumerate(page_images):
+        if image is None:
+            continue
+        image_bytes = image["image"]
+        image_ext = image["ext"]
+        
+        image_filename = f"image_p{page_num + 1}_{img_index + 1}.{image_ext}"
+        s3_image_key = f"pdf_sources/extracted_images/{document_id}/{image_filename}"
+        
+        try:
+            with track_stage(PROCESSOR, "image_upload"):
+                image_url = upload_image(image_bytes, s3_image_key, image_ext)
+                if image["thumbnail"]:
+                    thumbnail_key = f"pdf_sources/extracted_images/{document_id}/thumbnails/image_p{page_num + 1}_{img_index + 1}.{image['thumbnail_ext']}"
+                    thumbnail_urls[f"p{page_num + 1}_{img_index + 1}"] = upload_image(image["thumbnail"], thumbnail_key, image["thumbnail_ext"])
+            IMAGES_PROCESSED.labels(PROCESSOR).inc()
+            image_urls[f"p{page_num + 1}_{img_index + 1}"] = image_url
+            markdown_content.append(f"\n![Image {page_num + 1}-{img_index + 1}]({image_url})\n")
+            if with_blocks:
+                blocks.append(block_record("image", image_bbox(img_index), image_url=image_url))
+            
+        except Exception as e:
+            print(f"Failed to upload image {image_filename}: {str(e)}")
+            continue
+    
+    # Extract text
+    with track_stage(PROCESSOR, "parse"):
+        text_blocks = page.get_text("blocks")
+    for block in text_blocks:
+        # Check if block overlaps with any table
+        is_in_table = False
+        for table_bbox in table_areas:
+            # Check if the block intersects with table area
+            block_rect = fitz.Rect(block[:4])
+            if block_rect.intersects(table_bbox):
+                is_in_table = True
+                break
+        
+        if not is_in_table:
+            markdown_content.append(block[4] + "\n\n")
+            if with_blocks:
+                blocks.append(block_record("text", block[:4], block[4].strip()))
+    
+    markdown_content.append("\n---\n")
+    PAGES_PROCESSED.labels(PROCESSOR).inc()
+    fragment = {
+        'markdown': "\n".join(markdown_content),
+        'images': image_urls,
+        'thumbnails': thumbnail_urls,
+        'tables': tables_found
+    }
+    if with_blocks:
+        # Top to bottom, then left to right
+        fragment['blocks'] = sorted(blocks, key=lambda block: (block['bbox'][1], block['bbox'][0]) if block['bbox'] else (0, 0))
+    return fragment
+
+def process_pdf_with_open_source(pdf_buffer: io.BytesIO, document_id: str, original_filename: str, lineage: str = None):
+    """
+    Extract a PDF with PyMuPDF.
+
+    Pages whose fingerprint matches the same page of the lineage's previous revision
+    are taken from its stored fragments instead of being extracted again.
+    """
     print("Processing PDF with open source")
     try:
-        doc = fitz.open(stream=pdf_buffer, filetype="pdf")
+        with track_stage(PROCESSOR, "parse"):
+            doc = fitz.open(stream=pdf_buffer, filetype="pdf")
         base_name = Path(original_filename).stem
+        block_writer = open_block_writer(document_id, f"pdf_sources/extracted_blocks/{document_id}/{base_name}")
+        # Cached fragments only carry blocks when they were built for an export
+        settings = optimization_settings() + ("|blocks" if block_writer else "")
         
-        markdown_content = []
-        image_urls = {}
-        tables_found = 0
+        image_optimization = optimization_stats()
+        fingerprints = [page_fingerprint(doc, page) for page in doc]
+        reused, _, incremental = plan_pages(PROCESSOR, lineage, settings, fingerprints)
         
-        # Process the PDF
+        # Process the PDF, streaming each page's blocks to the structured export
+        fragments = []
         for page_num, page in enumerate(doc):
-            # Extract tables first
-            tables = page.find_tables()
-            table_areas = []  # Store table areas for text exclusion
-            
-            if tables and tables.tables:
-                tables_found += len(tables.tables)
-                for table in tables.tables:
-                    cells = table.extract()
-                    if cells:
-                        header = cells[0]
-                        markdown_content.append('\n| ' + ' | '.join(str(cell) for cell in header) + ' |')
-                        markdown_content.append('| ' + ' | '.join(['---' for _ in header]) + ' |')
-                        for row in cells[1:]:
-                            markdown_content.append('| ' + ' | '.join(str(cell) for cell in row) + ' |')
-                        markdown_content.append('\n')
-                    
-                    # Store table area
-                    table_areas.append(table.bbox)  # Use bbox instead of rect
-            
-            # Extract images
-            image_list = page.get_images()
-            for img_index, img in enumerate(image_list):
-                xref = img[0]
-                base_image = doc.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]
-                
-                image_filename = f"image_p{page_num + 1}_{img_index + 1}.{image_ext}"
-                s3_image_key = f"pdf_sources/extracted_images/{document_id}/{image_filename}"
-                
-                try:
-                    image_url = upload_image_to_s3(image_bytes, s3_image_key, image_ext)
-                    image_urls[f"p{page_num + 1}_{img_index + 1}"] = image_url
-                    markdown_content.append(f"\n![Image {page_num + 1}-{img_index + 1}]({image_url})\n")
-                    
-                except Exception as e:
-                    print(f"Failed to upload image {image_filename}: {str(e)}")
-                    continue
-            
-            # Extract text
-            text_blocks = page.get_text("blocks")
-            for block in text_blocks:
-                # Check if block overlaps with any table
-                is_in_table = False
-                for table_bbox in table_areas:
-                    # Check if the block intersects with table area
-                    block_rect = fitz.Rect(block[:4])
-                    if block_rect.intersects(table_bbox):
-                        is_in_table = True
-                        break
-                
-                if not is_in_table:
-                    markdown_content.append(block[4] + "\n\n")
-            
-            markdown_content.append("\n---\n")
+            fragment = reused.get(page_num + 1)
+            if fragment is None:
+                fragment = extract_page(doc, page, page_num, document_id, image_optimization, with_blocks=block_writer is not None)
+            if block_writer:
+                block_writer.write_page(page_num + 1, fragment['blocks'])
+            fragments.append(fragment)
         
         # Close the PDF before copying
         doc.close()
+        IMAGE_BYTES_SAVED.labels(PROCESSOR).inc(max(image_optimization['bytes_saved'], 0))
+        save_page_fragments(PROCESSOR, lineage, settings, document_id, fingerprints, fragments, reused)
+        
+        image_urls = {}
+        thumbnail_urls = {}
+        for fragment in fragments:
+            image_urls.update(fragment['images'])
+            thumbnail_urls.update(fragment['thumbnails'])
+        tables_found = sum(fragment['tables'] for fragment in fragments)
         
         # Upload markdown content with proper path
         markdown_filename = f"{base_name}.md"
         markdown_key = f"pdf_sources/extracted_markdown/{document_id}/{markdown_filename}"
-        markdown_content_str = "\n".join(markdown_content)
+        markdown_content_str = "\n".join(fragment['markdown'] for fragment in fragments)
         
-        # Use the existing upload_markdown_to_s3 function
-        markdown_url = upload_markdown_to_s3(markdown_content_str, markdown_key)
+        # Upload through the configured storage backend
+        with track_stage(PROCESSOR, "markdown_upload"):
+            markdown_url = upload_markdown(markdown_content_str, markdown_key)
+        schedule_indexing(document_id, 'pdf', PROCESSOR, [fragment['markdown'] for fragment in fragments], markdown_url, original_filename)
+
+        urls = {
+            'markdown': markdown_url,
+            'images': image_urls,
+            'thumbnails': thumbnail_urls
+        }
+        structured_export = None
+        if block_writer:
+            with track_stage(PROCESSOR, "blocks_upload"):
+                structured_export = block_writer.close()
+            urls['blocks'] = structured_export['url']
 
         return {
             'source_type': 'pdf',
             'document_id': document_id,
-            'urls':{
-                'markdown': markdown_url,
-                'images': image_urls
-            },
+            'urls': urls,
             'metadata': {
                 'source_type': 'pdf',
                 'original_filename': original_filename,
                 'content_type': 'document',
                 'image_count': len(image_urls),
-                'tables_found': tables_found
+                'tables_found': tables_found,
+                'image_optimization': image_optimization,
+                'incremental': incremental,
+                'page_fingerprints': fingerprints if incremental['cached'] else None,
+                'structured_export': structured_export
             }
         }
         
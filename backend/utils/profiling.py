@@ -0,0 +1,48 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+from backend.utils.storage import get_storage
+
+# Per-request profiling is only honoured when enabled for the deployment
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SUMMARY_LINES = int(os.getenv("PROFILE_SUMMARY_LINES", 40))
+
+TRUTHY = {"1", "true", "yes", "on"}
+
+def profiling_requested(query_flag: bool, header_value: str = None) -> bool:
+    """True if the request asked for a profile via query flag or X-Profile header"""
+    return bool(query_flag) or (header_value or "").strip().lower() in TRUTHY
+
+def run_profiled(func, *args, **kwargs):
+    """
+    Run func under cProfile and return (result, profiler).
+
+    Only the calling thread is profiled; work handed to worker pools shows up as
+    time spent waiting on their futures.
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    return result, profiler
+
+def store_profile(profiler: cProfile.Profile, source_type: str, document_id: str) -> dict:
+    """
+    Store the profile next to the document's extracted markdown.
+
+    Writes a pstats file (load with ``pstats.Stats(path)`` or snakeviz) and a text
+    summary of the top functions by cumulative time; returns their URLs.
+    """
+    prefix = f"{source_type}_sources/extracted_markdown/{document_id}"
+
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    # Serialise before sorting/printing; this is the format pstats.Stats.dump_stats writes
+    raw_stats = marshal.dumps(stats.stats)
+    stats.sort_stats("cumulative").print_stats(PROFILE_SUMMARY_LINES)
+
+    storage = get_storage()
+    return {
+        'pstats': storage.put(f"{prefix}/profile.pstats", raw_stats, 'application/octet-stream'),
+        'summary': storage.put(f"{prefix}/profile.txt", summary.getvalue().encode('utf-8'), 'text/plain')
+    }
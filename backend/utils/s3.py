@@ -1,5 +1,7 @@
-import boto3
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from pathlib import Path
 import io
@@ -8,21 +10,50 @@ AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = os.getenv("AWS_REGION")
 AWS_S3_BUCKET_NAME = os.getenv("AWS_S3_BUCKET_NAME")
+# Optional S3-compatible endpoint (MinIO, moto_server, LocalStack) used instead of AWS
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")
 
-# Add error checking for environment variables
-if not all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, AWS_S3_BUCKET_NAME]):
-    raise ValueError("Missing required AWS credentials in .env file")
+# Directory uploads: files in flight at once, and multipart settings per file
+S3_TRANSFER_MAX_WORKERS = int(os.getenv("S3_TRANSFER_MAX_WORKERS", 8))
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", 8 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", 8 * 1024 * 1024))
+S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY", 4))
 
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
+# The boto3 client is created on first use so importing this module stays cheap
+_s3_client = None
+_s3_client_lock = threading.Lock()
+_bucket_checked = threading.Event()
+
+def get_s3_client():
+    """Return the shared boto3 S3 client, creating it on first use"""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                # Add error checking for environment variables
+                if not all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, AWS_S3_BUCKET_NAME]):
+                    raise ValueError("Missing required AWS credentials in .env file")
+
+                import boto3
+                _s3_client = boto3.client(
+                    "s3",
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                    region_name=AWS_REGION,
+                    endpoint_url=AWS_S3_ENDPOINT_URL
+                )
+    return _s3_client
+
+def s3_object_url(key: str) -> str:
+    """Public URL of an object in the bucket"""
+    if AWS_S3_ENDPOINT_URL:
+        # S3-compatible stand-ins are addressed path-style
+        return f"{AWS_S3_ENDPOINT_URL.rstrip('/')}/{AWS_S3_BUCKET_NAME}/{key}"
+    return f"https://{AWS_S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{key}"
 
 def test_s3_connection():
     try:
-        s3_client.head_bucket(Bucket=AWS_S3_BUCKET_NAME)
+        get_s3_client().head_bucket(Bucket=AWS_S3_BUCKET_NAME)
         return True
     except Exception as e:
         print(f"S3 Connection Error: {str(e)}")
@@ -43,7 +74,7 @@ def ensure_s3_structure():
     
     try:
         for folder in base_folders:
-            s3_client.put_object(
+            get_s3_client().put_object(
                 Bucket=AWS_S3_BUCKET_NAME,
                 Key=folder
             )
@@ -59,21 +90,21 @@ def upload_to_s3(content: bytes, key: str, content_type: str = None) -> str:
         if content_type:
             extra_args['ContentType'] = content_type
             
-        s3_client.put_object(
+        get_s3_client().put_object(
             Bucket=AWS_S3_BUCKET_NAME,
             Key=key,
             Body=content,
             **extra_args
         )
         
-        return f"https://{AWS_S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{key}"
+        return s3_object_url(key)
     except Exception as e:
         raise Exception(f"Failed to upload to S3: {str(e)}")
 
 def get_from_s3(key: str) -> bytes:
     """Get content from S3"""
     try:
-        response = s3_client.get_object(
+        response = get_s3_client().get_object(
             Bucket=AWS_S3_BUCKET_NAME,
             Key=key
         )
@@ -81,16 +112,17 @@ def get_from_s3(key: str) -> bytes:
     except Exception as e:
         raise Exception(f"Failed to get file from S3: {str(e)}")
 
-def upload_image_buffer_to_s3(image_buffer: io.BytesIO, key: str) -> str:
-    """Upload image buffer to S3 and return the URL"""
+def upload_image_buffer_to_s3(image_buffer: io.BytesIO, key: str, image_ext: str = 'png') -> str:
+    """Stream an image file object to S3 and return the URL"""
     try:
-        s3_client.upload_fileobj(
+        content_type = f'image/{image_ext}' if image_ext in ['jpeg', 'jpg', 'png', 'gif', 'webp'] else 'application/octet-stream'
+        get_s3_client().upload_fileobj(
             image_buffer,
             AWS_S3_BUCKET_NAME,
             key,
-            ExtraArgs={'ContentType': 'image/png'}
+            ExtraArgs={'ContentType': content_type, 'ACL': 'public-read'}
         )
-        return f"https://{AWS_S3_BUCKET_NAME}.s3.amazonaws.com/{key}"
+        return s3_object_url(key)
     except Exception as e:
         raise Exception(f"Failed to upload image to S3: {str(e)}")
         
@@ -98,14 +130,14 @@ def upload_image_to_s3(image_bytes: bytes, key: str, image_ext: str) -> str:
     """Helper function to upload an image to S3 and return its URL"""
     try:
         content_type = f'image/{image_ext}' if image_ext in ['jpeg', 'jpg', 'png'] else 'application/octet-stream'
-        s3_client.put_object(
+        get_s3_client().put_object(
             Bucket=AWS_S3_BUCKET_NAME,
             Key=key,
             Body=image_bytes,
             ContentType=content_type,
             ACL='public-read'
         )
-        return f"https://{AWS_S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{key}"
+        return s3_object_url(key)
     except Exception as e:
         raise Exception(f"Failed to upload image to S3: {str(e)}")
     
@@ -118,101 +150,171 @@ def upload_pdf_to_s3(file_content: bytes, original_filename: str, document_id: s
     try:
         # Upload original PDF
         raw_key = f"pdf_sources/raw/{document_id}/{original_filename}"
-        s3_client.put_object(
+        get_s3_client().put_object(
             Bucket=AWS_S3_BUCKET_NAME,
             Key=raw_key,
             Body=file_content
         )
-        urls['raw_pdf'] = f"https://{AWS_S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{raw_key}"
+        urls['raw_pdf'] = s3_object_url(raw_key)
         
         return urls
     except Exception as e:
         raise Exception(f"Failed to upload PDF to S3: {e}")
 
-def upload_processed_content_to_s3(local_directory: str, document_id: str, source_type: str) -> dict:
+def _processed_file_target(relative_path: Path, document_id: str, source_type: str):
+    """Return (s3_key, content_type, url_label) for a file under a processed output directory, or None to skip it"""
+    parts = relative_path.parts
+    filename = relative_path.name
+
+    if parts[0] == 'raw':
+        # Only direct children of raw/ for PDF sources, as before
+        if source_type != 'pdf' or len(parts) != 2:
+            return None
+        return f"{source_type}_sources/raw/{document_id}/{filename}", 'application/pdf', 'raw_file'
+
+    if 'extracted_markdown' in parts:
+        return f"{source_type}_sources/extracted_markdown/{document_id}/{filename}", 'text/markdown', str(relative_path)
+
+    if 'extracted_images' in parts:
+        ext = filename.lower().split('.')[-1]
+        if ext in ['png']:
+            content_type = 'image/png'
+        elif ext in ['jpg', 'jpeg']:
+            content_type = 'image/jpeg'
+        else:
+            content_type = 'application/octet-stream'
+        return f"{source_type}_sources/extracted_images/{document_id}/{filename}", content_type, str(relative_path)
+
+    return None
+
+def upload_processed_content_to_s3(local_directory: str, document_id: str, source_type: str, transfers: dict = None) -> dict:
     """
-    Uploads processed content with proper content types and disposition
+    Uploads processed content with proper content types and disposition.
+
+    Files are uploaded concurrently (S3_TRANSFER_MAX_WORKERS at a time) through the boto3
+    transfer manager, which streams each file from disk and switches to parallel multipart
+    uploads above S3_MULTIPART_THRESHOLD. Returns the URL of each uploaded file, keyed by
+    'raw_file' for the original PDF and by relative path for everything else.
+
+    Pass a ``transfers`` dict to have it filled with {key, bytes, seconds} per file under
+    the same labels. Uploaded bytes are also counted in BYTES_UPLOADED ("processed").
     """
-    urls = {}
+    from backend.utils.metrics import BYTES_UPLOADED
+    from boto3.s3.transfer import TransferConfig
+
     base_path = Path(local_directory)  # Convert string to Path object
+    transfer_config = TransferConfig(
+        multipart_threshold=S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+        max_concurrency=S3_MULTIPART_CONCURRENCY
+    )
+
+    uploads = []
+    for local_path in base_path.rglob('*'):
+        if not local_path.is_file():
+            continue
+        relative_path = local_path.relative_to(base_path)
+        target = _processed_file_target(relative_path, document_id, source_type)
+        if target:
+            uploads.append((local_path, *target))
+
+    def upload_one(local_path, s3_key, content_type):
+        started = time.perf_counter()
+        get_s3_client().upload_file(
+            str(local_path),
+            AWS_S3_BUCKET_NAME,
+            s3_key,
+            ExtraArgs={'ACL': 'public-read', 'ContentType': content_type, 'ContentDisposition': 'inline'},
+            Config=transfer_config
+        )
+        return time.perf_counter() - started
+
+    urls = {}
     try:
-        # Handle raw files (PDF)  
-        if source_type == 'pdf':  
-            raw_dir = base_path / "raw"
-            if raw_dir.exists():
-                for file in raw_dir.iterdir():
-                    if file.is_file():
-                        raw_key = f"{source_type}_sources/raw/{document_id}/{file.name}"
-                        with open(file, 'rb') as f:
-                            s3_client.put_object(
-                                Bucket=AWS_S3_BUCKET_NAME,
-                                Key=raw_key,
-                                Body=f.read(),
-                                ACL='public-read',
-                                ContentType='application/pdf',
-                                ContentDisposition='inline'
-                            )
-                        urls['raw_file'] = f"https://{AWS_S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{raw_key}"
-
-        # Handle markdown and images
-        for root, _, files in os.walk(base_path):
-            for filename in files:  # Changed 'file' to 'filename'
-                local_path = Path(root) / filename  # Use filename string
-                relative_path = local_path.relative_to(base_path)
-                
-                # Skip raw directory as we've already handled it
-                if 'raw' in str(relative_path):
-                    continue
-                
-                # Determine the correct S3 prefix and content type
-                if 'extracted_markdown' in str(relative_path):
-                    s3_prefix = f"{source_type}_sources/extracted_markdown/{document_id}"
-                    content_type = 'text/markdown'
-                elif 'extracted_images' in str(relative_path):
-                    s3_prefix = f"{source_type}_sources/extracted_images/{document_id}"
-                    ext = filename.lower().split('.')[-1]  # Get extension from filename
-                    if ext in ['png']:
-                        content_type = 'image/png'
-                    elif ext in ['jpg', 'jpeg']:
-                        content_type = 'image/jpeg'
-                    else:
-                        content_type = 'application/octet-stream'
-                else:
-                    continue
-                
-                s3_key = f"{s3_prefix}/{filename}"  # Use filename directly
-                
-                # Upload file with proper content type
-                with open(local_path, 'rb') as f:
-                    s3_client.put_object(
-                        Bucket=AWS_S3_BUCKET_NAME,
-                        Key=s3_key,
-                        Body=f.read(),
-                        ACL='public-read',
-                        ContentType=content_type,
-                        ContentDisposition='inline'
-                    )
-                    urls[str(relative_path)] = f"https://{AWS_S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
-        
+        with ThreadPoolExecutor(max_workers=max(1, min(S3_TRANSFER_MAX_WORKERS, len(uploads)))) as executor:
+            futures = {
+                executor.submit(upload_one, local_path, s3_key, content_type): (local_path, s3_key, label)
+                for local_path, s3_key, content_type, label in uploads
+            }
+            for future in as_completed(futures):
+                local_path, s3_key, label = futures[future]
+                seconds = future.result()
+                size = local_path.stat().st_size
+                urls[label] = s3_object_url(s3_key)
+                BYTES_UPLOADED.labels("processed").inc(size)
+                if transfers is not None:
+                    transfers[label] = {'key': s3_key, 'bytes': size, 'seconds': round(seconds, 4)}
+
         return urls
     except Exception as e:
         raise Exception(f"Failed to upload content to S3: {str(e)}")  # Added str() for better error messages
 
 def upload_markdown_to_s3(content: str, key: str) -> str:
-    """Upload markdown content to S3"""
+    """Upload markdown content to S3, compressed with Content-Encoding above the configured size"""
+    from backend.utils.compression import compress_markdown
     try:
-        s3_client.put_object(
+        body, encoding = compress_markdown(content.encode('utf-8'))
+        extra_args = {'ContentEncoding': encoding} if encoding else {}
+        get_s3_client().put_object(
             Bucket=AWS_S3_BUCKET_NAME,
             Key=key,
-            Body=content.encode('utf-8'),
-            ContentType='text/markdown'
+            Body=body,
+            ContentType='text/markdown',
+            **extra_args
         )
-        return f"https://{AWS_S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{key}"
+        return s3_object_url(key)
     except Exception as e:
         raise Exception(f"Failed to upload markdown to S3: {str(e)}")
-    
-# Run this when the module loads to ensure S3 structure exists
-ensure_s3_structure()
 
-if not test_s3_connection():
-    print("WARNING: Cannot access S3 bucket. Please check your credentials and permissions.")
\ No newline at end of file
+def verify_s3_bucket():
+    """
+    Ensure the S3 folder structure exists and the bucket is reachable.
+
+    Runs at most once per process; intended to be scheduled in the background after
+    startup rather than at import time.
+    """
+    if _bucket_checked.is_set():
+        return
+    _bucket_checked.set()
+    try:
+        ensure_s3_structure()
+        if not test_s3_connection():
+            print("WARNING: Cannot access S3 bucket. Please check your credentials and permissions.")
+    except Exception as e:
+        print(f"WARNING: S3 startup check failed: {str(e)}")
+
+def create_presigned_put(key: str, content_type: str, expires_in: int) -> str:
+    """URL a client can PUT an object to directly; the request must send the same Content-Type"""
+    return get_s3_client().generate_presigned_url(
+        'put_object',
+        Params={'Bucket': AWS_S3_BUCKET_NAME, 'Key': key, 'ContentType': content_type},
+        ExpiresIn=expires_in
+    )
+
+def create_presigned_multipart(key: str, content_type: str, part_count: int, expires_in: int) -> dict:
+    """Start a multipart upload and presign a PUT URL for each of its parts"""
+    upload = get_s3_client().create_multipart_upload(Bucket=AWS_S3_BUCKET_NAME, Key=key, ContentType=content_type)
+    upload_id = upload['UploadId']
+    return {
+        'upload_id': upload_id,
+        'parts': [
+            {
+                'part_number': part_number,
+                'url': get_s3_client().generate_presigned_url(
+                    'upload_part',
+                    Params={'Bucket': AWS_S3_BUCKET_NAME, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number},
+                    ExpiresIn=expires_in
+                )
+            }
+            for part_number in range(1, part_count + 1)
+        ]
+    }
+
+def complete_multipart_upload(key: str, upload_id: str, parts: list) -> None:
+    """Assemble the uploaded parts, given as (part_number, etag) pairs"""
+    get_s3_client().complete_multipart_upload(
+        Bucket=AWS_S3_BUCKET_NAME,
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': etag} for number, etag in sorted(parts)]}
+    )
@@ -0,0 +1,186 @@
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from backend.utils.metrics import SEARCH_INDEX_PAGES
+
+# Full-text index over extracted markdown, updated in the background as processors finish.
+# Off unless SEARCH_INDEX_PATH names the database file; SEARCH_INDEX_ENABLED=false turns it off again
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH")
+SEARCH_INDEX_ENABLED = bool(SEARCH_INDEX_PATH) and os.getenv("SEARCH_INDEX_ENABLED", "true").lower() == "true"
+# Best-matching pages reported per document
+SEARCH_MAX_PAGES_PER_DOCUMENT = int(os.getenv("SEARCH_MAX_PAGES_PER_DOCUMENT", 3))
+
+# Images (including embedded base64 data URIs) carry no searchable text
+IMAGE_PATTERN = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+TOKEN_PATTERN = re.compile(r"\w+\*?")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    document_id TEXT PRIMARY KEY,
+    source_type TEXT,
+    processor TEXT,
+    title TEXT,
+    markdown_url TEXT,
+    first_row INTEGER,
+    page_count INTEGER,
+    indexed_at TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(
+    content,
+    document_id UNINDEXED,
+    page UNINDEXED,
+    tokenize = 'porter unicode61'
+);
+"""
+
+def searchable_text(markdown: str) -> str:
+    return IMAGE_PATTERN.sub(" ", markdown or "")
+
+def match_expression(query: str) -> str:
+    """
+    Turn free text into an FTS5 query matching pages that contain every term.
+
+    Terms are quoted so user input cannot inject FTS5 syntax; a trailing ``*`` keeps
+    its prefix-match meaning.
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(query or ""):
+        prefix = token.endswith("*")
+        word = token.rstrip("*")
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " ".join(terms)
+
+class SearchIndex:
+    """
+    SQLite FTS5 index with one row per extracted page.
+
+    Each document's pages occupy a contiguous rowid range recorded in ``documents``, so
+    re-indexing a document deletes its old pages by rowid instead of scanning the
+    index. Every thread gets its own connection; WAL mode lets searches run while the
+    indexing thread writes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def add_document(self, document_id: str, source_type: str, processor: str, pages, markdown_url: str = None, title: str = None) -> int:
+        """Index a document's page markdown (page 1 first), replacing any earlier version; returns the pages indexed"""
+        rows = [searchable_text(markdown) for markdown in pages]
+        connection = self._connection()
+        with self._write_lock, connection:
+            previous = connection.execute(
+                "SELECT first_row, page_count FROM documents WHERE document_id = ?", (document_id,)
+            ).fetchone()
+            if previous:
+                connection.execute(
+                    "DELETE FROM pages WHERE rowid BETWEEN ? AND ?", (previous[0], previous[0] + previous[1] - 1)
+                )
+            last = connection.execute("SELECT rowid FROM pages ORDER BY rowid DESC LIMIT 1").fetchone()
+            first_row = (last[0] if last else 0) + 1
+            connection.executemany(
+                "INSERT INTO pages (rowid, content, document_id, page) VALUES (?, ?, ?, ?)",
+                [(first_row + i, text, document_id, i + 1) for i, text in enumerate(rows)]
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (document_id, source_type, processor, title, markdown_url, first_row, len(rows),
+                 datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+        return len(rows)
+
+    def search(self, query: str, limit: int = 10, source_type: str = None, pages_per_document: int = SEARCH_MAX_PAGES_PER_DOCUMENT) -> list:
+        """
+        Documents ranked by their best-matching page (BM25), each with snippets of its top pages.
+
+        Returns a list of dicts with document_id, score (lower is better, as in FTS5),
+        the document's metadata and a ``pages`` list of {page, snippet}.
+        """
+        expression = match_expression(query)
+        if not expression:
+            return []
+        # Rank and cut inside FTS5 first, so snippets and the join only cover the top hits
+        filter_sql = ""
+        params = [expression]
+        if source_type:
+            filter_sql = " AND document_id IN (SELECT document_id FROM documents WHERE source_type = ?)"
+            params.append(source_type)
+        # Enough page hits to fill `limit` documents in the common case
+        params.append(limit * max(pages_per_document, 1) * 4)
+        sql = (
+            "SELECT hits.document_id, hits.page, hits.snippet, hits.rank, "
+            "documents.source_type, documents.processor, documents.title, documents.markdown_url "
+            "FROM (SELECT document_id, page, snippet(pages, 0, '**', '**', '…', 16) AS snippet, rank "
+            f"FROM pages WHERE pages MATCH ?{filter_sql} ORDER BY rank LIMIT ?) AS hits "
+            "JOIN documents ON documents.document_id = hits.document_id ORDER BY hits.rank"
+        )
+
+        results = {}
+        for document_id, page, snippet, score, source, processor, title, markdown_url in self._connection().execute(sql, params):
+            result = results.get(document_id)
+            if result is None:
+                if len(results) >= limit:
+                    continue
+                result = results[document_id] = {
+                    "document_id": document_id,
+                    "score": score,
+                    "source_type": source,
+                    "processor": processor,
+                    "title": title,
+                    "markdown_url": markdown_url,
+                    "pages": []
+                }
+            if len(result["pages"]) < pages_per_document:
+                result["pages"].append({"page": page, "snippet": " ".join(snippet.split())})
+        return list(results.values())
+
+    def stats(self) -> dict:
+        documents, pages = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(page_count), 0) FROM documents"
+        ).fetchone()
+        return {"documents": documents, "pages": pages}
+
+_index = None
+_index_lock = threading.Lock()
+# A single writer: SQLite serializes writes anyway, and indexing stays off the request threads
+_indexer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+
+def get_search_index() -> SearchIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SearchIndex(SEARCH_INDEX_PATH)
+    return _index
+
+def _index_document(document_id, source_type, processor, pages, markdown_url, title):
+    try:
+        count = get_search_index().add_document(document_id, source_type, processor, pages, markdown_url, title)
+        SEARCH_INDEX_PAGES.labels(source_type).inc(count)
+    except Exception as e:
+        # Search is best effort; the extraction result is already stored
+        print(f"Failed to index {document_id} for search: {str(e)}")
+
+def schedule_indexing(document_id: str, source_type: str, processor: str, pages, markdown_url: str = None, title: str = None):
+    """Queue a document's page markdown for indexing; returns the future, or None when search is disabled"""
+    if not SEARCH_INDEX_ENABLED:
+        return None
+    return _indexer.submit(_index_document, document_id, source_type, processor, list(pages), markdown_url, title)
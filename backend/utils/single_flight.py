@@ -0,0 +1,64 @@
+import asyncio
+import os
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from backend.utils.metrics import REQUESTS_COALESCED
+
+# Identical requests arriving while one is already running share its result
+REQUEST_COALESCING_ENABLED = os.getenv("REQUEST_COALESCING_ENABLED", "true").lower() == "true"
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of a URL for spotting duplicate requests.
+
+    Lowercases the scheme and host, drops default ports, fragments and a bare trailing
+    slash, and sorts the query parameters.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path if parts.path not in ("", "/") else ""
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time; concurrent callers with the same key wait
+    for it and share its result or exception.
+
+    The computation runs as its own task, so a caller that disconnects does not cancel
+    it for the others. Must be used from the event loop thread.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    async def run(self, key, compute, source: str, category: str):
+        """
+        Await ``compute()`` (a coroutine function) for ``key``, or join the run already in progress.
+
+        ``source`` and ``category`` label the coalescing metric.
+        """
+        if not REQUEST_COALESCING_ENABLED:
+            return await compute()
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            REQUESTS_COALESCED.labels(source, category.lower()).inc()
+        else:
+            task = asyncio.ensure_future(compute())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        self._in_flight.pop(key, None)
+        # Every waiter may have gone away; retrieve the exception so it is not reported as unhandled
+        if not task.cancelled():
+            task.exception()
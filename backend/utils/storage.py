@@ -0,0 +1,394 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from backend.utils.metrics import BYTES_UPLOADED
+from backend.utils.compression import compress_markdown
+from backend.utils.image_store import SHARED_IMAGE_STORE_ENABLED, image_digest, shared_image_key, find_shared_image, get_image_index
+
+# Which backend stores extracted content: s3 (default), local or memory
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3").lower()
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "storage")
+# Optional public base URL for the local backend, e.g. a static file server in front of LOCAL_STORAGE_DIR
+LOCAL_STORAGE_BASE_URL = os.getenv("LOCAL_STORAGE_BASE_URL")
+STORAGE_MAX_WORKERS = int(os.getenv("STORAGE_MAX_WORKERS", 8))
+
+def image_content_type(image_ext: str) -> str:
+    """Map an image extension to its MIME type"""
+    image_ext = image_ext.lower()
+    if image_ext in ['jpeg', 'jpg']:
+        return 'image/jpeg'
+    if image_ext in ['png', 'gif', 'webp']:
+        return f'image/{image_ext}'
+    return 'application/octet-stream'
+
+class StorageBackend:
+    """Interface shared by every storage backend"""
+
+    name = None
+    # Whether objects are served with their Content-Encoding, so compressed bodies reach clients decoded
+    supports_content_encoding = False
+
+    def put(self, key: str, body, content_type: str = None, **extra_args) -> str:
+        """Store bytes under key and return the object's URL"""
+        raise NotImplementedError
+
+    def put_fileobj(self, fileobj, key: str, content_type: str = None, **extra_args) -> str:
+        """Store a readable file object under key and return the object's URL"""
+        return self.put(key, fileobj.read(), content_type, **extra_args)
+
+    def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def open(self, key: str):
+        """Readable stream of an object, for reading large objects in chunks"""
+        import io
+        return io.BytesIO(self.get(key))
+
+    def presign_upload(self, key: str, content_type: str, size: int, expires_in: int, part_size: int) -> dict:
+        """
+        Let a client upload an object straight to the backend.
+
+        Returns a single presigned PUT, or a multipart upload with one presigned URL per
+        part when ``size`` exceeds ``part_size``; multipart uploads are finished with
+        complete_upload(). Backends clients cannot reach directly do not support this.
+        """
+        raise NotImplementedError(f"The {self.name} storage backend does not support direct uploads")
+
+    def complete_upload(self, key: str, upload_id: str, parts) -> None:
+        """Finish a multipart upload from its (part_number, etag) pairs"""
+        raise NotImplementedError(f"The {self.name} storage backend does not support direct uploads")
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        raise NotImplementedError
+
+    def verify(self) -> None:
+        """One-time startup check; backends without remote state have nothing to do"""
+
+    def put_many(self, items, max_workers: int = None) -> dict:
+        """
+        Store many objects concurrently.
+
+        :param items: Iterable of (key, body, content_type) or (key, body, content_type, extra_args).
+        :return: Dict mapping each stored key to its URL; failed puts are logged and omitted.
+        """
+        items = list(items)
+        if not items:
+            return {}
+
+        def put_item(item):
+            key, body, content_type, *rest = item
+            return key, self.put(key, body, content_type, **(rest[0] if rest else {}))
+
+        urls = {}
+        workers = min(max_workers or STORAGE_MAX_WORKERS, len(items))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(put_item, item) for item in items]
+            for item, future in zip(items, futures):
+                try:
+                    key, url = future.result()
+                    urls[key] = url
+                except Exception as e:
+                    print(f"Failed to store {item[0]}: {str(e)}")
+        return urls
+
+class S3Storage(StorageBackend):
+    """Stores objects in the configured S3 bucket"""
+
+    name = "s3"
+    supports_content_encoding = True
+
+    def put(self, key, body, content_type=None, **extra_args):
+        from backend.utils.s3 import get_s3_client, AWS_S3_BUCKET_NAME
+        if content_type:
+            extra_args['ContentType'] = content_type
+        get_s3_client().put_object(Bucket=AWS_S3_BUCKET_NAME, Key=key, Body=body, **extra_args)
+        return self.url(key)
+
+    def put_fileobj(self, fileobj, key, content_type=None, **extra_args):
+        from backend.utils.s3 import get_s3_client, AWS_S3_BUCKET_NAME
+        if content_type:
+            extra_args['ContentType'] = content_type
+        get_s3_client().upload_fileobj(fileobj, AWS_S3_BUCKET_NAME, key, ExtraArgs=extra_args)
+        return self.url(key)
+
+    def get(self, key):
+        from backend.utils.s3 import get_s3_client, AWS_S3_BUCKET_NAME
+        response = get_s3_client().get_object(Bucket=AWS_S3_BUCKET_NAME, Key=key)
+        return response['Body'].read()
+
+    def open(self, key):
+        from backend.utils.s3 import get_s3_client, AWS_S3_BUCKET_NAME
+        # The body streams from S3 as it is read
+        return get_s3_client().get_object(Bucket=AWS_S3_BUCKET_NAME, Key=key)['Body']
+
+    def presign_upload(self, key, content_type, size, expires_in, part_size):
+        from backend.utils.s3 import create_presigned_put, create_presigned_multipart
+        if size <= part_size:
+            return {
+                'method': 'PUT',
+                'url': create_presigned_put(key, content_type, expires_in),
+                'headers': {'Content-Type': content_type}
+            }
+        part_count = -(-size // part_size)
+        upload = create_presigned_multipart(key, content_type, part_count, expires_in)
+        return {'method': 'multipart', 'part_size': part_size, **upload}
+
+    def complete_upload(self, key, upload_id, parts):
+        from backend.utils.s3 import complete_multipart_upload
+        complete_multipart_upload(key, upload_id, parts)
+
+    def exists(self, key):
+        from backend.utils.s3 import get_s3_client, AWS_S3_BUCKET_NAME
+        from botocore.exceptions import ClientError
+        try:
+            get_s3_client().head_object(Bucket=AWS_S3_BUCKET_NAME, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def url(self, key):
+        from backend.utils.s3 import s3_object_url
+        return s3_object_url(key)
+
+    def verify(self):
+        from backend.utils.s3 import verify_s3_bucket
+        verify_s3_bucket()
+
+class LocalStorage(StorageBackend):
+    """Stores objects as files under a local directory"""
+
+    name = "local"
+
+    def __init__(self, root: str = LOCAL_STORAGE_DIR, base_url: str = LOCAL_STORAGE_BASE_URL):
+        self.root = Path(root).resolve()
+        self.base_url = base_url.rstrip('/') if base_url else None
+
+    def _path(self, key):
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def put(self, key, body, content_type=None, **extra_args):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+        return self.url(key)
+
+    def put_fileobj(self, fileobj, key, content_type=None, **extra_args):
+        import shutil
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(fileobj, f)
+        return self.url(key)
+
+    def get(self, key):
+        return self._path(key).read_bytes()
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def exists(self, key):
+        return self._path(key).is_file()
+
+    def url(self, key):
+        if self.base_url:
+            return f"{self.base_url}/{key}"
+        return self._path(key).as_uri()
+
+class MemoryStorage(StorageBackend):
+    """Keeps objects in a process-local dict; intended for benchmarks and offline runs"""
+
+    name = "memory"
+    supports_content_encoding = True
+
+    def __init__(self):
+        self.objects = {}
+        self.content_types = {}
+        self.content_encodings = {}
+        self._lock = threading.Lock()
+
+    def put(self, key, body, content_type=None, **extra_args):
+        with self._lock:
+            self.objects[key] = bytes(body)
+            self.content_types[key] = content_type
+            self.content_encodings[key] = extra_args.get('ContentEncoding')
+        return self.url(key)
+
+    def get(self, key):
+        with self._lock:
+            body = self.objects[key]
+        # A fresh copy, like a download from the real backends
+        return bytes(bytearray(body))
+
+    def exists(self, key):
+        with self._lock:
+            return key in self.objects
+
+    def url(self, key):
+        return f"memory://{key}"
+
+STORAGE_BACKENDS = {
+    S3Storage.name: S3Storage,
+    LocalStorage.name: LocalStorage,
+    MemoryStorage.name: MemoryStorage,
+}
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage() -> StorageBackend:
+    """Return the configured storage backend, creating it on first use"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if STORAGE_BACKEND not in STORAGE_BACKENDS:
+                    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+                _storage = STORAGE_BACKENDS[STORAGE_BACKEND]()
+    return _storage
+
+def set_storage(backend: StorageBackend) -> None:
+    """Replace the active storage backend (e.g. with MemoryStorage for benchmarks)"""
+    global _storage
+    with _storage_lock:
+        _storage = backend
+
+def upload_file(content: bytes, key: str, content_type: str = None) -> str:
+    """Store a source file and return its URL"""
+    try:
+        url = get_storage().put(key, content, content_type, ACL='public-read')
+        BYTES_UPLOADED.labels("raw").inc(len(content))
+        return url
+    except Exception as e:
+        raise Exception(f"Failed to upload file: {str(e)}")
+
+def _put_shared_image(storage, image_bytes: bytes, digest: str, image_ext: str):
+    """Store an image under its content-hash key unless it is already there; returns (url, uploaded)"""
+    key = shared_image_key(digest, image_ext)
+    url = find_shared_image(storage, key)
+    if url is not None:
+        return url, False
+    url = storage.put(key, image_bytes, image_content_type(image_ext), ACL='public-read')
+    get_image_index().add(url)
+    return url, True
+
+def upload_image(image_bytes: bytes, key: str, image_ext: str) -> str:
+    """Store an image and return its URL; with the shared image store, ``key`` is replaced by the content hash"""
+    try:
+        if SHARED_IMAGE_STORE_ENABLED:
+            url, uploaded = _put_shared_image(get_storage(), image_bytes, image_digest(image_bytes), image_ext)
+            if uploaded:
+                BYTES_UPLOADED.labels("image").inc(len(image_bytes))
+            return url
+        url = get_storage().put(key, image_bytes, image_content_type(image_ext), ACL='public-read')
+        BYTES_UPLOADED.labels("image").inc(len(image_bytes))
+        return url
+    except Exception as e:
+        raise Exception(f"Failed to upload image: {str(e)}")
+
+def upload_image_fileobj(fileobj, key: str, image_ext: str, content_hash: str = None) -> str:
+    """
+    Stream an image file object to storage and return its URL.
+
+    With the shared image store the object is keyed by ``content_hash`` (a sha256 hex
+    digest, computed from the file when not given) and skipped if already stored.
+    """
+    try:
+        storage = get_storage()
+        if SHARED_IMAGE_STORE_ENABLED:
+            if content_hash is None:
+                digest = hashlib.sha256()
+                for chunk in iter(lambda: fileobj.read(1024 * 1024), b''):
+                    digest.update(chunk)
+                fileobj.seek(0)
+                content_hash = digest.hexdigest()
+            key = shared_image_key(content_hash, image_ext)
+            url = find_shared_image(storage, key)
+            if url is not None:
+                return url
+        # Measure before uploading; the transfer may close the file object
+        start = fileobj.tell()
+        size = fileobj.seek(0, os.SEEK_END) - start
+        fileobj.seek(start)
+        url = storage.put_fileobj(fileobj, key, image_content_type(image_ext), ACL='public-read')
+        if SHARED_IMAGE_STORE_ENABLED:
+            get_image_index().add(url)
+        BYTES_UPLOADED.labels("image").inc(size)
+        return url
+    except Exception as e:
+        raise Exception(f"Failed to upload image: {str(e)}")
+
+def upload_images(images, max_workers: int = None) -> dict:
+    """Store (image_bytes, key, image_ext) tuples concurrently; returns key -> URL for successes"""
+    images = list(images)
+    if not SHARED_IMAGE_STORE_ENABLED:
+        urls = get_storage().put_many(
+            ((key, image_bytes, image_content_type(image_ext), {'ACL': 'public-read'}) for image_bytes, key, image_ext in images),
+            max_workers=max_workers
+        )
+        BYTES_UPLOADED.labels("image").inc(sum(len(image_bytes) for image_bytes, key, _ in images if key in urls))
+        return urls
+
+    # Identical images within the batch are checked and stored once
+    by_content = {}
+    for image_bytes, key, image_ext in images:
+        entry = by_content.setdefault((image_digest(image_bytes), image_ext), [image_bytes, []])
+        entry[1].append(key)
+    if not by_content:
+        return {}
+
+    storage = get_storage()
+    urls = {}
+    workers = min(max_workers or STORAGE_MAX_WORKERS, len(by_content))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_put_shared_image, storage, image_bytes, digest, image_ext): (image_bytes, keys)
+            for (digest, image_ext), (image_bytes, keys) in by_content.items()
+        }
+        for future, (image_bytes, keys) in futures.items():
+            try:
+                url, uploaded = future.result()
+            except Exception as e:
+                print(f"Failed to store {keys[0]}: {str(e)}")
+                continue
+            if uploaded:
+                BYTES_UPLOADED.labels("image").inc(len(image_bytes))
+            urls.update((key, url) for key in keys)
+    return urls
+
+def upload_markdown(content: str, key: str) -> str:
+    """
+    Store markdown content and return its URL.
+
+    Large documents are compressed when MARKDOWN_COMPRESSION is set and the backend
+    serves Content-Encoding, so HTTP clients receive them decoded.
+    """
+    try:
+        body = content.encode('utf-8')
+        storage = get_storage()
+        extra_args = {}
+        if storage.supports_content_encoding:
+            body, encoding = compress_markdown(body)
+            if encoding:
+                extra_args['ContentEncoding'] = encoding
+        url = storage.put(key, body, 'text/markdown', **extra_args)
+        BYTES_UPLOADED.labels("markdown").inc(len(body))
+        return url
+    except Exception as e:
+        raise Exception(f"Failed to upload markdown: {str(e)}")
+
+def download_file(key: str) -> bytes:
+    """Read an object back from storage"""
+    try:
+        return get_storage().get(key)
+    except Exception as e:
+        raise Exception(f"Failed to get file from storage: {str(e)}")
@@ -0,0 +1,153 @@
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlparse
+import requests
+from backend.utils.metrics import WEB_CACHE_LOOKUPS
+from backend.utils.single_flight import normalize_url
+
+# Reuse results for pages that have not changed since they were processed
+WEB_CACHE_ENABLED = os.getenv("WEB_CACHE_ENABLED", "true").lower() == "true"
+# Seconds a result is served without asking the site; 0 revalidates on every request
+WEB_CACHE_TTL_SECONDS = int(os.getenv("WEB_CACHE_TTL_SECONDS", 0))
+WEB_CACHE_MAX_ENTRIES = int(os.getenv("WEB_CACHE_MAX_ENTRIES", 1024))
+WEB_CACHE_REQUEST_TIMEOUT = int(os.getenv("WEB_CACHE_REQUEST_TIMEOUT", 15))
+# Rendered in a browser (Apify), so the raw HTML's validators do not follow the content
+# they extract; their results are only served within the TTL, never revalidated
+UNVALIDATED_CATEGORIES = {"enterprise"}
+
+def _parse_domain_ttls(value: str) -> dict:
+    """Parse "example.com=600,news.example.org=60"; a domain also covers its subdomains"""
+    ttls = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            domain, ttl = item.split("=", 1)
+            ttls[domain.strip().lower().lstrip(".")] = int(ttl)
+    return ttls
+
+WEB_CACHE_DOMAIN_TTLS = _parse_domain_ttls(os.getenv("WEB_CACHE_DOMAIN_TTLS"))
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+def ttl_for(url: str) -> int:
+    """TTL of the most specific configured domain matching the URL's host"""
+    host = (urlparse(url).hostname or "").lower()
+    labels = host.split(".")
+    for i in range(len(labels)):
+        domain = ".".join(labels[i:])
+        if domain in WEB_CACHE_DOMAIN_TTLS:
+            return WEB_CACHE_DOMAIN_TTLS[domain]
+    return WEB_CACHE_TTL_SECONDS
+
+def head_validators(url: str) -> dict:
+    """
+    ETag and Last-Modified of a page from a HEAD request, without downloading the body.
+
+    A failed HEAD (some servers reject the method) yields no validators.
+    """
+    try:
+        response = requests.head(url, headers=HEADERS, allow_redirects=True, timeout=WEB_CACHE_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+    except Exception as e:
+        print(f"Could not read cache validators for {url}: {str(e)}")
+        return {'etag': None, 'last_modified': None}
+
+class WebResultCache:
+    """
+    Per-URL, per-category cache of website results and the validators they were built from.
+
+    Entries stay fresh for their domain's TTL. After that a HEAD request compares the
+    page's ETag and Last-Modified with those the result was built from; a page whose
+    validators differ, that sent none, or whose category is in UNVALIDATED_CATEGORIES
+    is processed again. The page body is only ever downloaded by the processor. Least
+    recently used entries are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, max_entries: int = WEB_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_process(self, url: str, category: str, process):
+        """Return the cached result for url if the page is unchanged, otherwise ``process(url)`` and cache it"""
+        category = category.lower()
+        if not WEB_CACHE_ENABLED:
+            return process(url)
+
+        key = (normalize_url(url), category)
+        entry = self._get(key)
+        now = time.time()
+        if entry is None:
+            WEB_CACHE_LOOKUPS.labels(category, "miss").inc()
+            # Validators come from before processing, so a change during processing is caught next time
+            version = self._validators(url, category)
+            result = process(url)
+            self._store(key, result, version, now, url)
+            return result
+
+        if now < entry['expires_at']:
+            WEB_CACHE_LOOKUPS.labels(category, "hit").inc()
+            return self._cached_result(entry, "hit")
+
+        validators = (entry['etag'], entry['last_modified'])
+        version = self._validators(url, category)
+        if any(validators) and (version['etag'], version['last_modified']) == validators:
+            entry['expires_at'] = now + ttl_for(url)
+            entry['revalidated_at'] = now
+            self._put(key, entry)
+            WEB_CACHE_LOOKUPS.labels(category, "revalidated").inc()
+            return self._cached_result(entry, "revalidated")
+
+        # Changed, or nothing to tell: process again, which downloads the page once
+        WEB_CACHE_LOOKUPS.labels(category, "changed" if any(validators) else "expired").inc()
+        result = process(url)
+        self._store(key, result, version, now, url)
+        return result
+
+    @staticmethod
+    def _validators(url: str, category: str) -> dict:
+        if category in UNVALIDATED_CATEGORIES:
+            return {'etag': None, 'last_modified': None}
+        return head_validators(url)
+
+    def _store(self, key, result, version, now, url):
+        self._put(key, {
+            'result': copy.deepcopy(result),
+            'etag': version['etag'],
+            'last_modified': version['last_modified'],
+            'cached_at': now,
+            'revalidated_at': now,
+            'expires_at': now + ttl_for(url)
+        })
+
+    @staticmethod
+    def _cached_result(entry, status: str) -> dict:
+        result = copy.deepcopy(entry['result'])
+        result.setdefault('metadata', {})['cache'] = {
+            'status': status,
+            'cached_at': datetime.fromtimestamp(entry['cached_at']).strftime("%Y-%m-%d %H:%M:%S"),
+            'revalidated_at': datetime.fromtimestamp(entry['revalidated_at']).strftime("%Y-%m-%d %H:%M:%S")
+        }
+        return result
+
+web_result_cache = WebResultCache()
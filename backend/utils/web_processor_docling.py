@@ -7,12 +7,16 @@ from urllib.parse import urljoin, urlparse
 from docling.document_converter import DocumentConverter
 from docling.datamodel.base_models import InputFormat
 from datetime import datetime
-from backend.utils.s3 import upload_markdown_to_s3
+from backend.utils.storage import upload_markdown
+from backend.utils.search_index import schedule_indexing
+from backend.utils.metrics import track_stage, PAGES_PROCESSED
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 _log = logging.getLogger(__name__)
 
+PROCESSOR = "web_docling"
+
 def fetch_html(url):
     """Fetch HTML content from a URL and save it to a temporary file."""
     headers = {
@@ -64,7 +68,8 @@ def process_html_with_docling(url):
         document_id = f"{domain}_{timestamp}"
         
         # Fetch HTML content and save to temporary file
-        temp_html_path = fetch_html(url)
+        with track_stage(PROCESSOR, "fetch"):
+            temp_html_path = fetch_html(url)
         if not temp_html_path:
             raise ValueError("Failed to fetch HTML content")
 
@@ -73,19 +78,24 @@ def process_html_with_docling(url):
             doc_converter = DocumentConverter(allowed_formats=[InputFormat.HTML])
             
             # Convert HTML to markdown
-            result = doc_converter.convert(temp_html_path)
+            with track_stage(PROCESSOR, "parse"):
+                result = doc_converter.convert(temp_html_path)
             if not result:
                 raise ValueError("Failed to process the HTML file with Docling")
+            PAGES_PROCESSED.labels(PROCESSOR).inc()
             
             # Get markdown content
-            markdown_content = result.document.export_to_markdown()
+            with track_stage(PROCESSOR, "markdown_export"):
+                markdown_content = result.document.export_to_markdown()
             
             # Generate filename and S3 key
             markdown_filename = f"{domain}.md"
             markdown_key = f"web_sources/extracted_markdown/{document_id}/{markdown_filename}"
             
             # Upload to S3
-            markdown_url = upload_markdown_to_s3(markdown_content, markdown_key)
+            with track_stage(PROCESSOR, "markdown_upload"):
+                markdown_url = upload_markdown(markdown_content, markdown_key)
+            schedule_indexing(document_id, 'web', PROCESSOR, [markdown_content], markdown_url, url)
             
             return {
                 'source_type': 'web',
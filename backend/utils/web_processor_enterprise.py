@@ -1,16 +1,30 @@
 import os
 import time
+import hashlib
+import tempfile
 import requests
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime  
 from pathlib import Path
 from urllib.parse import urlparse
-from backend.utils.s3 import upload_markdown_to_s3, upload_image_to_s3
+from requests.adapters import HTTPAdapter
+from backend.utils.storage import upload_markdown, upload_image_fileobj
+from backend.utils.search_index import schedule_indexing
+from backend.utils.metrics import track_stage, FAILURES, PAGES_PROCESSED, IMAGES_PROCESSED
  
 # Constants
 APIFY_API_TOKEN = os.getenv("APIFY_API_TOKEN")
 ACTOR_ID = os.getenv("ACTOR_ID")
+PROCESSOR = "web_enterprise"
+
+# Image transfer settings
+IMAGE_TRANSFER_WORKERS = int(os.getenv("IMAGE_TRANSFER_WORKERS", 8))
+IMAGE_REQUEST_TIMEOUT = int(os.getenv("IMAGE_REQUEST_TIMEOUT", 30))
+IMAGE_SPOOL_MAX_BYTES = 5 * 1024 * 1024  # Spill to disk above 5MB
+IMAGE_CHUNK_SIZE = 64 * 1024
+IMAGE_EXTENSIONS = {'jpeg', 'jpg', 'png', 'gif', 'webp', 'svg', 'bmp', 'ico', 'avif'}
  
 # Apify page function
 PAGE_FUNCTION = """
@@ -18,6 +32,22 @@ async function pageFunction(context) {
     const $ = context.jQuery;
     const baseUrl = new URL(context.request.url);
     const extractedData = [];
+    const emitted = new Map();  // element -> node id of the record it produced
+    let nodeId = 0;
+
+    // Nearest ancestor that produced a record, so duplicates can be collapsed by ancestry
+    const parentNode = (el) => {
+        for (let p = el.parentElement; p; p = p.parentElement) {
+            if (emitted.has(p)) return emitted.get(p);
+        }
+        return null;
+    };
+    const push = (el, record) => {
+        record.node = nodeId;
+        record.parent = parentNode(el);
+        emitted.set(el, nodeId++);
+        extractedData.push(record);
+    };
  
     $('*').each((_, el) => {
         const tag = el.tagName.toLowerCase();
@@ -26,15 +56,15 @@ async function pageFunction(context) {
         }).get().join(' ').replace(/\\s+/g, ' ').trim();  // Preserve spaces
  
         if (tag === 'h1' || tag === 'h2' || tag === 'h3' || tag === 'h4' || tag === 'h5' || tag === 'h6') {
-            if (text) extractedData.push({ type: 'heading', tag, text });
+            if (text) push(el, { type: 'heading', tag, text });
         } else if (tag === 'p' || tag === 'span' || tag === 'div') {
-            if (text) extractedData.push({ type: 'text', text });
+            if (text) push(el, { type: 'text', text });
         } else if (tag === 'img') {
             const src = $(el).attr('src');
-            if (src) extractedData.push({ type: 'image', src: new URL(src, baseUrl).href });
+            if (src) push(el, { type: 'image', src: new URL(src, baseUrl).href });
         } else if (tag === 'a') {
             const href = $(el).attr('href');
-            if (href) extractedData.push({ type: 'link', href: new URL(href, baseUrl).href, text });
+            if (href) push(el, { type: 'link', href: new URL(href, baseUrl).href, text });
         } else if (tag === 'table') {
             const rows = [];
             $(el).find('tr').each((_, row) => {
@@ -45,7 +75,7 @@ async function pageFunction(context) {
                 });
                 if (rowData.length) rows.push(rowData);
             });
-            if (rows.length) extractedData.push({ type: 'table', rows });
+            if (rows.length) push(el, { type: 'table', rows });
         }
     });
  
@@ -65,26 +95,34 @@ def scrape_website_with_pdf(url: str):
         s3_images_key_prefix = f"web_sources/extracted_images/{document_id}"
  
         # Start the actor and fetch results
-        run_id, dataset_id = start_actor(url)
-        wait_for_actor_completion(run_id)
-        results = fetch_results(dataset_id)
- 
-        # Convert JSON to Markdown
-        md_content = json_to_markdown(results)
+        with track_stage(PROCESSOR, "remote_api_wait"):
+            run_id, dataset_id = start_actor(url)
+            wait_for_actor_completion(run_id)
+            results = fetch_results(dataset_id)
+        PAGES_PROCESSED.labels(PROCESSOR).inc(len(results))
+
+        with track_stage(PROCESSOR, "parse"):
+            # Drop text the page function emitted more than once before it reaches the markdown
+            results, dedup_stats = collapse_duplicate_records(results)
  
-        # Extract original image URLs
-        original_images = [data["src"] for item in results for data in item.get("extractedData", []) if data.get("type") == "image"]
+            # Convert JSON to Markdown
+            md_content = json_to_markdown(results)
  
         # Download and upload images to S3
-        new_images = download_images_to_s3(results, s3_images_key_prefix)
+        with track_stage(PROCESSOR, "image_upload"):
+            image_map = download_images_to_s3(results, s3_images_key_prefix)
+        IMAGES_PROCESSED.labels(PROCESSOR).inc(len(image_map))
+        new_images = list(dict.fromkeys(image_map.values()))
         # Replace image URLs in markdown content
-        updated_md_content = replace_image_urls(md_content, original_images, new_images)
+        updated_md_content = replace_image_urls(md_content, image_map)
  
         # Upload updated Markdown to S3
-        markdown_url = upload_markdown_to_s3(updated_md_content, s3_markdown_key)
+        with track_stage(PROCESSOR, "markdown_upload"):
+            markdown_url = upload_markdown(updated_md_content, s3_markdown_key)
  
         # Extract metadata
         title = results[0].get("pageTitle", domain) if results else domain
+        schedule_indexing(document_id, 'web', PROCESSOR, [updated_md_content], markdown_url, title)
         has_tables = any(item.get("tables") for item in results)
 
         print(markdown_url)
@@ -105,7 +143,9 @@ def scrape_website_with_pdf(url: str):
                 'title': title,
                 'has_tables': has_tables,
                 'image_count': len(new_images),
-                'images': new_images
+                'images': new_images,
+                'image_map': image_map,
+                'deduplication': dedup_stats
             }
         }
  
@@ -114,6 +154,102 @@ def scrape_website_with_pdf(url: str):
     except Exception as e:
         raise Exception(f"Failed to process website: {str(e)}")    
  
+def _normalize_text(text):
+    """Collapse whitespace and case so trivially different copies hash the same."""
+    return " ".join(text.split()).casefold()
+
+def _record_key(record):
+    """Hash the part of a record that is rendered into markdown."""
+    data_type = record.get("type")
+    if data_type == "image":
+        payload = record.get("src", "")
+    elif data_type == "link":
+        payload = f"{record.get('href', '')}\0{_normalize_text(record.get('text', ''))}"
+    elif data_type == "table":
+        payload = json.dumps(record.get("rows", []), ensure_ascii=False)
+    else:
+        # Text and headings share a key space so a paragraph repeating a heading is dropped
+        payload = _normalize_text(record.get("text", ""))
+        data_type = "text"
+    return data_type, hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+def _record_size(record):
+    """Approximate rendered size of a record in bytes."""
+    if record.get("type") == "table":
+        return sum(len(cell.encode("utf-8")) for row in record.get("rows", []) for cell in row)
+    return len(record.get("text", "").encode("utf-8")) + len(record.get("src", "") or record.get("href", ""))
+
+def collapse_duplicate_records(json_data):
+    """
+    Remove overlapping records from the Apify dataset in a single linear pass.
+
+    A record is dropped when its node was already emitted, when it repeats the content
+    of one of its own ancestor records, or when it is text inside a table whose rows
+    already carry it. Content repeated elsewhere on the page (the same answer under two
+    questions) is kept. Ancestry comes from the ``node``/``parent`` ids set by
+    PAGE_FUNCTION; records arrive in document order, so the current ancestor chain is
+    kept as a stack with a count of its content keys. Items without ids are left as is.
+
+    :param json_data: Apify dataset items.
+    :return: Tuple of (de-duplicated items, size statistics for the response metadata).
+    """
+    collapsed = []
+    records_before = records_after = 0
+    bytes_before = bytes_after = 0
+
+    for item in json_data:
+        seen_nodes = set()
+        chain = []  # (node id, record key, is table) from the outermost ancestor down
+        chain_keys = {}  # record key -> records on the chain with that key
+        chain_tables = 0
+        kept = []
+
+        for record in item.get("extractedData", []):
+            records_before += 1
+            size = _record_size(record)
+            bytes_before += size
+
+            node = record.get("node")
+            duplicate = False
+            if node is not None:
+                key = _record_key(record)
+                parent = record.get("parent")
+                # Leave the subtrees that ended before this record; each entry is popped once
+                while chain and chain[-1][0] != parent:
+                    _, popped_key, popped_is_table = chain.pop()
+                    chain_keys[popped_key] -= 1
+                    chain_tables -= popped_is_table
+                duplicate = (
+                    node in seen_nodes
+                    or chain_keys.get(key, 0) > 0
+                    or (chain_tables > 0 and record.get("type") == "text")
+                )
+                # Dropped records stay on the chain too: their descendants name them as parent
+                seen_nodes.add(node)
+                is_table = record.get("type") == "table"
+                chain.append((node, key, is_table))
+                chain_keys[key] = chain_keys.get(key, 0) + 1
+                chain_tables += is_table
+
+            if duplicate:
+                continue
+
+            kept.append(record)
+            records_after += 1
+            bytes_after += size
+
+        collapsed.append({**item, "extractedData": kept})
+
+    stats = {
+        'records_before': records_before,
+        'records_after': records_after,
+        'text_bytes_before': bytes_before,
+        'text_bytes_after': bytes_after,
+        'reduction_ratio': round(1 - bytes_after / bytes_before, 4) if bytes_before else 0.0
+    }
+    print(f"Collapsed {records_before - records_after} duplicate records ({stats['reduction_ratio']:.1%} of text)")
+    return collapsed, stats
+
 # Function to convert JSON to Markdown
 def json_to_markdown(json_data):
     md_lines = []
@@ -194,58 +330,92 @@ def fetch_results(dataset_id):
     
 # Function to download images and upload them directly to S3
 def download_images_to_s3(data, s3_key_prefix):
-    images_path = []
-    
+    """
+    Download every unique image referenced in the Apify results and stream it to S3.
+
+    Downloads run on a bounded thread pool sharing one pooled HTTP session. Each body
+    is spooled (in memory up to IMAGE_SPOOL_MAX_BYTES, then to disk) while it is hashed,
+    so the S3 key is derived from the content and never collides.
+
+    :param data: Apify dataset items.
+    :param s3_key_prefix: S3 prefix for this document's images.
+    :return: Dict mapping each original image URL to its S3 URL (failed downloads are omitted).
+    """
+    image_sources = []
+    seen = set()
     for item in data:
-        images = [data["src"] for data in item.get("extractedData", []) if data.get("type") == "image"]
-        
-        print(f"Extracted images: {images}")  # Debugging
-        
-        for img_url in images:
+        for record in item.get("extractedData", []):
+            src = record.get("src") if record.get("type") == "image" else None
+            if src and src not in seen:
+                seen.add(src)
+                image_sources.append(src)
+
+    print(f"Extracted {len(image_sources)} unique images")
+    if not image_sources:
+        return {}
+
+    url_map = {}
+    workers = min(IMAGE_TRANSFER_WORKERS, len(image_sources))
+    with _image_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_transfer_image, session, img_url, s3_key_prefix): img_url
+            for img_url in image_sources
+        }
+        for future in as_completed(futures):
+            img_url = futures[future]
             try:
-                print(f"Downloading image: {img_url}")  # Debugging
-                
-                # Extract image name
-                image_name = os.path.basename(img_url)
-                s3_key = f"{s3_key_prefix}/{image_name}"
- 
-                # Download image
-                response = requests.get(img_url, stream=True)
-                response.raise_for_status()
-                
-                image_bytes = response.content
-                image_ext = image_name.split('.')[-1].lower()
- 
-                # Upload image to S3
-                s3_url = upload_image_to_s3(image_bytes, s3_key, image_ext)
-                print(s3_url)
-                images_path.append(s3_url)
-                print(f"Uploaded to S3: {s3_url}")
- 
+                url_map[img_url] = future.result()
             except Exception as e:
+                FAILURES.labels(PROCESSOR, "image_upload").inc()
                 print(f"Failed to process {img_url}: {e}")
-    
-    return images_path
- 
-def replace_image_urls(md_content, original_images, new_images):
+
+    # Keep the map in document order rather than completion order
+    return {src: url_map[src] for src in image_sources if src in url_map}
+
+def _image_session(pool_size):
+    """Create an HTTP session whose connection pool matches the worker count."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _image_extension(img_url, content_type):
+    """Pick a file extension from the response content type, falling back to the URL path."""
+    subtype = content_type.split(';')[0].split('/')[-1].strip().lower() if '/' in content_type else ''
+    if subtype in IMAGE_EXTENSIONS:
+        return 'jpg' if subtype == 'jpeg' else subtype
+    ext = os.path.splitext(urlparse(img_url).path)[1].lstrip('.').lower()
+    return ext if ext in IMAGE_EXTENSIONS else 'bin'
+
+def _transfer_image(session, img_url, s3_key_prefix):
+    """Stream one image into a spool file while hashing it, then upload it under its content hash."""
+    with session.get(img_url, stream=True, timeout=IMAGE_REQUEST_TIMEOUT) as response:
+        response.raise_for_status()
+        image_ext = _image_extension(img_url, response.headers.get("Content-Type", ""))
+        digest = hashlib.sha256()
+        with tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_MAX_BYTES) as spool:
+            for chunk in response.iter_content(chunk_size=IMAGE_CHUNK_SIZE):
+                digest.update(chunk)
+                spool.write(chunk)
+            spool.seek(0)
+            s3_key = f"{s3_key_prefix}/{digest.hexdigest()[:32]}.{image_ext}"
+            return upload_image_fileobj(spool, s3_key, image_ext, content_hash=digest.hexdigest())
+
+def replace_image_urls(md_content, url_map):
     """
     Replace old image URLs in markdown content with new S3 URLs.
     
     :param md_content: The markdown content as a string.
-    :param original_images: List of original image URLs extracted from JSON.
-    :param new_images: List of new S3 image URLs.
+    :param url_map: Dict mapping original image URLs to their S3 URLs.
     :return: Updated markdown content with replaced image URLs.
     """
-    if not original_images or not new_images or len(original_images) != len(new_images):
-        print("⚠️ Warning: Image lists are mismatched or empty. Skipping URL replacement.")
+    if not url_map:
         return md_content
  
-    url_map = dict(zip(original_images, new_images))  # Map old URLs to new URLs
- 
     def replace_match(match):
         old_url = match.group(1)
         return f"![Image]({url_map.get(old_url, old_url)})"  # Replace if exists
  
     updated_md_content = re.sub(r"!\[Image\]\((.*?)\)", replace_match, md_content)
-    return updated_md_content       
-        
\ No newline at end of file
+    return updated_md_content
@@ -4,7 +4,12 @@ import os
 from urllib.parse import urljoin, urlparse
 from pathlib import Path
 from datetime import datetime
-from backend.utils.s3 import upload_image_to_s3, upload_markdown_to_s3
+from backend.utils.storage import upload_images, upload_markdown
+from backend.utils.search_index import schedule_indexing
+from backend.utils.image_optimizer import optimize_images, optimization_stats
+from backend.utils.metrics import track_stage, PAGES_PROCESSED, IMAGES_PROCESSED, IMAGE_BYTES_SAVED
+
+PROCESSOR = "web_open_source"
 
 def convert_table_to_markdown(table):
     """Convert HTML table to markdown format with advanced features"""
@@ -52,6 +57,47 @@ def convert_table_to_markdown(table):
     return '\n'.join(markdown_table) if markdown_table else ''
 
 
+def store_images(images, document_id: str, stats: dict) -> list:
+    """
+    Optimize and upload a page's downloaded images together, as the PDF processors do.
+
+    ``images`` is a list of (image_bytes, ext). Returns one entry per image in order:
+    None when the optimizer drops it, otherwise (filename, url, thumbnail_url) where url
+    is None if the upload failed. Kept images are numbered in page order.
+    """
+    with track_stage(PROCESSOR, "image_optimization"):
+        optimized = optimize_images(images, stats)
+
+    pending_uploads = []
+    stored = []
+    for image in optimized:
+        if image is None:
+            stored.append(None)
+            continue
+        image_number = sum(entry is not None for entry in stored) + 1
+        img_filename = f"image_{image_number}.{image['ext']}"
+        s3_key = f"web_sources/extracted_images/{document_id}/{img_filename}"
+        pending_uploads.append((image['image'], s3_key, image['ext']))
+        thumbnail_key = None
+        if image['thumbnail']:
+            thumbnail_key = f"web_sources/extracted_images/{document_id}/thumbnails/image_{image_number}.{image['thumbnail_ext']}"
+            pending_uploads.append((image['thumbnail'], thumbnail_key, image['thumbnail_ext']))
+        stored.append((img_filename, s3_key, thumbnail_key))
+
+    # Upload all images concurrently; failed uploads are reported with a None URL
+    with track_stage(PROCESSOR, "image_upload"):
+        uploaded = upload_images(pending_uploads)
+    results = []
+    for entry in stored:
+        if entry is None:
+            results.append(None)
+            continue
+        img_filename, s3_key, thumbnail_key = entry
+        results.append((img_filename, uploaded.get(s3_key), uploaded.get(thumbnail_key)))
+    IMAGES_PROCESSED.labels(PROCESSOR).inc(sum(1 for entry in results if entry is not None and entry[1]))
+    return results
+
+
 def scrape_website(url: str):
     print("Scraping website")
     try:
@@ -65,16 +111,21 @@ def scrape_website(url: str):
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
         
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        # Remove script and style elements
-        for element in soup(['script', 'style']):
-            element.decompose()
+        with track_stage(PROCESSOR, "fetch"):
+            response = requests.get(url, headers=headers)
+            response.raise_for_status()
+        with track_stage(PROCESSOR, "parse"):
+            soup = BeautifulSoup(response.text, 'html.parser')
+            # Remove script and style elements
+            for element in soup(['script', 'style']):
+                element.decompose()
         
         # Initialize markdown content and track images
         markdown_content = []
         image_urls = {}
+        thumbnail_urls = {}
+        image_optimization = optimization_stats()
+        page_images = []  # (markdown position, src, image bytes, ext)
         
         # Add title
         if soup.title:
@@ -83,7 +134,8 @@ def scrape_website(url: str):
         # Process content
         for element in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'img', 'table','article']):
             if element.name == 'table':
-                table_markdown = convert_table_to_markdown(element)
+                with track_stage(PROCESSOR, "table_detection"):
+                    table_markdown = convert_table_to_markdown(element)
                 if table_markdown:
                     markdown_content.append(f"\n{table_markdown}\n\n")
             
@@ -104,18 +156,9 @@ def scrape_website(url: str):
                             base64_data = src.split(',')[1]
                             img_data = base64.b64decode(base64_data)
                             
-                            # Generate unique filename
-                            img_filename = f"image_{len(image_urls) + 1}.{ext}"
-                            
-                            # Upload to S3
-                            s3_key = f"web_sources/extracted_images/{document_id}/{img_filename}"
-                            s3_url = upload_image_to_s3(img_data, s3_key, ext)
-                            
-                            # Store URL
-                            image_urls[img_filename] = {s3_url}
-                            
-                            # Add URL to markdown
-                            markdown_content.append(f"![Image]({s3_url})")
+                            # Optimized and uploaded with the page's other images; keep its place in the markdown
+                            page_images.append((len(markdown_content), src, img_data, ext))
+                            markdown_content.append(None)
                             
                         else:
                             # Handle regular image URLs
@@ -124,7 +167,8 @@ def scrape_website(url: str):
                                 src = urljoin(url, src)
                             
                             # Download image
-                            img_response = requests.get(src, headers=headers)
+                            with track_stage(PROCESSOR, "image_download"):
+                                img_response = requests.get(src, headers=headers)
                             if img_response.status_code == 200:
                                 # Rest of the existing image processing code
                                 content_type = img_response.headers.get('content-type', '')
@@ -132,12 +176,8 @@ def scrape_website(url: str):
                                 if ext not in ['jpeg', 'jpg', 'png', 'gif']:
                                     ext = 'png'
                                 
-                                img_filename = f"image_{len(image_urls) + 1}.{ext}"
-                                s3_key = f"web_sources/extracted_images/{document_id}/{img_filename}"
-                                s3_url = upload_image_to_s3(img_response.content, s3_key, ext)
-                                
-                                image_urls[img_filename] = {s3_url}
-                                markdown_content.append(f"![Image]({s3_url})")
+                                page_images.append((len(markdown_content), src, img_response.content, ext))
+                                markdown_content.append(None)
                     
                     except Exception as e:
                         print(f"Failed to process image {src}: {e}")
@@ -151,25 +191,46 @@ def scrape_website(url: str):
                         markdown_content.append(f"{'#' * level} {text}\n\n")
                     else:
                         markdown_content.append(f"{text}\n\n")
+        # Optimize and upload every image of the page at once, then fill in their markdown
+        stored_images = store_images([(img_data, ext) for _, _, img_data, ext in page_images], document_id, image_optimization)
+        for (position, src, _, _), stored in zip(page_images, stored_images):
+            if stored is None:
+                continue
+            img_filename, s3_url, thumbnail_url = stored
+            if s3_url is None:
+                print(f"Failed to process image {src}: upload failed")
+                markdown_content[position] = f"\n{src}\n\n"
+                continue
+            image_urls[img_filename] = {s3_url}
+            if thumbnail_url:
+                thumbnail_urls[img_filename] = thumbnail_url
+            markdown_content[position] = f"![Image]({s3_url})"
+
         # Save as markdown
         markdown_filename = f"{domain}.md"
         markdown_key = f"web_sources/extracted_markdown/{document_id}/{markdown_filename}"
-        markdown_content_str = "\n".join(markdown_content)
+        markdown_content_str = "\n".join(part for part in markdown_content if part is not None)
         
-        markdown_url = upload_markdown_to_s3(markdown_content_str, markdown_key)
+        with track_stage(PROCESSOR, "markdown_upload"):
+            markdown_url = upload_markdown(markdown_content_str, markdown_key)
+        schedule_indexing(document_id, 'web', PROCESSOR, [markdown_content_str], markdown_url, url)
+        PAGES_PROCESSED.labels(PROCESSOR).inc()
+        IMAGE_BYTES_SAVED.labels(PROCESSOR).inc(max(image_optimization['bytes_saved'], 0))
         
         return {
             'source_type': 'web',
             'document_id': document_id,
             'urls': {
                 'markdown': markdown_url,
-                'images': image_urls
+                'images': image_urls,
+                'thumbnails': thumbnail_urls
             },
             'metadata': {
                 'source_type': 'web',
                 'domain': domain,
                 'content_type': 'webpage',
                 'image_count': len(image_urls),
+                'image_optimization': image_optimization
             }
         }
         
@@ -0,0 +1,72 @@
+"""
+Benchmark markdown assembly in the enterprise PDF processor.
+
+Builds synthetic Azure-shaped result objects (no network or credentials needed) and
+times table_to_markdown / build_markdown on large tables and long documents.
+
+Usage:
+    python -m benchmarks.bench_enterprise_tables [--cells 10000] [--pages 500] [--repeat 5]
+"""
+import argparse
+import math
+import statistics
+import time
+from types import SimpleNamespace
+
+from backend.utils.pdf_processor_enterprise import build_markdown, table_to_markdown
+
+
+def make_table(cell_count, columns=20, page_number=1):
+    rows = math.ceil(cell_count / columns)
+    cells = [
+        SimpleNamespace(row_index=i // columns, column_index=i % columns, column_span=1, content=f"r{i // columns}c{i % columns}")
+        for i in range(cell_count)
+    ]
+    return SimpleNamespace(
+        row_count=rows,
+        column_count=columns,
+        cells=cells,
+        bounding_regions=[SimpleNamespace(page_number=page_number)]
+    )
+
+
+def make_result(pages, lines_per_page, cells_per_table):
+    return SimpleNamespace(
+        pages=[
+            SimpleNamespace(
+                page_number=p,
+                width=8.5,
+                height=11,
+                lines=[SimpleNamespace(content=f"Line {l} of page {p}") for l in range(lines_per_page)]
+            )
+            for p in range(1, pages + 1)
+        ],
+        tables=[make_table(cells_per_table, page_number=p) for p in range(1, pages + 1)]
+    )
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cells", type=int, default=10_000, help="cells in the large single table")
+    parser.add_argument("--pages", type=int, default=500, help="pages in the long document")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    table = make_table(args.cells)
+    print(f"table_to_markdown, {args.cells} cells: {timed(lambda: table_to_markdown(table), args.repeat) * 1000:.1f} ms")
+
+    result = make_result(args.pages, lines_per_page=50, cells_per_table=200)
+    print(f"build_markdown, {args.pages} pages: {timed(lambda: build_markdown(result, {}), args.repeat) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Compare stored size and fetch latency of markdown objects stored plain, gzip- or zstd-encoded.
+
+Builds synthetic markdown shaped like our heavy outputs: Docling exports with embedded
+base64 images, Apify exports with repeated text, and plain text-heavy documents. Each
+variant is served by a local HTTP server that sends the stored body with its
+Content-Encoding (as S3 does) at a capped bandwidth, and fetched with requests the way
+the Streamlit client does. Fetch latency covers transfer and decoding. The "transparent"
+column shows whether requests decoded the body on its own.
+
+Usage:
+    python -m benchmarks.bench_markdown_compression [--size-mb 4] [--bandwidth-mbps 100] [--repeat 5]
+"""
+import argparse
+import base64
+import contextlib
+import http.server
+import random
+import statistics
+import threading
+import time
+
+import requests
+
+from backend.utils.compression import DEFAULT_LEVELS, compress, decompress
+from benchmarks.corpus import WORDS, noise_png, paragraph
+
+
+def docling_markdown(rng, size):
+    """Paragraphs interleaved with embedded base64 PNGs, as ImageRefMode.EMBEDDED produces."""
+    parts, total = [], 0
+    while total < size:
+        image = base64.b64encode(noise_png(rng, 200, 150)).decode("ascii")
+        for part in (f"## Section {len(parts)}\n\n", paragraph(rng) + "\n\n", f"![Image](data:image/png;base64,{image})\n\n"):
+            parts.append(part)
+            total += len(part)
+    return "".join(parts)
+
+
+def apify_markdown(rng, size):
+    """Headings and paragraphs with the heavy repetition seen in scraped navigation and footers."""
+    boilerplate = [paragraph(rng, 3) for _ in range(20)]
+    parts, total = [], 0
+    while total < size:
+        part = f"### {rng.choice(WORDS).title()}\n\n" + (rng.choice(boilerplate) if rng.random() < 0.7 else paragraph(rng)) + "\n\n"
+        parts.append(part)
+        total += len(part)
+    return "".join(parts)
+
+
+def text_markdown(rng, size):
+    parts, total = [], 0
+    while total < size:
+        part = paragraph(rng, 8) + "\n\n"
+        parts.append(part)
+        total += len(part)
+    return "".join(parts)
+
+
+SAMPLES = {"docling_embedded": docling_markdown, "apify_repeated": apify_markdown, "text_heavy": text_markdown}
+
+
+class ThrottledHandler(http.server.BaseHTTPRequestHandler):
+    objects = {}
+    bytes_per_second = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body, encoding = self.objects[self.path]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/markdown")
+        self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        chunk = 64 * 1024
+        for start in range(0, len(body), chunk):
+            self.wfile.write(body[start:start + chunk])
+            if self.bytes_per_second:
+                time.sleep(chunk / self.bytes_per_second)
+
+
+@contextlib.contextmanager
+def serve(objects, bandwidth_mbps):
+    handler = type("Handler", (ThrottledHandler,), {
+        "objects": objects,
+        "bytes_per_second": bandwidth_mbps * 1_000_000 / 8 if bandwidth_mbps else None
+    })
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def fetch(url, encoding):
+    """Fetch and decode one object; returns (seconds, decoded_by_requests)"""
+    started = time.perf_counter()
+    with requests.get(url, stream=True) as response:
+        raw = response.raw.read(decode_content=False)
+    text = decompress(raw, encoding).decode("utf-8")
+    elapsed = time.perf_counter() - started
+    decoded = requests.get(url).content == text.encode("utf-8")
+    return elapsed, decoded
+
+
+def available_encodings():
+    encodings = [None, "gzip"]
+    try:
+        import zstandard  # noqa: F401
+        encodings.append("zstd")
+    except ImportError:
+        pass
+    return encodings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=4, help="approximate size of each markdown sample")
+    parser.add_argument("--bandwidth-mbps", type=float, default=100, help="simulated download bandwidth; 0 for unthrottled")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    size = int(args.size_mb * 1024 * 1024)
+    objects, rows = {}, []
+    for sample, build in SAMPLES.items():
+        body = build(rng, size).encode("utf-8")
+        for encoding in available_encodings():
+            started = time.perf_counter()
+            stored = compress(body, encoding) if encoding else body
+            compress_seconds = time.perf_counter() - started
+            path = f"/{sample}/{encoding or 'none'}.md"
+            objects[path] = (stored, encoding)
+            rows.append((sample, encoding, len(body), len(stored), compress_seconds, path))
+
+    print(f"bandwidth: {args.bandwidth_mbps or 'unthrottled'} Mbit/s, levels: {DEFAULT_LEVELS}")
+    print(f"{'sample':<18} {'encoding':<8} {'original MB':>11} {'stored MB':>10} {'ratio':>6} {'compress s':>10} {'fetch p50 s':>11} {'transparent':>11}")
+    with serve(objects, args.bandwidth_mbps) as base_url:
+        for sample, encoding, original, stored, compress_seconds, path in rows:
+            samples, transparent = [], True
+            for _ in range(args.repeat):
+                seconds, decoded = fetch(base_url + path, encoding)
+                samples.append(seconds)
+                transparent = transparent and decoded
+            print(
+                f"{sample:<18} {encoding or 'none':<8} {original / 1e6:>11.2f} {stored / 1e6:>10.2f} "
+                f"{original / stored:>6.2f} {compress_seconds:>10.3f} {statistics.median(samples):>11.3f} {str(transparent):>11}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Measure how many copies of an uploaded PDF the request path holds in memory.
+
+Generates a synthetic PDF, then traces Python allocations (tracemalloc) from the moment
+the upload is read until process_pdf_document returns, with MemoryStorage standing in
+for S3. The peak is reported as a multiple of the document size: the upload read itself
+accounts for 1.0x, so anything above that is a copy made by the pipeline. PyMuPDF's
+own C allocations are not traced.
+
+The default "handoff" processor only opens the buffer with PyMuPDF and walks the pages,
+isolating the pipeline from processor work; its peak must stay within --max-ratio
+(default 1.5x) of the document size, or the run fails. Real processors can be added
+with --processors; their peaks include whatever they extract and are only reported.
+
+Usage:
+    python -m benchmarks.bench_pdf_memory [--pages 40] [--processors handoff "open source"]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import fitz
+
+# Every run processes the same file; measure full processing, not reuse of the previous run's pages
+os.environ.setdefault("PAGE_CACHE_ENABLED", "false")
+# Nor index the results on disk
+os.environ.setdefault("SEARCH_INDEX_ENABLED", "false")
+
+from backend.utils.storage import MemoryStorage, set_storage
+from benchmarks.corpus import image_heavy_pdf
+
+
+def handoff_processor(pdf_buffer, document_id, original_filename, lineage=None):
+    """Stand-in processor: opens the buffer the way the real ones do and touches every page."""
+    doc = fitz.open(stream=pdf_buffer.getvalue(), filetype="pdf")
+    pages = sum(1 for _ in doc)
+    doc.close()
+    return {"document_id": document_id, "urls": {}, "metadata": {"pages": pages}}
+
+
+def measure(main, category, path, runs):
+    """Peak traced bytes from reading the upload to the end of processing, per run."""
+    peaks = []
+    for run in range(runs):
+        set_storage(MemoryStorage())
+        tracemalloc.start()
+        with open(path, "rb") as f:
+            document = main.DocumentBuffer(f.read(), path.name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.process_pdf_document(document, path.name, category, f"bench_memory_{run}")
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del document
+    return min(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40, help="pages in the synthetic image-heavy PDF")
+    parser.add_argument("--processors", nargs="+", default=["handoff"], help='"handoff" or PDF categories to trace')
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--max-ratio", type=float, default=1.5, help="largest handoff peak allowed, as a multiple of the document size")
+    args = parser.parse_args()
+
+    from backend import main as api
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "memory_bench.pdf"
+        image_heavy_pdf(random.Random(7), pages=args.pages).save(path)
+        size = path.stat().st_size
+        print(f"document: {size / 1024 / 1024:.2f} MB, {args.pages} pages")
+
+        get_processor = api.get_pdf_processor
+        for name in args.processors:
+            if name == "handoff":
+                api.get_pdf_processor = lambda category: handoff_processor
+            else:
+                api.get_pdf_processor = get_processor
+            try:
+                peak = measure(api, name, path, args.runs)
+            except Exception as e:
+                print(f"{name:>12}: skipped ({type(e).__name__}: {e})")
+                continue
+            finally:
+                api.get_pdf_processor = get_processor
+            print(f"{name:>12}: peak {peak / 1024 / 1024:8.2f} MB  ({peak / size:.2f}x document size)")
+            if name == "handoff":
+                # One copy from reading the upload, plus slack for the pipeline's own objects
+                assert peak <= args.max_ratio * size, f"handoff peak is {peak / size:.2f}x the document, over {args.max_ratio}x"
+
+
+if __name__ == "__main__":
+    main()
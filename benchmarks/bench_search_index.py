@@ -0,0 +1,94 @@
+"""
+Measure full-text index build rate and query latency at scale.
+
+Generates synthetic markdown pages from a Zipf-distributed vocabulary (so common and
+rare terms behave like real text, unlike the small corpus vocabulary), indexes them
+one document at a time the way the background indexer does, then times searches for
+common terms, rare terms, two-term conjunctions and prefixes. The index is written to
+a temporary SQLite file unless --path is given.
+
+Usage:
+    python -m benchmarks.bench_search_index [--pages 100000] [--pages-per-document 20] [--queries 200]
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import string
+import tempfile
+import time
+
+from backend.utils.search_index import SearchIndex
+
+
+def vocabulary(rng, size):
+    """Distinct pronounceable-ish words, most frequent first"""
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10))))
+    return sorted(words, key=len)
+
+
+def pages(rng, words, count, words_per_page):
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    for _ in range(count):
+        body = rng.choices(words, cum_weights=weights, k=words_per_page)
+        yield "## Section\n\n" + "\n\n".join(" ".join(body[i:i + 60]) for i in range(0, len(body), 60))
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=100_000)
+    parser.add_argument("--pages-per-document", type=int, default=20)
+    parser.add_argument("--words-per-page", type=int, default=300)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200, help="queries per query kind")
+    parser.add_argument("--path", help="index file to build (default: a temporary file)")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    words = vocabulary(rng, args.vocabulary)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.path or os.path.join(tmp, "search_index.db")
+        index = SearchIndex(path)
+
+        generated = pages(rng, words, args.pages, args.words_per_page)
+        indexed, text_bytes, build_seconds = 0, 0, 0.0
+        while indexed < args.pages:
+            document = list(itertools.islice(generated, args.pages_per_document))
+            text_bytes += sum(len(page) for page in document)
+            started = time.perf_counter()
+            indexed += index.add_document(f"doc_{indexed // args.pages_per_document:06d}", "pdf", "benchmark", document)
+            build_seconds += time.perf_counter() - started
+        size = os.path.getsize(path) + (os.path.getsize(path + "-wal") if os.path.exists(path + "-wal") else 0)
+        print(f"indexed {indexed} pages ({text_bytes / 1e6:.1f} MB text) in {build_seconds:.1f}s: "
+              f"{indexed / build_seconds:,.0f} pages/s, {text_bytes / 1e6 / build_seconds:.1f} MB/s, index {size / 1e6:.1f} MB")
+
+        common, rare = words[:50], words[len(words) // 2:]
+        kinds = {
+            "common term": lambda: rng.choice(common),
+            "rare term": lambda: rng.choice(rare),
+            "two terms": lambda: f"{rng.choice(words[:2000])} {rng.choice(words[:2000])}",
+            "prefix": lambda: rng.choice(words[:5000])[:3] + "*",
+        }
+        print(f"{'query':<12} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'avg hits':>8}")
+        for kind, make_query in kinds.items():
+            latencies, hits = [], []
+            for _ in range(args.queries):
+                query = make_query()
+                started = time.perf_counter()
+                results = index.search(query, limit=10)
+                latencies.append((time.perf_counter() - started) * 1000)
+                hits.append(len(results))
+            print(f"{kind:<12} {statistics.median(latencies):>8.2f} {percentile(latencies, 0.95):>8.2f} "
+                  f"{max(latencies):>8.2f} {statistics.mean(hits):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
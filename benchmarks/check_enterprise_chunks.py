@@ -0,0 +1,81 @@
+"""
+Offline check of chunked Azure analysis in the enterprise PDF processor.
+
+Analyzes a synthetic many-page PDF with the stub DocumentAnalysisClient
+(benchmarks/stub_azure.py), split into page ranges smaller than the document, and
+checks that the merged result matches analyzing the whole document at once: pages in
+order, each page carrying its own text, and tables rebased onto their pages. Then runs
+process_pdf_with_enterprise end to end against MemoryStorage with the same split.
+
+Usage:
+    python -m benchmarks.check_enterprise_chunks [--pages 23] [--chunk-pages 5]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+
+
+def summarize(result):
+    """(page number, line texts) per page and the page of each table, in result order"""
+    pages = [(page.page_number, [line.content for line in page.lines]) for page in result.pages]
+    tables = [(table.bounding_regions[0].page_number, table.cells[1].content) for table in result.tables]
+    return pages, tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=23)
+    parser.add_argument("--chunk-pages", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["PAGE_CACHE_ENABLED"] = "false"
+    os.environ["SEARCH_INDEX_ENABLED"] = "false"
+    os.environ["AZURE_CHUNK_PAGES"] = str(args.chunk_pages)
+
+    from benchmarks.corpus import many_page_pdf
+    from benchmarks.stub_azure import StubDocumentAnalysisClient
+    from backend.utils.storage import MemoryStorage, set_storage
+    from backend.utils.pdf_processor_enterprise import analyze_document, process_pdf_with_enterprise
+
+    doc = many_page_pdf(random.Random(7), pages=args.pages)
+    pdf_bytes = doc.tobytes()
+    doc.close()
+
+    whole = StubDocumentAnalysisClient()
+    expected_pages, _ = summarize(analyze_document(whole, pdf_bytes, chunk_pages=args.pages))
+    assert whole.calls == [args.pages], whole.calls
+
+    chunked = StubDocumentAnalysisClient()
+    pages, tables = summarize(analyze_document(chunked, pdf_bytes, chunk_pages=args.chunk_pages, max_concurrency=3))
+    full_chunks, rest = divmod(args.pages, args.chunk_pages)
+    assert sorted(chunked.calls) == sorted([args.chunk_pages] * full_chunks + ([rest] if rest else [])), chunked.calls
+    assert [number for number, _ in pages] == list(range(1, args.pages + 1)), "pages are not numbered 1..n in order"
+    assert pages == expected_pages, "chunked pages do not carry the same text as the whole-document analysis"
+    assert [number for number, _ in tables] == list(range(1, args.pages + 1)), "tables were not rebased onto their pages"
+    # Each stub table names its page within the chunk it was analyzed in
+    assert all(int(local) == (number - 1) % args.chunk_pages + 1 for number, local in tables)
+    print(f"analyze_document: {len(chunked.calls)} chunks of <= {args.chunk_pages} pages, "
+          f"{len(pages)} pages and {len(tables)} tables rebased")
+
+    storage = MemoryStorage()
+    set_storage(storage)
+    client = StubDocumentAnalysisClient()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = process_pdf_with_enterprise(io.BytesIO(pdf_bytes), "check_chunks", "chunks.pdf", client=client)
+    assert result['urls']['markdown'].endswith("check_chunks/chunks.md")
+    markdown = storage.get("pdf_sources/extracted_markdown/check_chunks/chunks.md").decode("utf-8")
+    positions = [markdown.index(f"## Page {number}\n") for number in range(1, args.pages + 1)]
+    assert positions == sorted(positions), "page sections are out of order"
+    for number, lines in expected_pages:
+        section = markdown[positions[number - 1]:positions[number] if number < args.pages else len(markdown)]
+        assert all(line in section for line in lines), f"page {number} lost its text"
+    print(f"process_pdf_with_enterprise: {len(client.calls)} chunks, {args.pages} page sections in order")
+
+    print("Enterprise chunking checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Offline check of the S3 storage path against moto's in-process S3 mock.
+
+Runs the default AWS configuration (no AWS_S3_ENDPOINT_URL) end to end: object URLs
+must be virtual-hosted, streamed image uploads must be counted in full, /process-pdf/
+must store and process a PDF, a presigned upload must be processable through
+/process-pdf-by-key/, and a processed output directory must upload concurrently
+(multipart for large files) with per-file transfer records. Pass --endpoint-url to run the same checks with the
+S3-compatible endpoint override instead. Needs moto (pip install moto), which is not
+a runtime dependency.
+
+Usage:
+    python -m benchmarks.check_s3_storage [--endpoint-url http://127.0.0.1:9000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint-url", help="check the S3-compatible endpoint override with this URL")
+    args = parser.parse_args()
+
+    os.environ.update(
+        STORAGE_BACKEND="s3",
+        AWS_ACCESS_KEY_ID="check",
+        AWS_SECRET_ACCESS_KEY="check",
+        AWS_REGION="us-east-1",
+        AWS_S3_BUCKET_NAME="extraction-check",
+        PAGE_CACHE_ENABLED="false",
+        SEARCH_INDEX_ENABLED="false",
+        # Small enough that the directory upload below goes multipart for its large file
+        S3_MULTIPART_THRESHOLD=str(5 * 1024 * 1024),
+        S3_MULTIPART_CHUNKSIZE=str(5 * 1024 * 1024),
+    )
+    if args.endpoint_url:
+        os.environ["AWS_S3_ENDPOINT_URL"] = args.endpoint_url
+    else:
+        os.environ.pop("AWS_S3_ENDPOINT_URL", None)
+
+    try:
+        from moto import mock_aws
+    except ImportError:
+        sys.exit("moto is not installed; pip install moto to run this check")
+
+    import requests
+    from fastapi.testclient import TestClient
+    from benchmarks.corpus import text_heavy_pdf
+
+    with mock_aws():
+        from backend.utils.s3 import get_s3_client
+        from backend.utils.storage import S3Storage, set_storage
+        from backend import main as api
+
+        get_s3_client().create_bucket(Bucket="extraction-check")
+        storage = S3Storage()
+        set_storage(storage)
+
+        expected = (
+            f"{args.endpoint_url.rstrip('/')}/extraction-check/check/object.txt" if args.endpoint_url
+            else "https://extraction-check.s3.us-east-1.amazonaws.com/check/object.txt"
+        )
+        url = storage.put("check/object.txt", b"ok", "text/plain")
+        assert url == expected, f"unexpected object URL {url}"
+        assert storage.get("check/object.txt") == b"ok"
+        print(f"object URL: {url}")
+
+        # The S3 transfer may close the file object; its size must be taken beforehand
+        from backend.utils.metrics import BYTES_UPLOADED
+        from backend.utils.storage import upload_image_fileobj
+        counted = BYTES_UPLOADED.labels("image")._value.get()
+        upload_image_fileobj(io.BytesIO(b"\x89PNG" + bytes(1000)), "check/image.png", "png")
+        uploaded = BYTES_UPLOADED.labels("image")._value.get() - counted
+        assert uploaded == 1004, f"counted {uploaded} image bytes for a 1004-byte upload"
+        print(f"image upload counted {int(uploaded)} bytes")
+
+        # Directory upload through the transfer manager, one file large enough for multipart
+        from backend.utils.s3 import upload_processed_content_to_s3
+        files = {
+            "raw/report.pdf": b"%PDF-1.4 check",
+            "extracted_markdown/report.md": b"# Report",
+            "extracted_images/page1.png": random.Random(7).randbytes(6 * 1024 * 1024),
+            "notes/skipped.txt": b"not uploaded",
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for relative, body in files.items():
+                path = Path(directory) / relative
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(body)
+            transfers = {}
+            urls = upload_processed_content_to_s3(directory, "check_dir", "pdf", transfers=transfers)
+        assert set(urls) == {"raw_file", "extracted_markdown/report.md", "extracted_images/page1.png"}, urls
+        assert set(transfers) == set(urls)
+        for label, transfer in transfers.items():
+            relative = "raw/report.pdf" if label == "raw_file" else label
+            assert transfer["bytes"] == len(files[relative]) and transfer["seconds"] >= 0, transfer
+            assert urls[label].endswith(transfer["key"])
+            assert storage.get(transfer["key"]) == files[relative], f"{transfer['key']} differs"
+        etag = get_s3_client().head_object(Bucket="extraction-check", Key=transfers["extracted_images/page1.png"]["key"])["ETag"]
+        assert "-" in etag, "large file was not uploaded multipart"
+        parts = etag.strip('"').split("-")[1]
+        print(f"directory upload: {len(urls)} files, {sum(t['bytes'] for t in transfers.values())} bytes, large file in {parts} parts")
+
+        doc = text_heavy_pdf(random.Random(7), pages=2)
+        pdf = doc.tobytes()
+        doc.close()
+        client = TestClient(api.app)
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = client.post("/process-pdf/?category=open%20source", files={"file": ("check.pdf", pdf, "application/pdf")})
+        assert response.status_code == 200, response.text
+        print(f"/process-pdf/: {response.status_code}, markdown at {response.json()['data']['urls']['markdown']}")
+
+        upload = client.post("/uploads/presign", json={"filename": "direct.pdf", "size": len(pdf)}).json()
+        put = requests.put(upload["url"], data=pdf, headers=upload["headers"])
+        assert put.status_code == 200, put.text
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = client.post("/process-pdf-by-key/", json={"key": upload["key"], "category": "open source"})
+        assert response.status_code == 200, response.text
+        print(f"/process-pdf-by-key/: {response.status_code} for {upload['key']}")
+
+    print("S3 storage checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Deterministic synthetic corpus for the benchmarks.
+
+Every document is generated from a fixed seed with PyMuPDF (PDFs) or plain string
+templates (HTML), so two runs on the same code produce byte-identical inputs and
+their results can be compared.
+
+Usage:
+    python -m benchmarks.corpus --out benchmarks/.corpus
+"""
+import argparse
+import json
+import random
+from pathlib import Path
+
+import fitz
+
+WORDS = (
+    "analysis revenue quarter growth model table figure market segment customer "
+    "storage pipeline latency throughput document extraction report summary region "
+    "forecast margin operating cost product service platform data result"
+).split()
+
+PAGE_RECT = fitz.paper_rect("letter")
+
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def paragraph(rng, sentences=6):
+    """Filler text of the given number of sentences drawn from WORDS."""
+    return " ".join(_sentence(rng, rng.randint(8, 16)) for _ in range(sentences))
+
+
+def noise_png(rng, width, height):
+    """A small noisy RGB image; noise keeps it from compressing to nothing."""
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), False)
+    pixmap.set_rect(pixmap.irect, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    for _ in range(width * height // 8):
+        pixmap.set_pixel(rng.randrange(width), rng.randrange(height), (rng.randrange(256),) * 3)
+    return pixmap.tobytes("png")
+
+
+def _draw_table(page, rng, top, rows, columns):
+    """Draw a ruled table so find_tables() detects it."""
+    left, right = 54, PAGE_RECT.width - 54
+    row_height = 16
+    col_width = (right - left) / columns
+    shape = page.new_shape()
+    for r in range(rows + 1):
+        y = top + r * row_height
+        shape.draw_line((left, y), (right, y))
+    for c in range(columns + 1):
+        x = left + c * col_width
+        shape.draw_line((x, top), (x, top + rows * row_height))
+    shape.finish(color=(0, 0, 0), width=0.5)
+    shape.commit()
+    for r in range(rows):
+        for c in range(columns):
+            text = f"H{c + 1}" if r == 0 else f"{rng.choice(WORDS)} {rng.randint(0, 9999)}"
+            page.insert_text((left + c * col_width + 3, top + r * row_height + 12), text, fontsize=8)
+    return top + rows * row_height
+
+
+def text_heavy_pdf(rng, pages=20):
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=PAGE_RECT.width, height=PAGE_RECT.height)
+        page.insert_textbox(PAGE_RECT + (54, 54, -54, -54), "\n\n".join(paragraph(rng) for _ in range(6)), fontsize=9)
+    return doc
+
+
+def table_heavy_pdf(rng, pages=10):
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=PAGE_RECT.width, height=PAGE_RECT.height)
+        top = 54
+        for _ in range(3):
+            top = _draw_table(page, rng, top, rows=12, columns=6) + 24
+    return doc
+
+
+def image_heavy_pdf(rng, pages=10, images_per_page=6):
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=PAGE_RECT.width, height=PAGE_RECT.height)
+        for i in range(images_per_page):
+            x, y = 54 + (i % 2) * 260, 54 + (i // 2) * 230
+            page.insert_image(fitz.Rect(x, y, x + 240, y + 210), stream=noise_png(rng, 160, 140))
+    return doc
+
+
+def many_page_pdf(rng, pages=200):
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=PAGE_RECT.width, height=PAGE_RECT.height)
+        page.insert_textbox(PAGE_RECT + (54, 54, -54, -54), paragraph(rng, 4), fontsize=10)
+    return doc
+
+
+PDF_BUILDERS = {
+    "text_heavy": text_heavy_pdf,
+    "table_heavy": table_heavy_pdf,
+    "image_heavy": image_heavy_pdf,
+    "many_pages": many_page_pdf,
+}
+
+
+def large_html(rng, sections=150, images=40):
+    parts = ["<html><head><title>Synthetic benchmark page</title></head><body>"]
+    for s in range(sections):
+        parts.append(f"<h2>Section {s + 1}</h2>")
+        parts.append(f"<div><p>{paragraph(rng)}</p><span>{_sentence(rng)}</span></div>")
+        if s % 10 == 0:
+            rows = "".join(
+                "<tr>" + "".join(f"<td>{rng.choice(WORDS)} {rng.randint(0, 999)}</td>" for _ in range(5)) + "</tr>"
+                for _ in range(10)
+            )
+            parts.append(f"<table><thead><tr>{''.join(f'<th>C{c}</th>' for c in range(5))}</tr></thead><tbody>{rows}</tbody></table>")
+        if s < images:
+            parts.append(f'<img src="images/img_{s % images}.png" alt="Figure {s}">')
+    parts.append("</body></html>")
+    return "\n".join(parts)
+
+
+def generate_corpus(out_dir, seed=7):
+    """
+    Write the corpus under out_dir and return its manifest.
+
+    Layout: pdf/<name>.pdf, html/<name>.html and html/images/*.png. The manifest
+    (also written to manifest.json) records page counts and sizes.
+    """
+    out_dir = Path(out_dir)
+    (out_dir / "pdf").mkdir(parents=True, exist_ok=True)
+    (out_dir / "html" / "images").mkdir(parents=True, exist_ok=True)
+    manifest = {"seed": seed, "pdf": {}, "html": {}}
+
+    for offset, (name, build) in enumerate(PDF_BUILDERS.items()):
+        doc = build(random.Random(seed + offset))
+        path = out_dir / "pdf" / f"{name}.pdf"
+        # Fixed metadata keeps the output byte-identical between runs
+        doc.set_metadata({"creationDate": "D:20240101000000", "modDate": "D:20240101000000"})
+        doc.save(path, garbage=3, deflate=True, no_new_id=True)
+        manifest["pdf"][name] = {"path": str(path.relative_to(out_dir)), "pages": len(doc), "bytes": path.stat().st_size}
+        doc.close()
+
+    rng = random.Random(seed + 100)
+    for i in range(40):
+        (out_dir / "html" / "images" / f"img_{i}.png").write_bytes(noise_png(rng, 120, 90))
+    html_path = out_dir / "html" / "large_page.html"
+    html_path.write_text(large_html(rng), encoding="utf-8")
+    manifest["html"]["large_page"] = {"path": str(html_path.relative_to(out_dir)), "pages": 1, "bytes": html_path.stat().st_size}
+
+    (out_dir / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="benchmarks/.corpus")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    print(json.dumps(generate_corpus(args.out, args.seed), indent=2))
+
+
+if __name__ == "__main__":
+    main()
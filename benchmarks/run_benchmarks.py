@@ -0,0 +1,227 @@
+"""
+Offline benchmark suite for the PDF and website processors.
+
+Generates the synthetic corpus (benchmarks/corpus.py), serves the HTML pages from a
+local HTTP server, and runs each processor against MemoryStorage, so no network or
+cloud credentials are involved; the enterprise processor talks to a stub Azure client
+(benchmarks/stub_azure.py) with a configurable simulated latency. Every processor runs in its own subprocess so its
+peak RSS is measured in isolation.
+
+Reports pages/sec, p50/p95 latency and peak RSS per processor and writes the results
+as JSON. Pass --compare with an earlier results file to print the change per metric.
+
+Usage:
+    python -m benchmarks.run_benchmarks [--processors pdf_open_source,web_open_source]
+        [--repeat 3] [--azure-latency 0.5] [--output benchmarks/results/latest.json]
+        [--compare old.json]
+"""
+import argparse
+import contextlib
+import functools
+import http.server
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.corpus import generate_corpus
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# name -> (module, function, input kind)
+PROCESSORS = {
+    "pdf_open_source": ("backend.utils.pdf_processor_open_source", "process_pdf_with_open_source", "pdf"),
+    "pdf_docling": ("backend.utils.pdf_processor_docling", "process_pdf_with_docling", "pdf"),
+    "pdf_enterprise": ("backend.utils.pdf_processor_enterprise", "process_pdf_with_enterprise", "pdf"),
+    "web_open_source": ("backend.utils.web_processor_open_source", "scrape_website", "html"),
+    "web_docling": ("backend.utils.web_processor_docling", "process_html_with_docling", "html"),
+}
+
+# Metrics where a larger value is better; everything else is better when smaller
+HIGHER_IS_BETTER = {"pages_per_second"}
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile; fine for the handful of samples a benchmark collects."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+@contextlib.contextmanager
+def serve_directory(directory):
+    """Serve a directory over HTTP on a free localhost port for the duration of the block."""
+    handler = functools.partial(QuietHandler, directory=str(directory))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def run_processor(name, corpus_dir, manifest, base_url, repeat, verbose, azure_latency=0.0):
+    """Subprocess entry point: run one processor over its part of the corpus."""
+    os.environ["STORAGE_BACKEND"] = "memory"
+    # Repeated runs of one file would otherwise be served from the previous run's pages
+    os.environ["PAGE_CACHE_ENABLED"] = "false"
+    # Benchmark documents are not worth indexing, and the index would be written to disk
+    os.environ["SEARCH_INDEX_ENABLED"] = "false"
+    from backend.utils.storage import MemoryStorage, set_storage
+    storage = MemoryStorage()
+    set_storage(storage)
+
+    module_name, function_name, kind = PROCESSORS[name]
+    try:
+        processor = getattr(importlib.import_module(module_name), function_name)
+    except ImportError as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+    if name == "pdf_enterprise":
+        from benchmarks.stub_azure import StubDocumentAnalysisClient
+        processor = functools.partial(processor, client=StubDocumentAnalysisClient(azure_latency))
+    rss_after_import = peak_rss_mb()
+
+    documents = {}
+    latencies = []
+    total_pages = 0
+    errors = []
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+
+    with output:
+        for doc_name, entry in manifest[kind].items():
+            path = Path(corpus_dir) / entry["path"]
+            samples = []
+            for run in range(repeat):
+                started = time.perf_counter()
+                try:
+                    if kind == "pdf":
+                        with open(path, "rb") as f:
+                            processor(io.BytesIO(f.read()), f"bench_{doc_name}_{run}", path.name)
+                    else:
+                        processor(f"{base_url}/{entry['path']}")
+                except Exception as e:
+                    errors.append(f"{doc_name}: {e}")
+                    continue
+                samples.append(time.perf_counter() - started)
+            if samples:
+                documents[doc_name] = {
+                    "pages": entry["pages"],
+                    "p50_seconds": round(percentile(samples, 50), 4),
+                    "pages_per_second": round(entry["pages"] / statistics.median(samples), 2),
+                }
+                latencies.extend(samples)
+                total_pages += entry["pages"] * len(samples)
+
+    if not latencies:
+        return {"errors": errors}
+
+    return {
+        "documents": documents,
+        "runs": len(latencies),
+        "pages_per_second": round(total_pages / sum(latencies), 2),
+        "p50_seconds": round(percentile(latencies, 50), 4),
+        "p95_seconds": round(percentile(latencies, 95), 4),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_after_import_mb": round(rss_after_import, 1),
+        "stored_objects": len(storage.objects),
+        "stored_bytes": sum(len(body) for body in storage.objects.values()),
+        "errors": errors,
+    }
+
+
+def compare(current, previous):
+    """Print the relative change of each headline metric against an earlier run."""
+    print(f"\nComparison with {previous.get('timestamp', 'previous run')}:")
+    for name, result in current["processors"].items():
+        old = previous.get("processors", {}).get(name)
+        if not old or "pages_per_second" not in result or "pages_per_second" not in old:
+            continue
+        changes = []
+        for metric in ("pages_per_second", "p50_seconds", "p95_seconds", "peak_rss_mb"):
+            if old.get(metric):
+                delta = (result[metric] - old[metric]) / old[metric]
+                better = delta > 0 if metric in HIGHER_IS_BETTER else delta < 0
+                marker = "+" if better else ("-" if delta else " ")
+                changes.append(f"{metric} {delta:+.1%}{marker}")
+        print(f"  {name:16s} " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processors", default=",".join(PROCESSORS), help="comma-separated subset of " + ", ".join(PROCESSORS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--azure-latency", type=float, default=0.5, help="simulated seconds per stub Azure analysis")
+    parser.add_argument("--corpus", default=str(REPO_ROOT / "benchmarks" / ".corpus"))
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default=str(REPO_ROOT / "benchmarks" / "results" / "latest.json"))
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show processor output")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.processors.split(",") if name.strip()]
+    unknown = set(names) - set(PROCESSORS)
+    if unknown:
+        parser.error(f"unknown processors: {', '.join(sorted(unknown))}")
+
+    manifest = generate_corpus(args.corpus, args.seed)
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "processors": {},
+    }
+
+    # Spawned workers start clean, so peak RSS belongs to a single processor
+    context = multiprocessing.get_context("spawn")
+    with serve_directory(Path(args.corpus) / "html") as base_url:
+        # The server root is the html directory, so drop that prefix from the page paths
+        manifest_for_workers = {
+            **manifest,
+            "html": {name: {**entry, "path": Path(entry["path"]).relative_to("html").as_posix()} for name, entry in manifest["html"].items()},
+        }
+        for name in names:
+            with context.Pool(1) as pool:
+                result = pool.apply(run_processor, (name, args.corpus, manifest_for_workers, base_url, args.repeat, args.verbose, args.azure_latency))
+            results["processors"][name] = result
+            if "skipped" in result:
+                print(f"{name:16s} skipped ({result['skipped']})")
+            elif "pages_per_second" not in result:
+                print(f"{name:16s} failed: {result['errors'][:3]}")
+            else:
+                print(f"{name:16s} {result['pages_per_second']:8.2f} pages/s  p50 {result['p50_seconds']:.3f}s  "
+                      f"p95 {result['p95_seconds']:.3f}s  peak RSS {result['peak_rss_mb']:.0f} MB"
+                      + (f"  ({len(result['errors'])} errors)" if result["errors"] else ""))
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(results, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Offline stand-in for Azure Form Recognizer's DocumentAnalysisClient.
+
+StubDocumentAnalysisClient answers begin_analyze_document() from the PDF itself: every
+page gets its PyMuPDF text lines (with polygons in inches, as Azure reports them) and a
+one-row table naming the page. Page numbers are local to the document it was sent, like
+Azure's, so callers that split documents have to rebase them. An optional latency per
+analysis stands in for the remote round trip.
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+import fitz
+
+
+class StubPoller:
+    def __init__(self, result, latency):
+        self._result = result
+        self._latency = latency
+
+    def result(self):
+        if self._latency:
+            time.sleep(self._latency)
+        return self._result
+
+
+class StubDocumentAnalysisClient:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        # Page count of every analyzed document, in submission order
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def begin_analyze_document(self, model_id, document, **kwargs):
+        doc = fitz.open(stream=document, filetype="pdf")
+        try:
+            pages, tables = [], []
+            for index, page in enumerate(doc):
+                page_number = index + 1
+                lines = [
+                    SimpleNamespace(
+                        content=" ".join(span["text"] for span in line["spans"]).strip(),
+                        polygon=[SimpleNamespace(x=x / 72, y=y / 72) for x, y in (line["bbox"][:2], line["bbox"][2:])]
+                    )
+                    for block in page.get_text("dict")["blocks"] if block.get("type") == 0
+                    for line in block["lines"]
+                ]
+                pages.append(SimpleNamespace(
+                    page_number=page_number,
+                    width=round(page.rect.width / 72, 4),
+                    height=round(page.rect.height / 72, 4),
+                    unit="inch",
+                    lines=[line for line in lines if line.content]
+                ))
+                tables.append(SimpleNamespace(
+                    row_count=1,
+                    column_count=2,
+                    cells=[
+                        SimpleNamespace(row_index=0, column_index=0, content="source page"),
+                        SimpleNamespace(row_index=0, column_index=1, content=str(page_number)),
+                    ],
+                    bounding_regions=[SimpleNamespace(page_number=page_number)]
+                ))
+        finally:
+            doc.close()
+        with self._lock:
+            self.calls.append(len(pages))
+        return StubPoller(SimpleNamespace(pages=pages, tables=tables), self.latency)